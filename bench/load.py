@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Compare whole-document and streaming loads of a synthetic CDG into networkx
+and compact graphs.
+
+Usage:
+    load.py [--functions=<n>] [--blocks=<n>] [--values=<n>]
+
+Options:
+    --functions=<n>     Number of functions to generate [default: 2000]
+    --blocks=<n>        Blocks per function [default: 8]
+    --values=<n>        Values per block [default: 8]
+'''
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cdg
+import cdg.synthetic
+import docopt
+
+
+def measure(filename, streaming, compact):
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    with open(filename, 'rb') as f:
+        graph = cdg.load(f, filename, streaming=streaming, compact=compact)
+
+    elapsed = time.perf_counter() - start
+    (retained, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (elapsed, peak, retained, graph.dimensions())
+
+
+args = docopt.docopt(__doc__)
+document = cdg.synthetic.generate(
+    int(args['--functions']), int(args['--blocks']),
+    int(args['--values']))
+
+with tempfile.TemporaryDirectory() as tmp:
+    import json
+    import ubjson
+
+    files = {
+        'cdg': os.path.join(tmp, 'bench.cdg'),
+        'json': os.path.join(tmp, 'bench.json'),
+    }
+
+    with open(files['cdg'], 'wb') as f:
+        ubjson.dump(document, f)
+
+    with open(files['json'], 'w') as f:
+        json.dump(document, f)
+
+    del document
+
+    print('%-6s %-10s %-8s %10s %12s %12s %10s %10s' % (
+        'format', 'mode', 'backend', 'time (s)', 'peak (MiB)', 'graph (MiB)',
+        'nodes', 'edges'))
+
+    for (fmt, filename) in sorted(files.items()):
+        for streaming in (False, True):
+            for compact in (False, True):
+                (elapsed, peak, retained, (nodes, edges)) = measure(
+                    filename, streaming, compact)
+
+                print('%-6s %-10s %-8s %10.2f %12.1f %12.1f %10d %10d' % (
+                    fmt, 'streaming' if streaming else 'document',
+                    'compact' if compact else 'networkx',
+                    elapsed, peak / (1 << 20), retained / (1 << 20),
+                    nodes, edges))
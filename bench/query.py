@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Time calls-to and flows-from traversals on a large synthetic CDG.
+
+Usage:
+    query.py [--functions=<n>] [--blocks=<n>] [--values=<n>] [--legacy]
+
+Options:
+    --functions=<n>     Number of functions to generate [default: 7000]
+    --blocks=<n>        Blocks per function [default: 8]
+    --values=<n>        Values per block [default: 8]
+    --legacy            Also time the original per-node set-union traversal
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cdg
+import cdg.query
+import cdg.synthetic
+import docopt
+
+
+def legacy_neighbours(graph, starting_nodes, select_fn, depth_limit=None):
+    '''
+    The traversal that cdg.query.transitive_neighbours used to perform.
+    '''
+
+    result = set()
+    seen = set()
+    working_set = set(starting_nodes).intersection(graph.nodes)
+
+    depth = 0
+    while True:
+        next_gen = set()
+
+        for node in working_set:
+            result.add(node)
+            seen.add(node)
+
+            selected = set(select_fn(node))
+            if seen.intersection(selected) == selected:
+                continue
+
+            seen = seen.union(selected)
+            result = result.union(selected)
+            next_gen = next_gen.union(selected)
+
+        working_set = next_gen
+        if len(working_set) == 0:
+            break
+
+        if depth_limit:
+            depth += 1
+            if depth >= depth_limit:
+                break
+
+    return result
+
+
+def legacy_pred(graph, node, attribute_predicate):
+    nodes = set(graph.predecessors(node))
+
+    return (
+        src for (src, dest, attrs) in graph.edges(nodes, data=True)
+        if dest == node and attribute_predicate(attrs)
+    )
+
+
+def legacy_succ(graph, node, attribute_predicate):
+    return (
+        dest for (src, dest, attrs) in graph.edges(node, data=True)
+        if src == node and attribute_predicate(attrs)
+    )
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start, len(result))
+
+
+args = docopt.docopt(__doc__)
+document = cdg.synthetic.generate(
+    int(args['--functions']), int(args['--blocks']),
+    int(args['--values']))
+
+graphs = {
+    'networkx': cdg.build('synthetic', document['functions'].items()),
+    'compact': cdg.build('synthetic', document['functions'].items(), True),
+}
+del document
+
+seeds = ['fn0::bb0::v0', 'fn1::bb0::v1', 'fn2::bb1::v0']
+calls = cdg.EdgeKind.mask(cdg.EdgeKind.Call)
+is_call = lambda attrs: attrs['kind'] == cdg.EdgeKind.Call
+
+queries = [
+    ('calls-to', calls, True, legacy_pred, is_call),
+    ('flows-from', cdg.EdgeKind.All, False, legacy_succ, lambda _: True),
+]
+
+print('Graph: %d nodes, %d edges' % graphs['networkx'].dimensions())
+print('%-10s %-10s %-8s %10s %10s' % (
+    'query', 'backend', 'engine', 'time (s)', 'nodes'))
+
+for (name, kinds, reverse, legacy_select, predicate) in queries:
+    for (backend, graph) in sorted(graphs.items()):
+        (elapsed, count) = timed(lambda: cdg.query.reachable(
+            graph, seeds, kinds, reverse))
+        print('%-10s %-10s %-8s %10.3f %10d' % (
+            name, backend, 'frontier', elapsed, count))
+
+        if args['--legacy']:
+            select_fn = lambda n: legacy_select(graph, n, predicate)
+            (elapsed, count) = timed(lambda: legacy_neighbours(
+                graph, seeds, select_fn))
+            print('%-10s %-10s %-8s %10.3f %10d' % (
+                name, backend, 'legacy', elapsed, count))
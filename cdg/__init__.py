@@ -13,13 +13,29 @@
 # limitations under the License.
 
 import cdg.graphviz
+import cdg.names
+import cdg.stats
 import collections
 import networkx
+import sys
 
 
 class EdgeKind:
     Call, Operand, Memory, Meta = range(4)
 
+    # Mask of every kind, as accepted by cdg.query.reachable
+    All = (1 << 4) - 1
+
+    @classmethod
+    def mask(cls, *kinds):
+        '''
+        Combine EdgeKind values into a bit mask.
+        '''
+        m = 0
+        for k in kinds:
+            m |= 1 << k
+        return m
+
     @classmethod
     def from_str(cls, name):
         if name == 'call':
@@ -42,8 +58,182 @@ class EdgeKind:
             return 'operand'
 
 
+class Graph(networkx.DiGraph):
+    '''
+    A networkx.DiGraph that counts changes to its structure, so that data
+    derived from it (e.g., a cdg.reach index) can tell when it is stale.
+
+    After `group_kinds`, the graph also keeps its edges grouped by kind (see
+    `kind_adjacency`), updating the groups as edges are added and removed.
+
+    Changes made directly to attribute dicts are not counted (or grouped).
+    '''
+
+    version = 0
+
+    # Edges grouped by kind, in each direction (see kind_adjacency)
+    _kind_groups = None
+
+    def add_node(self, *args, **kwargs):
+        self.version += 1
+        networkx.DiGraph.add_node(self, *args, **kwargs)
+
+    def add_nodes_from(self, *args, **kwargs):
+        self.version += 1
+        networkx.DiGraph.add_nodes_from(self, *args, **kwargs)
+
+    def remove_node(self, n):
+        self.version += 1
+        if self._kind_groups is not None and n in self:
+            self._ungroup_node(n)
+        networkx.DiGraph.remove_node(self, n)
+
+    def remove_nodes_from(self, nodes):
+        self.version += 1
+        if self._kind_groups is not None:
+            nodes = list(nodes)
+            for n in nodes:
+                if n in self:
+                    self._ungroup_node(n)
+        networkx.DiGraph.remove_nodes_from(self, nodes)
+
+    def add_edge(self, u, v, **attr):
+        self.version += 1
+        if self._kind_groups is None:
+            networkx.DiGraph.add_edge(self, u, v, **attr)
+            return
+
+        old = self._group_of(u, v)
+        networkx.DiGraph.add_edge(self, u, v, **attr)
+        self._regroup(u, v, old)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        self.version += 1
+        if self._kind_groups is None:
+            networkx.DiGraph.add_edges_from(self, ebunch_to_add, **attr)
+            return
+
+        edges = list(ebunch_to_add)
+        old = [(e[0], e[1], self._group_of(e[0], e[1])) for e in edges]
+        networkx.DiGraph.add_edges_from(self, edges, **attr)
+        for (u, v, kind) in old:
+            self._regroup(u, v, kind)
+
+    def remove_edge(self, u, v):
+        self.version += 1
+        kind = self._group_of(u, v)
+        networkx.DiGraph.remove_edge(self, u, v)
+        if kind is not None:
+            self._ungroup(u, v, kind)
+
+    def remove_edges_from(self, ebunch):
+        self.version += 1
+        if self._kind_groups is None:
+            networkx.DiGraph.remove_edges_from(self, ebunch)
+            return
+
+        edges = list(ebunch)
+        old = [(e[0], e[1], self._group_of(e[0], e[1])) for e in edges]
+        networkx.DiGraph.remove_edges_from(self, edges)
+        for (u, v, kind) in old:
+            if kind is not None:
+                self._ungroup(u, v, kind)
+
+    def clear(self):
+        self.version += 1
+        networkx.DiGraph.clear(self)
+        if self._kind_groups is not None:
+            self.group_kinds()
+
+    def clear_edges(self):
+        self.version += 1
+        networkx.DiGraph.clear_edges(self)
+        if self._kind_groups is not None:
+            self.group_kinds()
+
+    def group_kinds(self):
+        '''
+        Group the graph's edges by kind, and keep them grouped from now on.
+
+        Grouping the edges costs about as much as searching the whole graph,
+        so `build` and `load` do it once, for graphs that will be searched.
+        '''
+
+        count = EdgeKind.All.bit_length()
+        groups = ([{} for _ in range(count)], [{} for _ in range(count)])
+        (forward, reverse) = groups
+
+        for (u, neighbours) in self._succ.items():
+            for (v, attrs) in neighbours.items():
+                kind = attrs.get('kind')
+                if kind is not None and kind < count:
+                    forward[kind].setdefault(u, {})[v] = None
+                    reverse[kind].setdefault(v, {})[u] = None
+
+        self._kind_groups = groups
+
+    def kind_adjacency(self, reverse=False):
+        '''
+        The graph's edges grouped by kind: a list with, for each EdgeKind, a
+        dict of each node's successors (or predecessors, if `reverse`) along
+        edges of that kind, or None if the edges aren't grouped (see
+        `group_kinds`).
+        '''
+
+        groups = self._kind_groups
+        return None if groups is None else groups[1 if reverse else 0]
+
+    def _group_of(self, u, v):
+        '''
+        The kind group that an edge is in, or None.
+        '''
+
+        if self._kind_groups is None:
+            return None
+
+        attrs = self._succ.get(u, {}).get(v)
+        kind = None if attrs is None else attrs.get('kind')
+        if kind is None or kind >= len(self._kind_groups[0]):
+            return None
+
+        return kind
+
+    def _regroup(self, u, v, old):
+        new = self._group_of(u, v)
+        if new == old:
+            return
+
+        if old is not None:
+            self._ungroup(u, v, old)
+
+        if new is not None:
+            (forward, reverse) = self._kind_groups
+            forward[new].setdefault(u, {})[v] = None
+            reverse[new].setdefault(v, {})[u] = None
+
+    def _ungroup(self, u, v, kind):
+        (forward, reverse) = self._kind_groups
+        for (group, n, m) in ((forward[kind], u, v), (reverse[kind], v, u)):
+            neighbours = group.get(n)
+            if neighbours is not None:
+                neighbours.pop(m, None)
+                if not neighbours:
+                    del group[n]
+
+    def _ungroup_node(self, n):
+        for v in self._succ[n]:
+            kind = self._group_of(n, v)
+            if kind is not None:
+                self._ungroup(n, v, kind)
+
+        for u in self._pred[n]:
+            kind = self._group_of(u, n)
+            if kind is not None:
+                self._ungroup(u, n, kind)
+
+
 def create(name):
-    graph = networkx.DiGraph(comment='Callgraph of %s' % name)
+    graph = Graph(comment='Callgraph of %s' % name)
     hot_patch(graph)
     return graph
 
@@ -52,14 +242,82 @@ def dimensions(graph):
     return (len(graph.nodes()), len(graph.edges()))
 
 
-def load(stream, filename):
+@cdg.stats.measured('load')
+def load(stream, filename, streaming=False, compact=None, cache=False):
+    '''
+    Load a CDG from a .cdg (UBJSON), .json or .yaml stream, or from a .cdgc
+    columnar snapshot.
+
+    In streaming mode, function entries are decoded and added to the graph one
+    at a time rather than decoding the entire document first. If `compact` is
+    set, the graph is built as an array-backed cdg.compact.CompactGraph rather
+    than a networkx.DiGraph.
+
+    If `cache` is set and `filename` names a file on disk, the built graph is
+    kept in (and later loaded from) the snapshot cache described in
+    cdg.cache. In streaming mode, the hashes of the file's functions are
+    recorded too, if they haven't been already (see cdg.digest).
+
+    A .cdgc file is memory-mapped rather than decoded (see cdg.snapshot), so
+    only the parts of the graph that are used get read from disk. The mapped
+    CompactGraph is returned as it is (changes to it stay in memory) unless
+    `compact` is False, in which case it is converted to a networkx graph.
+    A stream that can't be mapped (e.g., an io.BytesIO) is read instead.
+    '''
+
+    import cdg.cache
+    import cdg.compact
+    import cdg.snapshot
+
+    cdg.stats.note(filename=filename)
+
+    if filename.endswith('.cdgc'):
+        graph = cdg.snapshot.open_mapped(stream)
+        if compact is not False:
+            return graph
+
+        graph = cdg.compact.to_networkx(graph)
+        graph.group_kinds()
+        return graph
+
+    if cache:
+        graph = cdg.cache.lookup(filename, compact)
+        if graph is not None:
+            cdg.stats.note(cached=True)
+            if not compact:
+                graph.group_kinds()
+            return graph
+
+    if streaming:
+        import cdg.digest
+        import cdg.stream
+
+        functions = cdg.digest.reading(stream, filename) if cache \
+            else cdg.stream.functions(stream, filename)
+    else:
+        functions = decode(stream, filename)['functions'].items()
+
+    graph = build(filename, functions, compact)
+
+    if cache:
+        cdg.cache.store(filename, graph)
+
+    return graph
+
+
+@cdg.stats.measured('decode')
+def decode(stream, filename):
+    '''
+    Decode an entire CDG document, using the format implied by the filename.
+    '''
+
     if filename.endswith('.cdg'):
         import ubjson
-        cg = ubjson.load(stream)
+        return ubjson.load(stream)
 
     elif filename.endswith('.json'):
         import json
-        cg = json.load(stream)
+        return json.load(stream)
 
     elif filename.endswith('.yaml'):
         import yaml
@@ -69,64 +327,249 @@ def load(stream, filename):
         except ImportError:
             from yaml import Loader
 
-        cg = yaml.load(stream, Loader=Loader)
+        return yaml.load(stream, Loader=Loader)
 
     else:
         raise ValueError('Unhandled file type: %s' % filename)
 
-    graph = create(filename)
 
-    fns = cg['functions']
-    for (fn_name, props) in fns.items():
-        graph.add_node(fn_name, children=set())
+@cdg.stats.measured('build')
+def build(name, functions, compact=False):
+    '''
+    Build a graph from an iterable of (function name, properties) pairs.
 
-        if 'attributes' in props:
-            graph.node[fn_name].update(props['attributes'])
+    Calls to functions that have not been seen yet are resolved once all of
+    the functions have been added, so the iterable may be a generator that
+    discards each entry after it has been consumed.
+    '''
 
-        if 'arguments' in props:
-            arguments = props['arguments']
-            if arguments:
-                for (name, attrs) in props['arguments'].items():
-                    graph.add_node(name, parent=fn_name, **attrs)
-                    graph.nodes[fn_name]['children'].add(name)
+    if compact:
+        import cdg.compact
+        graph = cdg.compact.Builder(name)
+    else:
+        graph = create(name)
 
-        if 'blocks' in props:
-            for (block_name, values) in props['blocks'].items():
-                graph.add_node(block_name, parent=fn_name, children=set())
-                graph.nodes[fn_name]['children'].add(block_name)
-                graph.nodes[block_name]['children'] = set(values)
+    # Call targets (argument names, or None) of each function seen so far
+    targets = {}
+    pending = []
 
-                for (value_name, value_attrs) in values.items():
-                    graph.add_node(value_name, parent=block_name, **value_attrs)
+    for (fn_name, props) in functions:
+        calls = add_function(graph, fn_name, props)
+        targets[fn_name] = call_targets(props)
 
-        if 'calls' in props:
-            calls = props['calls']
-            if calls:
-                for call in calls:
-                    source = call['from']
-                    dest = call['to']
+        for call in calls:
+            source = call['from']
+            dest = call['to']
 
-                    target = fns[dest] if dest in fns else None
-                    if target and 'arguments' in target:
-                        for arg in target['arguments']:
-                            graph.add_edge(source, arg, kind = EdgeKind.Call)
+            attrs = edge_attributes(call)
 
-                    else:
-                        graph.add_edge(source, dest, kind = EdgeKind.Call)
+            if dest in targets:
+                add_call(graph, source, dest, targets[dest], attrs)
+            else:
+                pending.append((source, dest, attrs))
 
-        if 'flows' in props:
-            flows = props['flows']
-            if flows:
-                for flow in flows:
-                    source = flow['from']
-                    dest = flow['to']
-                    kind = EdgeKind.from_str(flow['kind'])
+    for (source, dest, attrs) in pending:
+        add_call(graph, source, dest, targets.get(dest), attrs)
 
-                    graph.add_edge(source, dest, kind=kind)
+    if compact:
+        return graph.finish()
 
+    graph.group_kinds()
     return graph
 
 
+def patch(graph, functions):
+    '''
+    Replace some functions of a graph, in place.
+
+    `functions` is an iterable of (function name, properties) pairs in the
+    schema that `build` reads. Each function's arguments, blocks, calls and
+    flows replace any that the graph already has, and calls into a replaced
+    function are rewired to its new arguments. Other functions are left
+    untouched, as are edges from them into the replaced functions' nodes
+    (if those nodes still exist).
+
+    Returns the names of every node that was added, removed or rewired, so
+    that callers can update any data derived from that region of the graph.
+    Data that tracks the graph's version (e.g., cdg.reach indexes) is
+    invalidated automatically.
+    '''
+
+    functions = list(functions)
+    old = dict((fn_name, descendants(graph, fn_name))
+               for (fn_name, _) in functions)
+    replaced = set().union(*old.values())
+
+    # Edges from the rest of the graph into the functions being replaced:
+    # calls (to be rewired to the new arguments) and anything else
+    callers = []
+    incoming = []
+
+    for (fn_name, nodes) in old.items():
+        targets = set(graph_targets(graph, fn_name) or [fn_name])
+
+        for v in nodes:
+            for (u, data) in graph.pred[v].items():
+                if u in replaced:
+                    continue
+
+                if v in targets and data.get('kind') == EdgeKind.Call:
+                    callers.append((u, fn_name))
+                else:
+                    incoming.append((u, v, data))
+
+    graph.remove_nodes_from(replaced)
+    affected = set(replaced)
+
+    targets = {}
+    calls = []
+
+    for (fn_name, props) in functions:
+        calls += [(c['from'], c['to'], edge_attributes(c))
+                  for c in add_function(graph, fn_name, props)]
+        targets[fn_name] = call_targets(props)
+        affected.update(descendants(graph, fn_name))
+
+    calls += [(u, fn_name, {}) for (u, fn_name) in sorted(set(callers))]
+    for (source, dest, attrs) in calls:
+        t = targets[dest] if dest in targets else graph_targets(graph, dest)
+        add_call(graph, source, dest, t, attrs)
+        affected.add(source)
+
+    for (u, v, data) in incoming:
+        if v in graph:
+            graph.add_edge(u, v, **data)
+            affected.add(u)
+
+    return affected
+
+
+def descendants(graph, name):
+    '''
+    A node and (transitively) its children.
+    '''
+
+    result = set()
+    todo = [name]
+
+    while todo:
+        n = todo.pop()
+        if n in result or n not in graph:
+            continue
+
+        result.add(n)
+        todo.extend(graph.nodes[n].get('children', ()))
+
+    return result
+
+
+def graph_targets(graph, fn_name):
+    '''
+    The nodes that a call to a function in a graph should point at: its
+    arguments, or None if it has none (or isn't in the graph).
+    '''
+
+    if fn_name not in graph:
+        return None
+
+    nodes = graph.nodes
+    arguments = [
+        c for c in nodes[fn_name].get('children', ())
+        if c in nodes and 'children' not in nodes[c]
+    ]
+
+    return sorted(arguments) or None
+
+
+def add_function(graph, fn_name, props):
+    '''
+    Add a function's arguments, blocks and flows to a graph.
+
+    Returns the function's calls, which can only be resolved into edges once
+    the callee's arguments are known.
+    '''
+
+    # A name is decoded afresh wherever it appears; intern it, so that every
+    # reference to a node (e.g., in adjacency dicts) shares one string.
+    intern = sys.intern
+    fn_name = intern(fn_name)
+
+    children = set()
+    graph.add_node(fn_name, children=children,
+                   **(props.get('attributes') or {}))
+
+    if 'arguments' in props:
+        arguments = props['arguments']
+        if arguments:
+            for (name, attrs) in props['arguments'].items():
+                name = intern(name)
+                graph.add_node(name, parent=fn_name, **attrs)
+                children.add(name)
+
+    if 'blocks' in props:
+        for (block_name, values) in props['blocks'].items():
+            block_name = intern(block_name)
+            graph.add_node(block_name, parent=fn_name,
+                           children=set(intern(v) for v in values))
+            children.add(block_name)
+
+            for (value_name, value_attrs) in values.items():
+                graph.add_node(intern(value_name), parent=block_name,
+                               **value_attrs)
+
+    if 'flows' in props:
+        flows = props['flows']
+        if flows:
+            for flow in flows:
+                source = intern(flow['from'])
+                dest = intern(flow['to'])
+                kind = EdgeKind.from_str(flow.get('kind'))
+                attrs = edge_attributes(flow)
+
+                if kind is None:
+                    graph.add_edge(source, dest, **attrs)
+                else:
+                    graph.add_edge(source, dest, kind=kind, **attrs)
+
+    return props.get('calls') or []
+
+
+def call_targets(props):
+    '''
+    The nodes that a call to a function should point at: its arguments if it
+    declares any, or None if calls should point at the function itself.
+    '''
+
+    if props and 'arguments' in props:
+        return list(props['arguments'] or [])
+
+    return None
+
+
+def add_call(graph, source, dest, targets, attrs=None):
+    source = sys.intern(source)
+    attrs = attrs or {}
+
+    if targets is None:
+        graph.add_edge(source, sys.intern(dest), kind = EdgeKind.Call,
+                       **attrs)
+        return
+
+    for arg in targets:
+        graph.add_edge(source, sys.intern(arg), kind = EdgeKind.Call,
+                       **attrs)
+
+
+def edge_attributes(edge):
+    '''
+    The attributes of a call or flow in a document (e.g., the 'hops' of a
+    simplified edge), other than its ends and kind.
+    '''
+
+    return dict(
+        (k, v) for (k, v) in edge.items() if k not in ('from', 'to', 'kind'))
+
+
 def hot_patch(graph):
     '''
     Bind new instance methods for converting, saving, etc.
@@ -160,87 +603,140 @@ def new_empty_function():
     }
 
 
+@cdg.stats.measured('save')
 def save(graph, output, filename):
+    '''
+    Save a graph to a binary stream, in the format implied by the filename.
+
+    Functions are written out one at a time, so saving a graph takes little
+    more memory than the graph itself. Their hashes are recorded as they go
+    (see cdg.digest), if `output` is the file named `filename`.
+    '''
+
+    import cdg.digest
+    import cdg.snapshot
+    import cdg.stream
+
+    cdg.stats.note(filename=filename)
+
+    if filename.endswith('.cdgc'):
+        cdg.snapshot.write(graph, output)
+        return
+
+    digest = cdg.digest.Digest()
+    records = function_records(graph)
+
+    if getattr(output, 'name', None) == filename:
+        spans = filename.endswith('.cdg') and cdg.digest.seekable(output)
+        records = cdg.digest.recording(records, digest,
+                                       output if spans else None)
+
+    cdg.stream.write(output, filename, records)
+    cdg.digest.saved(output, filename, digest)
+
+
+def function_records(graph):
+    '''
+    Describe a graph as (function name, properties) pairs, as read by `build`,
+    without modifying it.
+
+    An edge belongs to the function that contains its source. Edges from
+    nodes outside of any function's hierarchy are grouped by the function
+    part of their source's name, as in `foo::bar`. A top-level node outside
+    of any hierarchy (e.g., a component from cdg.condense) is saved as a
+    function without arguments or blocks, so that its attributes are kept.
+    '''
+
     nodes = graph.nodes
-    roots = ( (k,v) for (k,v) in graph.nodes.items() if 'parent' not in v )
+    succ = graph.succ
 
-    functions = collections.defaultdict(new_empty_function)
-    for (fn_name, fn_attrs) in roots:
-        if 'children' not in fn_attrs:
+    # Edges that don't come from within a function are rare: index them by
+    # the name of the function that they should be saved with.
+    stray = collections.defaultdict(list)
+    for (n, attrs) in nodes.items():
+        if succ[n] and owner(graph, n) is None:
+            stray[cdg.names.function_part(n)].append(n)
+
+        elif 'parent' not in attrs and 'children' not in attrs \
+                and attributes(attrs):
+            stray[cdg.names.function_part(n)].append(n)
+
+    for (fn_name, fn_attrs) in nodes.items():
+        if 'parent' in fn_attrs or 'children' not in fn_attrs:
             continue
 
-        fn = functions[fn_name]
+        fn = new_empty_function()
+        fn['attributes'] = attributes(fn_attrs)
+        sources = [fn_name] + stray.pop(fn_name, [])
 
-        # Blocks have children; anything else must be an argument.
-        child_names = set(fn_attrs['children'])
-        blocks = {
-            n for n in child_names if n in nodes #and 'children' in nodes[n]
-        }
-        args = child_names.difference(blocks)
+        for child_name in fn_attrs['children']:
+            if child_name not in nodes:
+                continue
 
-        for block_name in blocks:
-            block_attrs = nodes[block_name]
-            block = fn['blocks'][block_name] = dict([
-                (k,v) for (k,v) in nodes[block_name].items()
-                if k not in ('parent', 'children')
-            ])
+            child_attrs = nodes[child_name]
+            sources.append(child_name)
 
-            for child_name in block_attrs['children']:
-                child_attrs = nodes[child_name] if child_name in nodes else {}
-                if 'parent' in child_attrs:
-                    child_attrs.pop('parent')
-                assert 'children' not in child_attrs
+            if 'children' not in child_attrs:
+                fn['arguments'][child_name] = attributes(child_attrs)
+                continue
 
-                block[child_name] = child_attrs
+            # A block is saved as a map of its values, which leaves no room
+            # for attributes of its own
+            block = fn['blocks'][child_name] = {}
+            for value_name in child_attrs['children']:
+                if value_name in nodes:
+                    block[value_name] = attributes(nodes[value_name])
+                    sources.append(value_name)
 
-        for arg_name in args:
-            #if arg_name not in nodes:
-            #    continue
+        add_edges(fn, graph, sources)
+        yield (fn_name, fn)
 
-            arg_attrs = nodes[arg_name]
-            arg_attrs.pop('parent')
-            assert 'children' not in arg_attrs
+    for (fn_name, sources) in stray.items():
+        fn = { 'calls': [], 'flows': [] }
+        if fn_name in nodes:
+            fn['attributes'] = attributes(nodes[fn_name])
 
-            fn['arguments'][arg_name] = dict(arg_attrs)
+        add_edges(fn, graph, sources)
+        yield (fn_name, fn)
 
-        functions[fn_name] = fn
 
-    for (src, dest, data) in graph.edges(data=True):
-        #if src not in nodes or dest not in nodes:
-        #    continue
+def owner(graph, name):
+    '''
+    The function whose hierarchy contains a node, or None.
+    '''
 
-        (fn_name, src_name) = src.split('::', 1)
-        kind = data['kind']
+    nodes = graph.nodes
+    attrs = nodes[name]
 
-        data = {
-            'from': src,
-            'to': dest,
-            'kind': EdgeKind.to_str(kind),
-        }
+    while 'parent' in attrs:
+        name = attrs['parent']
+        if name not in nodes:
+            return None
+        attrs = nodes[name]
 
-        if kind == EdgeKind.Call:
-            functions[fn_name]['calls'].append(data)
-        else:
-            functions[fn_name]['flows'].append(data)
+    return name if 'children' in attrs else None
 
-    if filename.endswith('.cdg'):
-        import ubjson
-        cg = ubjson.load(stream)
 
-    elif filename.endswith('.json'):
-        import json
-        cg = json.load(stream)
+def attributes(attrs):
+    return dict(
+        (k, v) for (k, v) in attrs.items() if k not in ('parent', 'children'))
 
-    elif filename.endswith('.yaml'):
-        import yaml
 
-        try:
-            from yaml import CLoader as Loader
-        except ImportError:
-            from yaml import Loader
+def add_edges(fn, graph, sources):
+    '''
+    Add the edges leaving some nodes to a function's calls and flows.
+    '''
 
-        cg = yaml.load(stream, Loader=Loader)
+    for src in sources:
+        for (dest, data) in graph.succ[src].items():
+            kind = data.get('kind')
+            edge = { 'from': src, 'to': dest }
+            if kind is not None:
+                edge['kind'] = EdgeKind.to_str(kind)
 
+            edge.update((k, v) for (k, v) in data.items() if k != 'kind')
 
-    import ubjson
-    ubjson.dump({'functions': functions}, output)
+            if kind == EdgeKind.Call:
+                fn['calls'].append(edge)
+            else:
+                fn['flows'].append(edge)
@@ -0,0 +1,242 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Benchmarks of loading, filtering, simplifying and saving synthetic CDGs.
+
+`run` generates a synthetic graph (see cdg.synthetic) at each requested
+scale, writes it out in every format and times `cdg.load`, every filter,
+building reachability indexes (see cdg.reach), `simplified`, `save` and
+`to_dot` against it, with both graph backends. Each
+operation is timed `repeat` times (keeping the fastest) and, optionally, run
+once more under tracemalloc to find its peak memory use.
+
+Results are plain dicts, ready to be dumped as JSON and compared over time:
+
+    {"operation": "filter", "variant": "flows-from", "scale": "small",
+     "backend": "compact", "seconds": 0.0123, "peak_bytes": 456789,
+     "nodes": 1234, "edges": 5678}
+'''
+
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cdg
+import cdg.filters
+import cdg.reach
+import cdg.synthetic
+
+
+# (functions, blocks per function, values per block)
+Scales = {
+    'tiny': (20, 2, 2),
+    'small': (200, 4, 4),
+    'medium': (2000, 8, 8),
+    'large': (10000, 8, 8),
+}
+
+Formats = ('cdg', 'json', 'yaml', 'cdgc')
+
+Backends = ('networkx', 'compact')
+
+
+def parse_scale(scale):
+    '''
+    Parse a scale name or a "functions x blocks x values" triple.
+    '''
+
+    if scale in Scales:
+        return Scales[scale]
+
+    try:
+        (functions, blocks, values) = (int(n) for n in scale.split('x'))
+    except ValueError:
+        raise ValueError('Invalid scale: %s' % scale)
+
+    return (functions, blocks, values)
+
+
+def run(scales=('small',), repeat=3, memory=True, formats=Formats,
+        backends=Backends, seed=0):
+    '''
+    Run every benchmark at each scale, returning a list of results.
+    '''
+
+    results = []
+
+    for scale in scales:
+        (functions, blocks, values) = parse_scale(scale)
+
+        def record(operation, variant, backend, measurement):
+            (seconds, peak, graph) = measurement
+            results.append({
+                'operation': operation,
+                'variant': variant,
+                'scale': scale,
+                'functions': functions,
+                'blocks': blocks,
+                'values': values,
+                'backend': backend,
+                'seconds': seconds,
+                'peak_bytes': peak,
+                'nodes': len(graph) if graph is not None else None,
+                'edges': graph.number_of_edges()
+                         if graph is not None else None,
+            })
+
+        with tempfile.TemporaryDirectory(prefix='cdg-bench-') as tmp:
+            files = {}
+            for fmt in formats:
+                files[fmt] = os.path.join(tmp, 'bench.' + fmt)
+                cdg.synthetic.write(files[fmt], functions, blocks, values,
+                                    seed=seed)
+
+            for backend in backends:
+                compact = (backend == 'compact')
+
+                for (fmt, filename) in files.items():
+                    modes = [False]
+                    if fmt in ('cdg', 'json'):
+                        modes.append(True)
+
+                    for streaming in modes:
+                        load = lambda: load_file(filename, streaming,
+                                                 compact)
+                        variant = fmt + ('-streaming' if streaming else '')
+                        record('load', variant, backend,
+                               measure(load, repeat, memory))
+
+                # Queries don't depend on the file format
+                graph = load_file(files[formats[0]], False, compact)
+
+                for (name, spec) in filter_specs(graph):
+                    apply = lambda: cdg.filters.apply(spec, graph)
+                    record('filter', name, backend,
+                           measure(apply, repeat, memory))
+
+                for (variant, kinds) in (('all', cdg.EdgeKind.All),
+                                         ('calls', cdg.EdgeKind.mask(
+                                             cdg.EdgeKind.Call))):
+                    index = lambda: cdg.reach.Index(graph, kinds, False)
+                    record('index', variant, backend,
+                           measure(index, repeat, memory))
+
+                record('simplify', None, backend,
+                       measure(graph.simplified, repeat, memory))
+
+                for fmt in formats:
+                    save = lambda: graph.save(Sink(), 'bench.' + fmt)
+                    record('save', fmt, backend,
+                           measure(save, repeat, memory))
+
+                to_dot = lambda: graph.to_dot(Sink())
+                record('dot', None, backend, measure(to_dot, repeat, memory))
+
+    return results
+
+
+def load_file(filename, streaming, compact):
+    with open(filename, 'rb') as f:
+        return cdg.load(f, filename, streaming=streaming, compact=compact,
+                        cache=False)
+
+
+def filter_specs(graph):
+    '''
+    A spec for each filter, with seeds that exist in synthetic graphs.
+    '''
+
+    # fn0 is the most-called function; calls point at its arguments, if any
+    callee = cdg.graph_targets(graph, 'fn0') or ['fn0']
+    value = 'fn1::bb0::v0'
+
+    specs = [('calls-to', 'calls-to:' + ','.join(callee))]
+    specs += [
+        (name, '%s:%s' % (name, value))
+        for name in sorted(cdg.filters.Traversals) if name != 'calls-to'
+    ]
+    specs.append(('exclude', 'exclude:' + value))
+
+    return specs
+
+
+def measure(fn, repeat=3, memory=True):
+    '''
+    Time a function, returning its fastest time, its peak memory use
+    (or None) and the graph that it returned (if any).
+    '''
+
+    times = []
+    for _ in range(max(repeat, 1)):
+        # Don't keep one result alive while producing the next
+        graph = None
+
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+        graph = result if hasattr(result, 'number_of_edges') else None
+        del result
+
+    peak = None
+    if memory:
+        graph = None
+        tracemalloc.start()
+        try:
+            result = fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        graph = result if hasattr(result, 'number_of_edges') else None
+
+    return (min(times), peak, graph)
+
+
+def environment():
+    '''
+    Describe the machine and software that benchmarks were run with.
+    '''
+
+    import networkx
+
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'networkx': networkx.__version__,
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'argv': sys.argv,
+    }
+
+
+class Sink:
+    '''
+    A file-like object that counts and discards everything written to it.
+    '''
+
+    def __init__(self):
+        self.length = 0
+
+    def write(self, data):
+        self.length += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
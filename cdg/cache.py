@@ -0,0 +1,304 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+An on-disk cache of built graphs, keyed by the content of the file they were
+loaded from.
+
+Entries are binary snapshots (see cdg.snapshot) named after a hash of the
+input file, the code that builds graphs and the snapshot format version, so a
+changed input or a changed library never sees a stale graph. Once the cache
+grows beyond its size budget, the least-recently-used entries are evicted.
+
+The cache lives in $CDG_CACHE_DIR (default: $XDG_CACHE_HOME/cdg or
+~/.cache/cdg). Setting CDG_CACHE=0 disables it and CDG_CACHE_SIZE sets the
+budget (in bytes, or with a K, M or G suffix).
+'''
+
+import hashlib
+import os
+import tempfile
+
+import cdg
+import cdg.compact
+import cdg.snapshot
+
+
+DefaultBudget = 4 << 30
+
+Suffix = '.snap'
+
+# Cache entries: snapshots and data derived from them
+Suffixes = (Suffix, '.reach', '.memo')
+
+
+def directory():
+    if 'CDG_CACHE_DIR' in os.environ:
+        return os.environ['CDG_CACHE_DIR']
+
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'cdg')
+
+
+def enabled():
+    return os.environ.get('CDG_CACHE', '1') not in ('0', 'no', 'off', '')
+
+
+def budget():
+    value = os.environ.get('CDG_CACHE_SIZE')
+    if not value:
+        return DefaultBudget
+
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    value = value.strip().upper()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+def code_hash():
+    '''
+    A hash of the modules that decide what a cached graph contains, so that
+    changing them (in a release or in a source checkout) invalidates the
+    cache.
+    '''
+
+    global _code_hash
+
+    if _code_hash is None:
+        h = hashlib.sha256()
+        for module in (cdg, cdg.compact, cdg.snapshot):
+            with open(module.__file__, 'rb') as f:
+                h.update(f.read())
+        _code_hash = h.hexdigest()
+
+    return _code_hash
+
+_code_hash = None
+
+
+def key(filename):
+    '''
+    The cache key for an input file: a hash of its content, the code that
+    builds graphs and the snapshot format version.
+    '''
+
+    h = hashlib.sha256()
+    h.update(('cdg %s snapshot %d\n' % (
+        code_hash(), cdg.snapshot.Version)).encode('utf-8'))
+    h.update(file_hash(filename).encode('ascii'))
+
+    return h.hexdigest()
+
+
+def file_hash(filename):
+    '''
+    Hash a file's content, reusing the previous hash if the file's size and
+    modification time haven't changed.
+    '''
+
+    st = os.stat(filename)
+    stamp = '%d %d' % (st.st_size, st.st_mtime_ns)
+
+    path = os.path.abspath(filename).encode('utf-8', 'surrogateescape')
+    record = os.path.join(directory(), 'hashes',
+                          hashlib.sha256(path).hexdigest())
+
+    try:
+        with open(record) as f:
+            (recorded_stamp, digest) = f.read().rsplit(' ', 1)
+            if recorded_stamp == stamp:
+                return digest
+    except (OSError, ValueError):
+        pass
+
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    digest = h.hexdigest()
+    try:
+        atomic_write(record, ('%s %s' % (stamp, digest)).encode('ascii'))
+    except OSError:
+        pass
+
+    return digest
+
+
+def path(filename):
+    return os.path.join(directory(), key(filename) + Suffix)
+
+
+def lookup(filename, compact=False):
+    '''
+    Return the cached graph for an input file, or None.
+    '''
+
+    if not enabled() or not os.path.isfile(filename):
+        return None
+
+    k = key(filename)
+    p = os.path.join(directory(), k + Suffix)
+    try:
+        graph = cdg.snapshot.open_mapped(p)
+    except (OSError, ValueError):
+        return None
+
+    # Record the use for LRU eviction
+    try:
+        os.utime(p)
+    except OSError:
+        pass
+
+    if not compact:
+        graph = cdg.compact.to_networkx(graph)
+
+    # Data derived from the graph (e.g., cdg.reach indexes) can be cached too
+    mark(graph, k)
+
+    return graph
+
+
+def store(filename, graph):
+    '''
+    Store a snapshot of the graph loaded from an input file.
+    '''
+
+    if not enabled() or not os.path.isfile(filename):
+        return
+
+    k = key(filename)
+    try:
+        atomic_write(os.path.join(directory(), k + Suffix),
+                     writer=lambda f: cdg.snapshot.write(graph, f))
+        evict(budget())
+    except OSError:
+        return
+
+    mark(graph, k)
+
+
+def mark(graph, k):
+    '''
+    Note that a graph is the one cached under a key, as it is now.
+    '''
+
+    graph.cache_key = k
+    graph.cache_version = getattr(graph, 'version', 0)
+
+
+def graph_key(graph):
+    '''
+    The key of the cached snapshot that a graph was stored as or loaded
+    from, if it hasn't changed since, or None. Data derived from the graph
+    (e.g., cdg.reach indexes) can be cached under this key.
+    '''
+
+    key = getattr(graph, 'cache_key', None)
+    if key is None or not enabled() \
+            or getattr(graph, 'version', 0) != graph.cache_version:
+        return None
+
+    return key
+
+
+def entries():
+    '''
+    Cached snapshots and derived files as (path, size, last use) tuples,
+    oldest first.
+    '''
+
+    d = directory()
+    try:
+        names = os.listdir(d)
+    except OSError:
+        return []
+
+    result = []
+    for name in names:
+        if name.endswith(Suffixes):
+            p = os.path.join(d, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            result.append((p, st.st_size, st.st_mtime))
+
+    return sorted(result, key=lambda e: e[2])
+
+
+def evict(limit):
+    '''
+    Remove least-recently-used snapshots until the cache fits in `limit`.
+    '''
+
+    cached = entries()
+    total = sum(size for (_, size, _) in cached)
+
+    for (p, size, _) in cached:
+        if total <= limit:
+            break
+
+        try:
+            os.unlink(p)
+            total -= size
+        except OSError:
+            pass
+
+
+def clear():
+    '''
+    Remove every cached snapshot, file hash and function digest (see
+    cdg.digest).
+    '''
+
+    evict(0)
+
+    for records in ('hashes', 'digests'):
+        records = os.path.join(directory(), records)
+        try:
+            names = os.listdir(records)
+        except OSError:
+            continue
+
+        for name in names:
+            try:
+                os.unlink(os.path.join(records, name))
+            except OSError:
+                pass
+
+
+def atomic_write(filename, data=None, writer=None):
+    '''
+    Write a file via a temporary file and a rename, so that concurrent
+    readers never see a partial entry.
+    '''
+
+    d = os.path.dirname(filename)
+    os.makedirs(d, exist_ok=True)
+
+    (fd, tmp) = tempfile.mkstemp(dir=d, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if writer:
+                writer(f)
+            else:
+                f.write(data)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
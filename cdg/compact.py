@@ -0,0 +1,1057 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A compact, array-backed alternative to networkx.DiGraph.
+
+Node names are interned to integer ids (in sorted name order), edges are
+stored as CSR (outgoing) and CSC (incoming) offset arrays with a parallel
+array of EdgeKind bytes and the function/block/value hierarchy is kept as an
+array of parent ids. Only nodes with attributes beyond their place in the
+hierarchy carry a Python dict. Each node's edges are grouped by kind, with an
+offset for each group, so that a search along (say) only call edges never
+looks at any others.
+
+CompactGraph exposes the subset of the networkx.DiGraph interface that the
+rest of this package relies on, so that filters, queries, simplification and
+output work unchanged. Mutations are supported but are intended to be rare:
+removed nodes are tombstoned and added edges are kept in an overlay until the
+graph is next copied (see `CompactGraph.compacted`).
+'''
+
+import bisect
+import collections
+import collections.abc
+import gc
+import itertools
+from array import array
+
+
+# Kind byte stored for edges without a 'kind' attribute
+NoKind = 0xff
+
+# Array type codes for node ids, signed ids (with -1 for "none") and offsets
+IdType = 'I'
+ParentType = 'i'
+OffsetType = 'Q'
+
+# Each node's edges are grouped by kind: one group per EdgeKind and a last
+# group for any other kind byte (e.g., NoKind).
+Groups = 5
+Group = bytes(min(k, Groups - 1) for k in range(256))
+
+
+def kind_spans(table):
+    '''
+    The runs of consecutive edge groups that a `kind_table` selects edges
+    from, as (first, last + 1) pairs.
+    '''
+
+    selected = [g for g in range(Groups - 1) if table[g]]
+    if any(table[Groups - 1:]):
+        selected.append(Groups - 1)
+
+    spans = []
+    for g in selected:
+        if spans and spans[-1][1] == g:
+            spans[-1] = (spans[-1][0], g + 1)
+        else:
+            spans.append((g, g + 1))
+
+    return spans
+
+
+def kind_table(mask):
+    '''
+    A 256-entry lookup table of which kind bytes an EdgeKind mask selects.
+
+    Edges without a kind are only selected by a mask of all kinds.
+    '''
+    import cdg
+
+    table = bytearray(256)
+    for k in range(8):
+        if mask & (1 << k):
+            table[k] = 1
+
+    if mask == cdg.EdgeKind.All:
+        table[NoKind] = 1
+
+    return bytes(table)
+
+
+class Builder:
+    '''
+    Accumulate nodes and edges with the networkx API used by `cdg.build`,
+    then freeze them into a CompactGraph.
+    '''
+
+    def __init__(self, name):
+        self.graph = {'comment': 'Callgraph of %s' % name}
+
+        self.index = {}
+        self.names = []
+        self.parents = array(ParentType)
+        self.containers = bytearray()
+        self.attrs = {}
+
+        self.srcs = array(IdType)
+        self.dsts = array(IdType)
+        self.kinds = bytearray()
+        self.edge_attrs = {}
+
+    def id(self, name):
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+            self.parents.append(-1)
+            self.containers.append(0)
+
+        return i
+
+    def add_node(self, name, parent=None, children=None, **attrs):
+        i = self.id(name)
+
+        if parent is not None:
+            self.parents[i] = self.id(parent)
+
+        # Children are recovered from the parent links of other nodes; all
+        # we need to record is that this node is a container.
+        if children is not None:
+            self.containers[i] = 1
+
+        if attrs:
+            self.attrs.setdefault(i, {}).update(attrs)
+
+    def add_edge(self, src, dest, kind=NoKind, **attrs):
+        (u, v) = (self.id(src), self.id(dest))
+
+        self.srcs.append(u)
+        self.dsts.append(v)
+        self.kinds.append(NoKind if kind is None else kind)
+
+        if attrs:
+            self.edge_attrs[(u, v)] = attrs
+
+    def finish(self):
+        import cdg
+
+        graph = CompactGraph()
+        graph.graph = self.graph
+        freeze(graph, self.names, self.parents, self.containers, self.attrs,
+               self.srcs, self.dsts, self.kinds, self.edge_attrs)
+
+        return cdg.hot_patch(graph)
+
+
+def freeze(graph, names, parents, containers, attrs,
+           srcs, dsts, kinds, edge_attrs):
+    '''
+    Fill in a CompactGraph's arrays from unsorted, possibly-duplicated lists
+    of nodes and edges (later duplicate edges replace earlier ones, as with
+    DiGraph.add_edge).
+    '''
+
+    n = len(names)
+    order = sorted(range(n), key=names.__getitem__)
+    remap = array(IdType, bytes(4 * n))
+    for (new, old) in enumerate(order):
+        remap[old] = new
+
+    graph._names = [names[i] for i in order]
+    graph._index = dict((name, i) for (i, name) in enumerate(graph._names))
+    graph._parent = array(ParentType, (
+        remap[parents[i]] if parents[i] >= 0 else -1 for i in order))
+    graph._container = bytearray(containers[i] for i in order)
+    graph._attrs = dict((remap[i], a) for (i, a) in attrs.items() if a)
+    graph._alive = bytearray(b'\x01') * n
+    graph._base = n
+
+    # Sort edges by (source, destination); the sort is stable, so keeping the
+    # last of each run gives DiGraph's "last add_edge wins" semantics.
+    keys = [remap[s] * n + remap[d] for (s, d) in zip(srcs, dsts)]
+    edges = sorted(range(len(keys)), key=keys.__getitem__)
+
+    unique_srcs = array(IdType)
+    unique_dsts = array(IdType)
+    unique_kinds = bytearray()
+    last = None
+
+    for e in edges:
+        k = keys[e]
+        if k == last:
+            unique_kinds[-1] = kinds[e]
+            continue
+
+        last = k
+        (u, v) = divmod(k, n)
+        unique_srcs.append(u)
+        unique_dsts.append(v)
+        unique_kinds.append(kinds[e])
+
+    # Group each node's edges by kind with counting sorts, so that a search
+    # along some kinds of edges can skip the others entirely. Walking edges
+    # in (source, destination) order keeps the destinations within each
+    # group sorted, and the sources within each incoming group too.
+    (out_groups, targets, out_kinds) = group(
+        n, unique_srcs, unique_dsts, unique_kinds)
+    (in_groups, sources, in_kinds) = group(
+        n, unique_dsts, unique_srcs, unique_kinds)
+
+    graph._out_offsets = out_groups[::Groups]
+    graph._out_groups = out_groups
+    graph._out_targets = targets
+    graph._out_kinds = out_kinds
+    graph._in_offsets = in_groups[::Groups]
+    graph._in_groups = in_groups
+    graph._in_sources = sources
+    graph._in_kinds = in_kinds
+
+    graph._edge_attrs = dict(
+        ((remap[u], remap[v]), a) for ((u, v), a) in edge_attrs.items())
+
+    graph._added_succ = {}
+    graph._added_pred = {}
+    graph._shadowed = set()
+    graph._children = None
+
+    graph._node_count = n
+    graph._edge_count = len(targets)
+
+    # Counts structural changes, like cdg.Graph.version
+    graph.version = 0
+
+
+def group(n, nodes, ends, kinds):
+    '''
+    Sort edges, given as parallel arrays of the nodes that they belong to,
+    the nodes at their other ends and their kinds, by (node, kind group).
+    The sort is stable.
+
+    Returns the offsets of each (node, group) in the sorted edges and the
+    sorted arrays of other ends and kinds.
+    '''
+
+    keys = [u * Groups + g
+            for (u, g) in zip(nodes, bytes(kinds).translate(Group))]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    counts = collections.Counter(keys)
+    offsets = array(OffsetType, [0])
+    offsets.extend(itertools.accumulate(
+        map(counts.get, range(n * Groups), itertools.repeat(0))))
+
+    return (offsets, array(IdType, map(ends.__getitem__, order)),
+            bytearray(map(kinds.__getitem__, order)))
+
+
+class CompactGraph:
+    '''
+    An array-backed directed graph with networkx.DiGraph-like accessors.
+
+    Node attribute dicts returned by `nodes[name]` are live views: updates
+    (e.g., query annotations) are stored in the graph. Edge attribute dicts
+    are snapshots.
+    '''
+
+    def __init__(self):
+        self.graph = {}
+        freeze(self, [], [], b'', {}, [], [], b'', {})
+
+    #
+    # Node and edge views
+    #
+    @property
+    def nodes(self):
+        return NodeView(self)
+
+    @property
+    def edges(self):
+        return EdgeView(self)
+
+    @property
+    def succ(self):
+        return AdjacencyView(self, self._out)
+
+    @property
+    def pred(self):
+        return AdjacencyView(self, self._in)
+
+    adj = succ
+
+    def __iter__(self):
+        return (self._names[i] for i in self._live())
+
+    def __contains__(self, name):
+        return self.id(name) is not None
+
+    def __len__(self):
+        return self._node_count
+
+    def __getitem__(self, name):
+        return self.succ[name]
+
+    def number_of_nodes(self):
+        return self._node_count
+
+    def number_of_edges(self):
+        return self._edge_count
+
+    def has_node(self, name):
+        return name in self
+
+    def has_edge(self, src, dest):
+        (u, v) = (self.id(src), self.id(dest))
+        return u is not None and v is not None and self._kind(u, v) is not None
+
+    def successors(self, name):
+        return (self._names[v] for (v, _) in self._out(self._node(name)))
+
+    def predecessors(self, name):
+        return (self._names[u] for (u, _) in self._in(self._node(name)))
+
+    neighbors = successors
+
+    def out_degree(self, name=None):
+        if name is None:
+            return ((n, self.out_degree(n)) for n in self)
+        return sum(1 for _ in self._out(self._node(name)))
+
+    def in_degree(self, name=None):
+        if name is None:
+            return ((n, self.in_degree(n)) for n in self)
+        return sum(1 for _ in self._in(self._node(name)))
+
+    def is_directed(self):
+        return True
+
+    #
+    # Integer-id accessors, for code that wants to avoid name lookups
+    #
+    def id(self, name):
+        '''
+        The integer id of a live node, or None.
+        '''
+        i = self._index.get(name)
+        return i if i is not None and self._alive[i] else None
+
+    def name(self, i):
+        return self._names[i]
+
+    def parent_id(self, i):
+        p = self._parent[i]
+        return p if p >= 0 and self._alive[p] else None
+
+    def child_ids(self, i):
+        if self._children is None:
+            self._index_children()
+
+        (offsets, ids) = self._children
+        if i + 1 >= len(offsets):
+            return []
+        return [c for c in ids[offsets[i]:offsets[i + 1]] if self._alive[c]]
+
+    def is_container(self, i):
+        return bool(self._container[i])
+
+    def degree_id(self, i, reverse=False, table=None):
+        '''
+        The number of edges that `expand` looks at to expand a node.
+        '''
+        (groups, overlay) = (self._in_groups, self._added_pred) if reverse \
+            else (self._out_groups, self._added_succ)
+
+        n = len(overlay.get(i, ()))
+        if i < self._base:
+            row = i * Groups
+            for (first, last) in kind_spans(table or kind_table(0xff)):
+                n += groups[row + last] - groups[row + first]
+
+        return n
+
+    def expand(self, frontier, table, seen, reverse=False):
+        '''
+        Expand a whole BFS frontier of node ids at once.
+
+        Follows out-edges (or in-edges, if `reverse`) whose kind is selected
+        by `table` (see `kind_table`), marks unseen neighbours in the `seen`
+        bytearray and returns them as the next frontier. Only the groups of
+        edges with selected kinds are looked at.
+        '''
+
+        if reverse:
+            (groups, ends, kinds) = (
+                self._in_groups, self._in_sources, self._in_kinds)
+            overlay = self._added_pred
+        else:
+            (groups, ends, kinds) = (
+                self._out_groups, self._out_targets, self._out_kinds)
+            overlay = self._added_succ
+
+        alive = self._alive
+        base = self._base
+        shadowed = self._shadowed
+        spans = kind_spans(table)
+        following = []
+
+        for u in frontier:
+            if u < base:
+                row = u * Groups
+                for (first, last) in spans:
+                    (lo, hi) = (groups[row + first], groups[row + last])
+                    for (v, k) in zip(ends[lo:hi], kinds[lo:hi]):
+                        if seen[v] or not table[k] or not alive[v]:
+                            continue
+
+                        if shadowed and (
+                                ((v, u) if reverse else (u, v)) in shadowed):
+                            continue
+
+                        seen[v] = 1
+                        following.append(v)
+
+            extra = overlay.get(u)
+            if extra:
+                for (v, k) in extra.items():
+                    if table[k] and not seen[v] and alive[v]:
+                        seen[v] = 1
+                        following.append(v)
+
+        return following
+
+    def neighbour_ids(self, u, table, reverse=False):
+        '''
+        The ids of a node's live successors (or predecessors, if `reverse`)
+        along edges whose kind is selected by `table`.
+        '''
+
+        if reverse:
+            (groups, ends, kinds) = (
+                self._in_groups, self._in_sources, self._in_kinds)
+            overlay = self._added_pred
+        else:
+            (groups, ends, kinds) = (
+                self._out_groups, self._out_targets, self._out_kinds)
+            overlay = self._added_succ
+
+        alive = self._alive
+        shadowed = self._shadowed
+        result = []
+
+        if u < self._base:
+            row = u * Groups
+            for (first, last) in kind_spans(table):
+                (lo, hi) = (groups[row + first], groups[row + last])
+                for (v, k) in zip(ends[lo:hi], kinds[lo:hi]):
+                    if table[k] and alive[v] and not (shadowed and (
+                            ((v, u) if reverse else (u, v)) in shadowed)):
+                        result.append(v)
+
+        extra = overlay.get(u)
+        if extra:
+            result += [v for (v, k) in extra.items()
+                       if table[k] and alive[v]]
+
+        return result
+
+    #
+    # Copying and mutation
+    #
+    def copy(self):
+        c = CompactGraph()
+        c.graph = dict(self.graph)
+        self._freeze_into(c, self._live())
+        return c
+
+    def subgraph(self, nodes):
+        ids = {self.id(n) for n in nodes}
+        ids.discard(None)
+
+        s = CompactGraph()
+        s.graph = self.graph
+        self._freeze_into(s, sorted(ids))
+        return s
+
+    def compacted(self):
+        '''
+        A copy without tombstones or overlay edges.
+        '''
+        return self.copy()
+
+    def add_node(self, name, parent=None, children=None, **attrs):
+        i = self.id(name)
+        if i is None:
+            i = self._new_node(name)
+
+        if parent is not None:
+            self.nodes[name]['parent'] = parent
+
+        if children is not None:
+            self.nodes[name]['children'] = children
+
+        if attrs:
+            self._attrs.setdefault(i, {}).update(attrs)
+
+    def add_nodes_from(self, nodes, **attrs):
+        for n in nodes:
+            if isinstance(n, tuple):
+                (n, a) = n
+                self.add_node(n, **dict(attrs, **a))
+            else:
+                self.add_node(n, **attrs)
+
+    def add_edge(self, src, dest, kind=NoKind, **attrs):
+        u = self.id(src)
+        if u is None:
+            u = self._new_node(src)
+
+        v = self.id(dest)
+        if v is None:
+            v = self._new_node(dest)
+
+        if kind is None:
+            kind = NoKind
+
+        self.version += 1
+        if self._kind(u, v) is None:
+            self._edge_count += 1
+        elif u < self._base and v < self._base:
+            self._shadowed.add((u, v))
+
+        self._added_succ.setdefault(u, {})[v] = kind
+        self._added_pred.setdefault(v, {})[u] = kind
+
+        if attrs:
+            self._edge_attrs[(u, v)] = attrs
+        else:
+            self._edge_attrs.pop((u, v), None)
+
+    def add_edges_from(self, edges, **attrs):
+        for e in edges:
+            if len(e) == 3:
+                (u, v, a) = e
+                self.add_edge(u, v, **dict(attrs, **a))
+            else:
+                (u, v) = e
+                self.add_edge(u, v, **attrs)
+
+    def remove_edge(self, src, dest):
+        (u, v) = (self._node(src), self._node(dest))
+        if self._kind(u, v) is None:
+            raise KeyError((src, dest))
+
+        self.version += 1
+        if u < self._base and v < self._base:
+            self._shadowed.add((u, v))
+
+        self._added_succ.get(u, {}).pop(v, None)
+        self._added_pred.get(v, {}).pop(u, None)
+        self._edge_attrs.pop((u, v), None)
+        self._edge_count -= 1
+
+    def remove_node(self, name):
+        i = self._node(name)
+
+        loop = self._kind(i, i) is not None
+        self._edge_count -= (
+            sum(1 for _ in self._out(i)) + sum(1 for _ in self._in(i)) - loop)
+
+        self.version += 1
+        self._alive[i] = 0
+        self._node_count -= 1
+        self._attrs.pop(i, None)
+        self._added_succ.pop(i, None)
+        self._added_pred.pop(i, None)
+
+    def remove_nodes_from(self, nodes):
+        for n in list(nodes):
+            if n in self:
+                self.remove_node(n)
+
+    #
+    # Internals
+    #
+    def _node(self, name):
+        i = self.id(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+    def _thaw(self):
+        '''
+        Replace memory-mapped columns (see cdg.snapshot.open_mapped) with
+        ordinary, growable containers.
+        '''
+        if isinstance(self._names, list):
+            return
+
+        self._names = list(self._names)
+        self._index = dict((n, i) for (i, n) in enumerate(self._names))
+        self._parent = array(ParentType, self._parent)
+        self._container = bytearray(self._container)
+
+    def _new_node(self, name):
+        self._thaw()
+        self.version += 1
+
+        i = len(self._names)
+        self._names.append(name)
+        self._index[name] = i
+        self._parent.append(-1)
+        self._container.append(0)
+        self._alive.append(1)
+        self._node_count += 1
+        self._children = None
+        return i
+
+    def _live(self):
+        alive = self._alive
+        return (i for i in range(len(alive)) if alive[i])
+
+    def _out(self, u):
+        '''
+        Iterate over (destination id, kind) pairs of a node's live out-edges.
+        '''
+        alive = self._alive
+        shadowed = self._shadowed
+
+        if u < self._base:
+            targets = self._out_targets
+            kinds = self._out_kinds
+            for e in range(self._out_offsets[u], self._out_offsets[u + 1]):
+                v = targets[e]
+                if alive[v] and not (shadowed and (u, v) in shadowed):
+                    yield (v, kinds[e])
+
+        extra = self._added_succ.get(u)
+        if extra:
+            for (v, kind) in extra.items():
+                if alive[v]:
+                    yield (v, kind)
+
+    def _in(self, v):
+        '''
+        Iterate over (source id, kind) pairs of a node's live in-edges.
+        '''
+        alive = self._alive
+        shadowed = self._shadowed
+
+        if v < self._base:
+            sources = self._in_sources
+            kinds = self._in_kinds
+            for e in range(self._in_offsets[v], self._in_offsets[v + 1]):
+                u = sources[e]
+                if alive[u] and not (shadowed and (u, v) in shadowed):
+                    yield (u, kinds[e])
+
+        extra = self._added_pred.get(v)
+        if extra:
+            for (u, kind) in extra.items():
+                if alive[u]:
+                    yield (u, kind)
+
+    def _kind(self, u, v):
+        '''
+        The kind byte of a live edge, or None if there is no such edge.
+        '''
+        if not (self._alive[u] and self._alive[v]):
+            return None
+
+        extra = self._added_succ.get(u)
+        if extra and v in extra:
+            return extra[v]
+
+        if u < self._base and v < self._base and (u, v) not in self._shadowed:
+            # Destinations are sorted within each of the node's edge groups
+            (groups, targets) = (self._out_groups, self._out_targets)
+            row = u * Groups
+            for g in range(Groups):
+                (lo, hi) = (groups[row + g], groups[row + g + 1])
+                e = bisect.bisect_left(targets, v, lo, hi)
+                if e < hi and targets[e] == v:
+                    return self._out_kinds[e]
+
+        return None
+
+    def _edge_data(self, u, v, kind):
+        data = {} if kind == NoKind else {'kind': kind}
+        extra = self._edge_attrs.get((u, v))
+        if extra:
+            data.update(extra)
+        return data
+
+    def _index_children(self):
+        n = len(self._names)
+        offsets = array(OffsetType, bytes(8 * (n + 1)))
+        for p in self._parent:
+            if p >= 0:
+                offsets[p + 1] += 1
+
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+
+        ids = array(IdType, bytes(4 * offsets[n]))
+        fill = array(OffsetType, offsets)
+        for (i, p) in enumerate(self._parent):
+            if p >= 0:
+                ids[fill[p]] = i
+                fill[p] += 1
+
+        self._children = (offsets, ids)
+
+    def _freeze_into(self, other, ids):
+        ids = list(ids)
+        keep = set(ids)
+        new = dict((old, i) for (i, old) in enumerate(ids))
+
+        srcs = array(IdType)
+        dsts = array(IdType)
+        kinds = bytearray()
+        edge_attrs = {}
+
+        for u in ids:
+            for (v, kind) in self._out(u):
+                if v in keep:
+                    srcs.append(new[u])
+                    dsts.append(new[v])
+                    kinds.append(kind)
+
+                    a = self._edge_attrs.get((u, v))
+                    if a:
+                        edge_attrs[(new[u], new[v])] = dict(a)
+
+        attrs = dict((new[i], dict(self._attrs[i]))
+                     for i in ids if i in self._attrs)
+
+        # Like networkx subgraphs, keep the names of parents that were left
+        # out (as plain attributes) so that nodes don't turn into roots.
+        for i in ids:
+            p = self._parent[i]
+            if p >= 0 and p not in new:
+                attrs.setdefault(new[i], {})['parent'] = self._names[p]
+
+        freeze(other,
+               [self._names[i] for i in ids],
+               [new.get(self._parent[i], -1) for i in ids],
+               bytearray(self._container[i] for i in ids),
+               attrs, srcs, dsts, kinds, edge_attrs)
+
+
+class NodeAttributes(collections.abc.MutableMapping):
+    '''
+    A live, dict-like view of a node's attributes.
+
+    The 'parent' and 'children' attributes are synthesised from the graph's
+    hierarchy arrays; everything else is stored in a sparse per-node dict.
+    '''
+
+    __slots__ = ('graph', 'id')
+
+    def __init__(self, graph, i):
+        self.graph = graph
+        self.id = i
+
+    def __getitem__(self, key):
+        g = self.graph
+        if key == 'parent':
+            p = g.parent_id(self.id)
+            if p is not None:
+                return g._names[p]
+
+        elif key == 'children':
+            if g._container[self.id]:
+                return set(g._names[c] for c in g.child_ids(self.id))
+
+        attrs = g._attrs.get(self.id)
+        if attrs is None or key not in attrs:
+            raise KeyError(key)
+
+        return attrs[key]
+
+    def __setitem__(self, key, value):
+        g = self.graph
+        if key == 'parent' and value in g:
+            g._parent[self.id] = g.id(value)
+            g._children = None
+            g._attrs.get(self.id, {}).pop('parent', None)
+
+        elif key == 'children':
+            g._container[self.id] = 1
+            for child in value:
+                c = g.id(child)
+                if c is not None:
+                    g._parent[c] = self.id
+            g._children = None
+
+        else:
+            if key == 'parent':
+                g._parent[self.id] = -1
+                g._children = None
+
+            g._attrs.setdefault(self.id, {})[key] = value
+
+    def __delitem__(self, key):
+        g = self.graph
+        if key == 'parent' and g.parent_id(self.id) is not None:
+            g._parent[self.id] = -1
+            g._children = None
+
+        elif key == 'children' and g._container[self.id]:
+            g._container[self.id] = 0
+
+        else:
+            del g._attrs[self.id][key]
+            if not g._attrs[self.id]:
+                del g._attrs[self.id]
+
+    def __iter__(self):
+        g = self.graph
+        if g.parent_id(self.id) is not None:
+            yield 'parent'
+
+        if g._container[self.id]:
+            yield 'children'
+
+        for key in g._attrs.get(self.id, ()):
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class NodeView(collections.abc.Mapping):
+    '''
+    A networkx.NodeView-like view of a CompactGraph's nodes.
+    '''
+
+    __slots__ = ('graph',)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __call__(self, data=False, default=None):
+        if data is False:
+            return self
+
+        if data is True:
+            return self.items()
+
+        return ((n, a.get(data, default)) for (n, a) in self.items())
+
+    def data(self, data=True, default=None):
+        return self(data, default)
+
+    def __getitem__(self, name):
+        return NodeAttributes(self.graph, self.graph._node(name))
+
+    def __iter__(self):
+        return iter(self.graph)
+
+    def __len__(self):
+        return len(self.graph)
+
+    def __contains__(self, name):
+        return name in self.graph
+
+
+class EdgeView:
+    '''
+    A networkx.OutEdgeView-like view of a CompactGraph's edges.
+    '''
+
+    __slots__ = ('graph',)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __call__(self, nbunch=None, data=False, default=None):
+        if nbunch is None and data is False:
+            return self
+
+        return self._edges(nbunch, data, default)
+
+    def _edges(self, nbunch, data, default):
+        g = self.graph
+
+        if nbunch is None:
+            ids = g._live()
+        elif isinstance(nbunch, str):
+            ids = (g.id(nbunch),)
+        else:
+            ids = (i for i in (g.id(n) for n in nbunch) if i is not None)
+
+        for u in ids:
+            src = g._names[u]
+            for (v, kind) in g._out(u):
+                if data is False:
+                    yield (src, g._names[v])
+                else:
+                    d = g._edge_data(u, v, kind)
+                    yield (src, g._names[v],
+                           d if data is True else d.get(data, default))
+
+    def data(self, data=True, default=None, nbunch=None):
+        return self._edges(nbunch, data, default)
+
+    def __iter__(self):
+        return self._edges(None, False, None)
+
+    def __len__(self):
+        return self.graph._edge_count
+
+    def __contains__(self, edge):
+        (u, v) = edge
+        return self.graph.has_edge(u, v)
+
+    def __getitem__(self, edge):
+        g = self.graph
+        (u, v) = (g._node(edge[0]), g._node(edge[1]))
+        kind = g._kind(u, v)
+        if kind is None:
+            raise KeyError(edge)
+
+        return g._edge_data(u, v, kind)
+
+
+class AdjacencyView(collections.abc.Mapping):
+    '''
+    A view of each node's neighbours (`graph.succ` or `graph.pred`), mapping
+    neighbour names to edge attribute dicts.
+    '''
+
+    __slots__ = ('graph', 'neighbours')
+
+    def __init__(self, graph, neighbours):
+        self.graph = graph
+        self.neighbours = neighbours
+
+    def __getitem__(self, name):
+        g = self.graph
+        i = g._node(name)
+        out = (self.neighbours == g._out)
+
+        return dict(
+            (g._names[j], g._edge_data(i, j, kind) if out
+                          else g._edge_data(j, i, kind))
+            for (j, kind) in self.neighbours(i))
+
+    def __iter__(self):
+        return iter(self.graph)
+
+    def __len__(self):
+        return len(self.graph)
+
+
+def from_graph(graph):
+    '''
+    Convert a networkx graph (or graph view) to a CompactGraph.
+    '''
+
+    import cdg
+
+    if isinstance(graph, CompactGraph):
+        return cdg.hot_patch(graph.copy())
+
+    b = Builder('')
+    b.graph.update(graph.graph)
+
+    for (name, attrs) in graph.nodes(data=True):
+        attrs = dict(attrs)
+        parent = attrs.pop('parent', None)
+
+        if parent is not None and parent not in graph:
+            # Keep dangling parent names as plain attributes, as `subgraph`
+            # does, rather than creating nodes for them.
+            attrs['parent'] = parent
+            parent = None
+
+        b.add_node(name, parent=parent, **attrs)
+
+    for (src, dest, attrs) in graph.edges(data=True):
+        b.add_edge(src, dest, **attrs)
+
+    return b.finish()
+
+
+def to_networkx(graph):
+    '''
+    Convert a CompactGraph to a networkx.DiGraph.
+    '''
+
+    import cdg
+
+    g = cdg.create('')
+    g.graph.update(graph.graph)
+
+    names = graph._names
+    live = list(graph._live())
+
+    # Fill in the DiGraph's adjacency dicts directly: add_nodes_from and
+    # add_edges_from cost more than decoding the snapshot did. None of the
+    # dicts created here can be garbage, so don't let the cyclic collector
+    # repeatedly scan them as they pile up.
+    (node, succ, pred) = (g._node, g._succ, g._pred)
+
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        for i in live:
+            attrs = dict(graph._attrs.get(i, ()))
+
+            p = graph.parent_id(i)
+            if p is not None:
+                attrs['parent'] = names[p]
+
+            if graph._container[i]:
+                attrs['children'] = set(
+                    names[c] for c in graph.child_ids(i))
+
+            name = names[i]
+            node[name] = attrs
+            succ[name] = {}
+            pred[name] = {}
+
+        edge_attrs = graph._edge_attrs
+        (offsets, targets, kinds) = (
+            graph._out_offsets, graph._out_targets, graph._out_kinds)
+        overlay = (graph._shadowed or graph._added_succ
+                   or len(live) < graph._base)
+
+        for u in live:
+            src = names[u]
+            out = succ[src]
+
+            if overlay or u >= graph._base:
+                neighbours = graph._out(u)
+            else:
+                (lo, hi) = (offsets[u], offsets[u + 1])
+                neighbours = zip(targets[lo:hi], kinds[lo:hi])
+
+            for (v, kind) in neighbours:
+                dest = names[v]
+                data = {} if kind == NoKind else {'kind': kind}
+                if edge_attrs:
+                    data.update(edge_attrs.get((u, v), ()))
+
+                out[dest] = data
+                pred[dest][src] = data
+    finally:
+        if collecting:
+            gc.enable()
+
+    return g
@@ -0,0 +1,251 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Condensations of CDGs: the DAGs of their strongly connected components.
+
+Recursive calls and data-flow loops make up strongly connected components
+(SCCs) in which every node reaches every other. A `Condensation` finds them
+once, records the members of each component and keeps the DAG of edges
+between components, which is often much smaller than the graph itself.
+
+After `attach(graph)`, cdg.query.reachable answers queries without a depth
+limit by searching the DAG and only expanding components into their members
+for the result. A condensation records the graph's version (see cdg.Graph)
+and is rebuilt if the graph changes.
+
+`Condensation.to_graph` turns the DAG back into a CDG, in which each
+component with more than one member becomes a single node, for saving or
+drawing.
+'''
+
+import threading
+
+import cdg
+import cdg.reach
+import cdg.simplify
+
+
+def condense(graph, kinds=cdg.EdgeKind.All):
+    '''
+    Find the strongly connected components of a graph's edges of some kinds
+    (an EdgeKind mask).
+    '''
+
+    return Condensation(graph, kinds)
+
+
+def attach(graph):
+    '''
+    Answer reachability queries about a graph by searching its condensation.
+    '''
+
+    graph.condensations = {}
+    graph.condensation_lock = threading.Lock()
+
+
+def lookup(graph, kinds):
+    '''
+    The up-to-date condensation of a graph for an EdgeKind mask, or None if
+    the graph doesn't use condensations.
+    '''
+
+    condensations = getattr(graph, 'condensations', None)
+    if condensations is None:
+        return None
+
+    with graph.condensation_lock:
+        c = condensations.get(kinds)
+        if c is None or c.version != cdg.reach.version(graph):
+            c = condensations[kinds] = Condensation(graph, kinds)
+
+    return c
+
+
+class Condensation:
+    '''
+    The strongly connected components of a graph and the DAG between them.
+
+    Components are numbered in topological order: every DAG edge goes from a
+    lower-numbered component to a higher-numbered one.
+    '''
+
+    def __init__(self, graph, kinds=cdg.EdgeKind.All):
+        self.graph = graph
+        self.kinds = kinds
+        self.version = cdg.reach.version(graph)
+
+        self.order = cdg.reach.node_order(graph)
+        (self.names, adjacent) = cdg.reach.adjacency(graph, kinds, False,
+                                                     self.order)
+
+        # Components are numbered in the order that they're found: visit
+        # neighbours in a fixed order so that the numbers (and so the names
+        # of collapsed nodes) don't depend on how the graph was loaded.
+        adjacent = [sorted(neighbours) for neighbours in adjacent]
+        (self.component, count) = cdg.reach.components(adjacent)
+        self.members = cdg.reach.members(self.component, count)
+
+        successors = [set() for _ in range(count)]
+        for (u, neighbours) in enumerate(adjacent):
+            c = self.component[u]
+            for v in neighbours:
+                d = self.component[v]
+                if d != c:
+                    successors[c].add(d)
+
+        predecessors = [[] for _ in range(count)]
+        for (c, following) in enumerate(successors):
+            for d in following:
+                predecessors[d].append(c)
+
+        self.successors = [sorted(s) for s in successors]
+        self.predecessors = predecessors
+
+    def __len__(self):
+        return len(self.members)
+
+    def number_of_edges(self):
+        return sum(len(s) for s in self.successors)
+
+    def component_of(self, name):
+        '''
+        The number of a node's component, or None.
+        '''
+
+        u = cdg.reach.local_number(self.graph, self.order, name)
+        return None if u is None else self.component[u]
+
+    def member_names(self, c):
+        return [self.names[u] for u in self.members[c]]
+
+    def cycles(self):
+        '''
+        The components with more than one member, largest first.
+        '''
+
+        nontrivial = [c for (c, m) in enumerate(self.members) if len(m) > 1]
+        return sorted(nontrivial, key=lambda c: -len(self.members[c]))
+
+    def reachable(self, starting_nodes, reverse=False):
+        '''
+        The names of all nodes reachable from the given nodes along the
+        condensed kinds of edges.
+        '''
+
+        following = self.predecessors if reverse else self.successors
+        seen = set()
+        for n in starting_nodes:
+            c = self.component_of(n)
+            if c is not None:
+                seen.add(c)
+
+        frontier = list(seen)
+        while frontier:
+            found = []
+            for c in frontier:
+                for d in following[c]:
+                    if d not in seen:
+                        seen.add(d)
+                        found.append(d)
+
+            frontier = found
+
+        names = self.names
+        return set(names[u] for c in seen for u in self.members[c])
+
+    def to_graph(self):
+        '''
+        The condensed graph: a CDG with one node per component.
+
+        A component with one member keeps its name and attributes. A larger
+        component becomes a node named `scc<number>`, with a `members`
+        attribute listing the nodes that it replaces, which stays within the
+        members' function (or block) if they share one. Edges between the
+        same components are merged into one, of the highest-precedence kind
+        among them (see cdg.simplify.merge_kinds); edges within a component
+        are dropped.
+        '''
+
+        graph = self.graph
+        nodes = graph.nodes
+        name = self.component_name
+
+        result = cdg.create('')
+        result.graph.update(graph.graph)
+
+        containers = {}
+        for c in range(len(self.members)):
+            members = self.member_names(c)
+
+            if len(members) == 1:
+                attrs = dict(nodes[members[0]])
+            else:
+                attrs = {
+                    'members': sorted(members),
+                    'description': '%d strongly connected nodes' % (
+                        len(members)),
+                }
+
+                parents = set(nodes[m].get('parent') for m in members)
+                if len(parents) == 1:
+                    attrs['parent'] = parents.pop()
+
+            # Children are recovered from the new parent links below
+            if 'children' in attrs:
+                attrs['children'] = containers[name(c)] = set()
+
+            result.add_node(name(c), **attrs)
+
+        for (n, attrs) in result.nodes.items():
+            parent = attrs.get('parent')
+            if parent not in graph:
+                continue
+
+            # A parent that was merged into a component isn't a container
+            # any more, so the node is left at the top level.
+            parent = name(self.component_of(parent))
+            if parent in containers:
+                attrs['parent'] = parent
+                containers[parent].add(n)
+            else:
+                del attrs['parent']
+
+        kinds = {}
+        for (src, dest, attrs) in graph.edges(data=True):
+            (c, d) = (self.component_of(src), self.component_of(dest))
+            if c == d and len(self.members[c]) > 1:
+                continue
+
+            kinds.setdefault((name(c), name(d)), []).append(attrs.get('kind'))
+
+        for ((src, dest), merged) in kinds.items():
+            kind = cdg.simplify.merge_kinds(merged)
+            if kind is None:
+                result.add_edge(src, dest)
+            else:
+                result.add_edge(src, dest, kind=kind)
+
+        return result
+
+    def component_name(self, c):
+        members = self.members[c]
+        if len(members) == 1:
+            return self.names[members[0]]
+
+        name = 'scc%d' % c
+        while name in self.graph:
+            name += "'"
+
+        return name
@@ -0,0 +1,469 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Content hashes of CDG functions, for comparing graphs without loading them.
+
+A function's hash covers everything that `cdg.build` reads about it: its
+attributes, arguments, blocks, values, calls and flows. Calls are hashed as
+the edges that `cdg.build` resolves them to (e.g., a call to `foo` becomes
+edges to `foo`'s arguments), and flows as the edges that they become (of
+which there is one per source and destination), so a source document and
+the same graph saved by cdg.save hash alike. Edges are hashed in sorted
+order, so the order that a graph was saved in doesn't matter either. A
+graph's root hash covers its functions' names and hashes, so two files with
+the same root hash describe the same graph.
+
+Saving a graph, or loading a file in streaming mode, records the hashes of
+its functions in the cache directory (see cdg.cache), keyed by the file's
+path, size and modification time. For a .cdg file, the record also says
+where each function's entry is in the file. `diff` compares two files' root
+hashes, then their functions' hashes, and only decodes the functions whose
+hashes differ (reading just their entries from a .cdg file) to find the
+nodes and edges that were added or removed.
+'''
+
+import hashlib
+import io
+import json
+import os
+
+import cdg
+import cdg.cache
+import cdg.snapshot
+import cdg.stats
+import cdg.stream
+
+
+Version = 2
+
+
+class Digest:
+    '''
+    The hashes of a graph's functions, the targets of calls to them (see
+    cdg.call_targets) and, for a .cdg file, the spans of their entries.
+    '''
+
+    def __init__(self, hashes=None, spans=None, root=None, targets=None):
+        self._hashes = hashes or {}
+        self.targets = targets or {}
+        self.spans = spans
+        self._root = root
+
+        # Functions whose calls can't be resolved (and hashed) until their
+        # callees are known, or the end of the graph is reached
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def hashes(self):
+        if self._pending:
+            for (name, props) in self._pending.items():
+                self._hashes[name] = function_hash(props, self.targets)
+            self._pending = {}
+
+        return self._hashes
+
+    def add(self, name, props, span=None):
+        self.targets[name] = cdg.call_targets(props)
+        if all(c['to'] in self.targets for c in props.get('calls') or ()):
+            self._hashes[name] = function_hash(props, self.targets)
+        else:
+            self._pending[name] = props
+
+        self._root = None
+        if span is not None:
+            if self.spans is None:
+                self.spans = {}
+            self.spans[name] = span
+
+    def root(self):
+        if self._root is None:
+            h = hashlib.blake2b(digest_size=16)
+            for name in sorted(self.hashes):
+                h.update(('%s\0%s\n' % (name, self.hashes[name])).encode(
+                    'utf-8', 'surrogateescape'))
+
+            self._root = h.hexdigest()
+
+        return self._root
+
+    def to_json(self, stamp):
+        return {
+            'version': Version,
+            'stamp': stamp,
+            'root': self.root(),
+            'hashes': self.hashes,
+            'targets': self.targets,
+            'spans': self.spans,
+        }
+
+    @classmethod
+    def from_json(cls, record):
+        spans = record.get('spans')
+        if spans is not None:
+            spans = dict((name, tuple(s)) for (name, s) in spans.items())
+
+        return cls(record['hashes'], spans, record['root'],
+                   record.get('targets'))
+
+
+def function_hash(props, targets):
+    '''
+    Hash a function's properties (as read by `cdg.build`), given the call
+    targets of the functions in the graph.
+    '''
+
+    canonical = {}
+    for (key, value) in props.items():
+        if value and key not in ('calls', 'flows'):
+            canonical[key] = value
+
+    canonical['edges'] = sorted(
+        (u, v, attrs.get('kind') or '', sorted(
+            (k, x) for (k, x) in attrs.items() if k != 'kind'))
+        for ((u, v), attrs) in edge_map(props, targets))
+
+    data = json.dumps(canonical, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False, check_circular=False, default=str)
+
+    return hashlib.blake2b(data.encode('utf-8', 'surrogateescape'),
+                           digest_size=16).hexdigest()
+
+
+def edge_map(props, targets):
+    '''
+    The edges that `cdg.build` adds for a function's flows and calls, as
+    ((source, destination), attributes) pairs. A later edge between the same
+    nodes updates the attributes of an earlier one, and calls are added
+    after flows.
+    '''
+
+    result = {}
+    for flow in props.get('flows') or ():
+        attrs = cdg.edge_attributes(flow)
+        if flow.get('kind') is not None:
+            attrs['kind'] = flow['kind']
+        result.setdefault((flow['from'], flow['to']), {}).update(attrs)
+
+    for call in props.get('calls') or ():
+        attrs = dict(cdg.edge_attributes(call), kind='call')
+        for key in resolve([call], targets):
+            result.setdefault(key, {}).update(attrs)
+
+    return result.items()
+
+
+def resolve(calls, targets):
+    '''
+    The (source, destination) call edges that `cdg.build` adds for some
+    calls, given the call targets of the functions in the graph.
+    '''
+
+    edges = set()
+    for call in calls or ():
+        (source, dest) = (call['from'], call['to'])
+        t = targets.get(dest)
+        edges.update((source, d) for d in ([dest] if t is None else t))
+
+    return edges
+
+
+def recording(functions, digest, stream=None):
+    '''
+    Hash the functions that pass through an iterable of (name, properties)
+    pairs, e.g., on their way to being written out or built into a graph.
+
+    If `stream` is a .cdg stream that the functions are being written to,
+    the span of each function's entry is recorded too.
+    '''
+
+    if stream is None:
+        for (name, props) in functions:
+            yield (name, props)
+            digest.add(name, props)
+        return
+
+    # Each function is written after it is yielded
+    for (name, props) in functions:
+        start = stream.tell()
+        yield (name, props)
+        digest.add(name, props, (start, stream.tell()))
+
+
+def reading(stream, filename):
+    '''
+    Iterate over the functions in a file (as cdg.stream.functions does),
+    recording their hashes if they aren't already.
+    '''
+
+    s = file_stamp(filename)
+    if s is None or lookup(filename, s) is not None:
+        yield from cdg.stream.functions(stream, filename)
+        return
+
+    digest = Digest()
+    yield from hashed(stream, filename, digest)
+    store(filename, s, digest)
+
+
+def hashed(stream, filename, digest):
+    '''
+    Iterate over the functions in a .cdg or .json stream, hashing them (and
+    noting the spans of a seekable .cdg stream's entries) into a digest.
+    '''
+
+    if filename.endswith('.cdg') and seekable(stream):
+        for (name, props, span) in cdg.stream.ubjson_functions(stream, True):
+            yield (name, props)
+            digest.add(name, props, span)
+    else:
+        yield from recording(cdg.stream.functions(stream, filename), digest)
+
+
+def saved(output, filename, digest):
+    '''
+    Record the hashes of a graph that has just been saved to a file.
+    '''
+
+    if getattr(output, 'name', None) != filename:
+        return
+
+    try:
+        output.flush()
+        st = os.fstat(output.fileno())
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return
+
+    store(filename, stat_stamp(st), digest)
+
+
+@cdg.stats.measured('digest')
+def of(filename):
+    '''
+    The digest of a graph file, computed (and recorded) if need be.
+    '''
+
+    cdg.stats.note(filename=filename)
+
+    s = file_stamp(filename)
+    digest = lookup(filename, s)
+    if digest is not None:
+        return digest
+
+    digest = Digest()
+    for _ in functions(filename, digest):
+        pass
+
+    store(filename, s, digest)
+    return digest
+
+
+def functions(filename, digest=None):
+    '''
+    Iterate over all of the functions in a graph file, hashing them into
+    `digest` if it is given.
+    '''
+
+    if filename.endswith('.cdgc'):
+        graph = cdg.snapshot.open_mapped(filename)
+        records = cdg.function_records(graph)
+        yield from records if digest is None else recording(records, digest)
+        return
+
+    with open(filename, 'rb') as f:
+        if filename.endswith(('.cdg', '.json')):
+            yield from cdg.stream.functions(f, filename) if digest is None \
+                else hashed(f, filename, digest)
+
+        else:
+            records = cdg.decode(f, filename)['functions'].items()
+            yield from records if digest is None \
+                else recording(records, digest)
+
+
+def fetch(filename, digest, names):
+    '''
+    Decode some functions of a graph file, returning a dict of their
+    properties.
+    '''
+
+    names = set(names)
+    if not names:
+        return {}
+
+    if digest.spans is not None:
+        spans = sorted(digest.spans[n] for n in names)
+        with open(filename, 'rb') as f:
+            return dict(cdg.stream.read_span(f, s) for s in spans)
+
+    return dict((name, props) for (name, props) in functions(filename)
+                if name in names)
+
+
+@cdg.stats.measured('diff')
+def diff(old, new):
+    '''
+    Compare two graph files, returning a Change for each function that was
+    added, removed or modified, in name order.
+    '''
+
+    (a, b) = (of(old), of(new))
+    if a.root() == b.root():
+        return []
+
+    changed = sorted(
+        name for name in set(a.hashes) | set(b.hashes)
+        if a.hashes.get(name) != b.hashes.get(name))
+    cdg.stats.note(functions=len(changed))
+
+    before = fetch(old, a, [n for n in changed if n in a.hashes])
+    after = fetch(new, b, [n for n in changed if n in b.hashes])
+
+    return [Change(n, before.get(n), after.get(n), a.targets, b.targets)
+            for n in changed]
+
+
+class Change:
+    '''
+    The differences between two versions of a function: the nodes and edges
+    (as (source, destination, kind) tuples) that were added or removed, and
+    the nodes whose attributes changed.
+    '''
+
+    def __init__(self, name, old, new, old_targets=None, new_targets=None):
+        self.name = name
+
+        if old is None:
+            self.status = 'added'
+        elif new is None:
+            self.status = 'removed'
+        else:
+            self.status = 'modified'
+
+        (old_nodes, new_nodes) = (nodes(old), nodes(new))
+        (old_edges, new_edges) = (edges(old, old_targets),
+                                  edges(new, new_targets))
+
+        self.nodes_added = sorted(set(new_nodes) - set(old_nodes))
+        self.nodes_removed = sorted(set(old_nodes) - set(new_nodes))
+        self.edges_added = sorted(new_edges - old_edges, key=str)
+        self.edges_removed = sorted(old_edges - new_edges, key=str)
+        self.attributes_changed = sorted(
+            n for n in set(old_nodes) & set(new_nodes)
+            if old_nodes[n] != new_nodes[n])
+
+        if old is not None and new is not None \
+                and (old.get('attributes') or {}) != \
+                (new.get('attributes') or {}):
+            self.attributes_changed.insert(0, name)
+
+    def __repr__(self):
+        return '<Change %s %s: %s>' % (self.status, self.name,
+                                       self.summary())
+
+    def summary(self):
+        return '+%d/-%d nodes, +%d/-%d edges' % (
+            len(self.nodes_added), len(self.nodes_removed),
+            len(self.edges_added), len(self.edges_removed))
+
+
+def nodes(props):
+    '''
+    The nodes that a function's properties describe, with their attributes.
+    '''
+
+    if props is None:
+        return {}
+
+    result = {}
+    for (name, attrs) in (props.get('arguments') or {}).items():
+        result[name] = attrs
+
+    for (block, values) in (props.get('blocks') or {}).items():
+        result[block] = {}
+        for (name, attrs) in values.items():
+            result[name] = attrs
+
+    return result
+
+
+def edges(props, targets=None):
+    '''
+    A function's edges, as (source, destination, kind) tuples, with its
+    calls resolved as `cdg.build` would resolve them with `targets`.
+    '''
+
+    if props is None:
+        return set()
+
+    return set((u, v, attrs.get('kind'))
+               for ((u, v), attrs) in edge_map(props, targets or {}))
+
+
+def record_path(filename):
+    path = os.path.abspath(filename).encode('utf-8', 'surrogateescape')
+    return os.path.join(cdg.cache.directory(), 'digests',
+                        hashlib.sha256(path).hexdigest() + '.json')
+
+
+def file_stamp(filename):
+    try:
+        return stat_stamp(os.stat(filename))
+    except OSError:
+        return None
+
+
+def stat_stamp(st):
+    return '%d %d' % (st.st_size, st.st_mtime_ns)
+
+
+def lookup(filename, stamp):
+    '''
+    The recorded digest of a file, or None if there isn't an up-to-date one.
+    '''
+
+    if stamp is None or not cdg.cache.enabled():
+        return None
+
+    try:
+        with open(record_path(filename)) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if record.get('version') != Version or record.get('stamp') != stamp:
+        return None
+
+    return Digest.from_json(record)
+
+
+def store(filename, stamp, digest):
+    if stamp is None or not cdg.cache.enabled():
+        return
+
+    data = json.dumps(digest.to_json(stamp)).encode('utf-8')
+    try:
+        cdg.cache.atomic_write(record_path(filename), data)
+    except OSError:
+        pass
+
+
+def seekable(stream):
+    try:
+        return stream.seekable()
+    except (AttributeError, ValueError):
+        return False
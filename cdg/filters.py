@@ -21,7 +21,11 @@
 # limitations under the License.
 #
 
+import cdg.compact
+import cdg.names
 import cdg.query
+import cdg.stats
+import re
 
 
 class FilterError(Exception):
@@ -37,19 +41,98 @@ class FilterError(Exception):
         self.message = message
 
 
+# Reachability filters: (edge kinds, reverse, annotations, description)
+Traversals = {
+    'calls-from': (cdg.EdgeKind.mask(cdg.EdgeKind.Call), False,
+                   {'call': 'root'}, 'successors'),
+    'calls-to': (cdg.EdgeKind.mask(cdg.EdgeKind.Call), True,
+                 {'call': 'target'}, 'predecessors'),
+    'flows-from': (cdg.EdgeKind.All, False, {'flow': 'source'}, 'successors'),
+    'flows-to': (cdg.EdgeKind.All, True, {'flow': 'sink'}, 'predecessors'),
+}
+
+# Annotations of the ends of the paths that a path filter finds
+PathEnds = ({'path': 'source'}, {'path': 'target'})
+
+# Names of edge kinds in filter specs, with their EdgeKind masks
+EdgeKinds = dict(
+    [(cdg.EdgeKind.to_str(k), cdg.EdgeKind.mask(k))
+     for k in range(cdg.EdgeKind.All.bit_length())]
+    + [('all', cdg.EdgeKind.All)]
+)
+
+
+def parse(filter_spec):
+    '''
+    Split a filter spec into its name, edge kinds, arguments and depth limit.
+
+    Fields are separated by single colons, so that node names like
+    `fn::block::value` can be used as arguments; arguments may also be
+    patterns like `sys_*` (see cdg.names). A reachability filter's
+    name may be followed by the kinds of edges to follow instead of its
+    usual ones, as in `flows-to[memory,operand]:x`; if it isn't, the kinds
+    are None.
+
+    A path filter, `path[kinds]:source,target:count`, finds the shortest
+    paths (by default, just one) from a source to a target, either of which
+    may be a pattern. Its count is returned in place of a depth limit.
+    '''
+
+    tokens = re.split('(?<!:):(?!:)', filter_spec)
+    match = re.match(r'([^[]*)(?:\[([^]]*)\])?$', tokens[0])
+    if match is None:
+        raise FilterError(filter_spec, 'Invalid filter')
+
+    (name, kind_names) = match.groups()
+    kinds = None
+
+    if kind_names is not None:
+        if name not in Traversals and name != 'path':
+            raise FilterError(filter_spec, 'Filter does not follow edges')
+
+        kinds = 0
+        for k in kind_names.split(','):
+            kind = EdgeKinds.get(k.strip())
+            if kind is None:
+                raise FilterError(filter_spec, 'Invalid edge kind: %s' % k)
+            kinds |= kind
+
+    args = tokens[1].split(',') if len(tokens) > 1 else []
+    depth_limit = int(tokens[2]) if len(tokens) > 2 else None
+
+    return (name, kinds, args, depth_limit)
+
+
+def traversal(filter_spec, name, kinds=None):
+    '''
+    A reachability filter's (edge kinds, reverse, annotations, description),
+    following the given kinds of edges rather than its usual ones.
+    '''
+
+    if name not in Traversals:
+        raise FilterError(filter_spec, 'Invalid filter')
+
+    (usual, reverse, annotations, description) = Traversals[name]
+    return (usual if kinds is None else kinds, reverse, annotations,
+            description)
+
+
+@cdg.stats.measured('filter')
 def apply(filter_spec, graph):
     '''
     Apply a filter like calls-to:read,write or flows-from:main to a graph.
+
+    The input graph is not modified: the filter's annotations (e.g.,
+    call='target') are only set on the returned graph.
     '''
 
-    tokens = filter_spec.split(':')
-    name = tokens[0]
-    args = tokens[1].split(',')
-    depth_limit = int(tokens[2]) if len(tokens) > 2 else None
+    cdg.stats.note(spec=filter_spec)
+    (name, kinds, args, depth_limit) = parse(filter_spec)
+
+    if name == 'path':
+        return apply_all([filter_spec], graph)
 
-    def get_neighbours(select_fn, **annotations):
-        return cdg.query.transitive_neighbours(graph, args, select_fn,
-                                               annotations, depth_limit)
+    args = cdg.names.expand(graph, args)
 
     if name == 'identity':
         return graph
@@ -57,48 +140,221 @@ def apply(filter_spec, graph):
     elif name == 'exclude':
         return exclude(graph, args)
 
-    elif name == 'calls-from':
-        select_fn = lambda node: cdg.query.succ(graph, node, is_call)
-        nodes = get_neighbours(select_fn, call='root')
-        description = 'successors'
+    (kinds, reverse, annotations, description) = traversal(
+        filter_spec, name, kinds)
+    nodes = cdg.query.reachable(graph, args, kinds, reverse,
+                                depth_limit=depth_limit)
 
-    elif name == 'calls-to':
-        select_fn = lambda node: cdg.query.pred(graph, node, is_call)
-        nodes = get_neighbours(select_fn, call='target')
-        description = 'predecessors'
+    return keep(graph, nodes, args, annotations, description)
 
-    elif name == 'flows-from':
-        select_fn = lambda node: cdg.query.succ(graph, node, lambda _: True)
-        nodes = get_neighbours(select_fn, flow='source')
-        description = 'successors'
 
-    elif name == 'flows-to':
-        select_fn = lambda node: cdg.query.pred(graph, node, lambda _: True)
-        nodes = get_neighbours(select_fn, flow='sink')
-        description = 'predecessors'
+@cdg.stats.measured('filter-pipeline')
+def apply_all(filter_specs, graph):
+    '''
+    Apply a pipeline of filters, each to the result of the one before.
 
-    else:
-        raise FilterError(filter_spec, 'Invalid filter')
+    This gives the same result as calling `apply` for each spec in turn, but
+    no intermediate graph is built: each filter narrows down a set of nodes
+    to keep (searching only the nodes that are still kept) and the result is
+    materialised once, at the end. The exception is a path filter, which
+    keeps only the edges along its paths: the filters after it search its
+    materialised result.
+    '''
+
+    nodes = None
+    annotations = {}
+
+    # Path filters keep only the edges along their paths
+    edges = None
+
+    for spec in filter_specs:
+        (name, kinds, args, depth_limit) = parse(spec)
+
+        if edges is not None:
+            graph = narrowed(graph, nodes, annotations, edges)
+            (nodes, annotations, edges) = (None, {}, None)
+
+        if name == 'path':
+            paths = find_paths(spec, graph, kinds, args, depth_limit, nodes)
+
+            found = set(n for p in paths for n in p)
+            along = set((p[i], p[i + 1]) for p in paths
+                        for i in range(len(p) - 1))
+            edges = along
+
+            also_keep = parents(graph, found, nodes)
+
+            print('Keeping %d nodes on %d paths (and %d parents)' % (
+                len(found), len(paths), len(also_keep)))
+
+            for p in paths:
+                annotations.setdefault(p[0], {}).update(PathEnds[0])
+                annotations.setdefault(p[-1], {}).update(PathEnds[1])
+
+            nodes = found.union(also_keep)
+            continue
+
+        args = cdg.names.expand(graph, args)
+
+        if name == 'identity':
+            continue
+
+        elif name == 'exclude':
+            before = len(graph) if nodes is None else len(nodes)
+            nodes = set(graph if nodes is None else nodes).difference(args)
+            print('Removed %d nodes' % (before - len(nodes)))
+            continue
+
+        (kinds, reverse, attrs, description) = traversal(spec, name, kinds)
+        found = cdg.query.reachable(graph, args, kinds, reverse,
+                                    depth_limit=depth_limit, within=nodes)
+
+        also_keep = parents(graph, found, nodes)
+
+        print('Keeping %d %s of %d nodes (and %d parents)' % (
+            len(found), description, len(args), len(also_keep)))
+
+        for n in args:
+            if n in found:
+                annotations.setdefault(n, {}).update(attrs)
+
+        nodes = found.union(also_keep)
+
+    if nodes is None:
+        return graph
+
+    return narrowed(graph, nodes, annotations, edges)
+
+
+def narrowed(graph, nodes, annotations, edges=None):
+    '''
+    The subgraph of the nodes that a pipeline kept, with its annotations
+    and, if `edges` isn't None, only those edges.
+    '''
+
+    result = materialise(graph, nodes)
+    for (n, attrs) in annotations.items():
+        if n in result:
+            result.nodes[n].update(attrs)
+
+    if edges is not None:
+        for (u, v) in [e for e in result.edges() if e not in edges]:
+            result.remove_edge(u, v)
+
+    return cdg.hot_patch(result)
+
+
+def parents(graph, nodes, within=None):
+    '''
+    The ancestors (blocks and functions) of some nodes that aren't among
+    them, so that a filter's result keeps the hierarchy that its nodes are
+    saved in. If `within` is given, only ancestors in it are kept.
+    '''
+
+    attrs = graph.nodes
+    nodes = set(nodes)
+    found = set()
 
-    also_keep = set()
     for n in nodes:
-        node = graph.nodes[n]
-        if 'parent' in node:
-            also_keep.add(node['parent'])
+        parent = attrs[n].get('parent')
+        while parent in graph and parent not in found \
+                and parent not in nodes \
+                and (within is None or parent in within):
+            found.add(parent)
+            parent = attrs[parent].get('parent')
+
+    return found
+
+
+def find_paths(filter_spec, graph, kinds, args, count, within=None):
+    '''
+    The shortest paths that a path filter asks for, as lists of node names.
+    '''
+
+    if len(args) != 2:
+        raise FilterError(filter_spec, 'Expected a source and a target')
+
+    (sources, targets) = (cdg.names.expand(graph, [a]) for a in args)
+    if kinds is None:
+        kinds = cdg.EdgeKind.All
+
+    return cdg.query.shortest_paths(graph, sources, targets, kinds,
+                                    count or 1, within)
+
+
+@cdg.stats.measured('filter-batch')
+def apply_batch(filter_specs, graph):
+    '''
+    Apply each of many filters to the same graph.
+
+    Reachability filters with the same name, edge kinds and depth limit
+    (e.g., a flows-to filter for each of several hundred sinks) are answered
+    together by one multi-source traversal (see cdg.query.reachable_sets)
+    rather than one traversal each. Returns one filtered graph per spec.
+    '''
+
+    results = [None] * len(filter_specs)
+    batches = {}
+
+    for (i, spec) in enumerate(filter_specs):
+        (name, kinds, args, depth_limit) = parse(spec)
+        if name in Traversals:
+            args = cdg.names.expand(graph, args)
+            batches.setdefault((name, kinds, depth_limit), []).append(
+                (i, spec, args))
+        else:
+            results[i] = apply(spec, graph)
+
+    for ((name, kinds, depth_limit), batch) in batches.items():
+        (kinds, reverse, annotations, description) = traversal(
+            batch[0][1], name, kinds)
+        reached = cdg.query.reachable_sets(
+            graph, [args for (_, _, args) in batch], kinds, reverse,
+            depth_limit)
+
+        for ((i, _, args), nodes) in zip(batch, reached):
+            results[i] = keep(graph, nodes, args, annotations, description)
+
+    return results
+
+
+def keep(graph, nodes, seeds, annotations, description):
+    '''
+    The subgraph of the nodes that a filter found (and their parents), with
+    the filter's annotations on its seeds.
+    '''
+
+    also_keep = parents(graph, nodes)
 
     print('Keeping %d %s of %d nodes (and %d parents)' % (
-        len(nodes), description, len(args), len(also_keep)))
+        len(nodes), description, len(seeds), len(also_keep)))
 
     nodes = nodes.union(also_keep)
 
-    return cdg.hot_patch(graph.subgraph(nodes))
+    result = materialise(graph, nodes)
+    cdg.query.annotate(result, [n for n in seeds if n in result], annotations)
 
+    return cdg.hot_patch(result)
 
-def exclude(graph, to_exclude):
-    result = graph.full_copy()
 
-    for n in to_exclude:
-        result.remove_node(n)
+@cdg.stats.measured('subgraph')
+def materialise(graph, nodes):
+    '''
+    Copy the subgraph induced by some nodes, without sharing attributes.
+    '''
+
+    # A networkx subgraph is a view that shares attributes with its graph
+    result = graph.subgraph(nodes)
+    if not isinstance(result, cdg.compact.CompactGraph):
+        result = result.copy()
+
+    return result
+
+
+def exclude(graph, to_exclude):
+    to_exclude = set(to_exclude)
+    result = cdg.hot_patch(materialise(
+        graph, [n for n in graph if n not in to_exclude]))
 
     print('Removed %d nodes, %d edges' % (
         len(graph.nodes) - len(result.nodes),
@@ -113,9 +369,7 @@ def is_call(attrs):
 
 
 def intersection(G, H):
-    R = G.full_copy()
-    R.remove_nodes_from(n for n in G if n not in H)
-    return R
+    return cdg.hot_patch(materialise(G, [n for n in G if n in H]))
 
 
 def union(G, H):
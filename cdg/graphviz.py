@@ -13,9 +13,8 @@
 # limitations under the License.
 
 import cdg
-import collections
-import networkx
-import pygraphviz
+import cdg.stats
+
 
 class Colour:
     CallRoot = '#ffcc6699'
@@ -24,84 +23,121 @@ class Colour:
     FlowSource = '#99ccff99'
     FlowSink = '#cc666699'
 
+    Cluster = '#66666611'
+
 
+@cdg.stats.measured('dot')
 def dot(graph, output):
     """
     Write GraphViz .dot representation of a graph.
+
+    The file is written directly, in a single walk of the function -> block
+    -> value hierarchy: each cluster's nodes are declared inside a nested
+    `subgraph cluster_*` block, so no cluster ever has to be told about its
+    descendants' descendants. Graph attributes are neither copied nor changed.
     """
 
+    if isinstance(output, str):
+        with open(output, 'w') as f:
+            return dot(graph, f)
+
     nodes = graph.nodes
+    declared = set()
+
+    output.write('digraph {\n')
+    output.write('\tnode [shape=rectangle, style=filled];\n')
+
+    # Clusters whose parents aren't in the graph are top-level subgraphs.
+    for (name, attrs) in nodes.items():
+        if 'children' not in attrs or name in declared:
+            continue
+
+        parent = attrs.get('parent')
+        if parent in nodes and 'children' in nodes[parent]:
+            continue
+
+        declared.add(name)
+        write_cluster(output, nodes, declared, name, attrs, '\t')
+
+    for (name, attrs) in nodes.items():
+        if name not in declared and 'children' not in attrs:
+            write_node(output, name, attrs, '\t')
+
+    for (src, dest, attrs) in graph.edges(data=True):
+        output.write('\t%s -> %s [%s];\n' % (
+            quote(src), quote(dest), attr_list(edge_attrs(attrs))))
+
+    output.write('}\n')
+
+
+def write_cluster(output, nodes, declared, name, attrs, indent):
+    """
+    Write a cluster as a subgraph, declaring its (not yet declared) children
+    inside it.
+    """
+
+    output.write('%ssubgraph %s {\n' % (indent, quote('cluster_' + name)))
+    output.write('%s\tgraph [%s];\n' % (indent, attr_list({
+        'fillcolor': Colour.Cluster,
+        'label': name,
+        'style': 'filled',
+    })))
+
+    for child in sorted(c for c in attrs['children'] if c in nodes):
+        if child in declared:
+            continue
+        declared.add(child)
 
-    def graph_name(name):
-        """
-        The final name of a graph node may be prefixed with 'cluster_' if the
-        node is, in fact, a subgraph. This is a requirement for GraphViz layout
-        algorithms that know how to draw subgraphs.
-        """
-        return 'cluster_' + name if 'children' in nodes[name] else name
-
-    parents = dict([
-        (name, { graph_name(c) for c in attrs['children'] })
-            for (name,attrs) in nodes.items()
-            if 'children' in attrs
-    ])
-
-    leaves = { n for n in nodes if n not in parents }
-
-    #
-    # We need to generate a pygraphviz object ourselves because NetworkX's
-    # built-in pygraphviz support doesn't let us build hierarchies of subgraphs
-    # within subgraphs.
-    #
-    pgv = pygraphviz.AGraph(directed=True)
-    pgv.node_attr['shape'] = 'rectangle'
-    pgv.node_attr['style'] = 'filled'
-
-    # In order to display recursive clusters of nodes, we need to add all leaf
-    # nodes (but no subgraph nodes) to the top-level graph.
-    for name in leaves:
-        pgv.add_node(name, **node_attrs(graph.nodes[name]))
-
-    # Add subgraphs, starting from the root, using our hierarchical naming
-    # system to ensure that we always generate a subgraph before its
-    # sub-sub-graphs. 
-    clusters = {}
-
-    for name in sorted(parents, key=lambda name: len(name)):
-        attrs = nodes[name]
-        children = all_children(attrs, nodes)
-
-        g = clusters[attrs['parent']] if 'parent' in attrs else pgv
-        sub = g.add_subgraph(children, fillcolor='#66666611', label=name,
-            name='cluster_'+name, style='filled')
-        clusters[name] = sub
-
-    for (src,dest,attrs) in graph.edges(data = True):
-        pgv.add_edge(src, dest, **edge_attrs(attrs))
-
-    pgv.write(output)
-
-
-def all_children(node, nodes):
+        child_attrs = nodes[child]
+        if 'children' in child_attrs:
+            write_cluster(output, nodes, declared, child, child_attrs,
+                          indent + '\t')
+        else:
+            write_node(output, child, child_attrs, indent + '\t')
+
+    output.write('%s}\n' % indent)
+
+
+def write_node(output, name, attrs, indent):
+    output.write('%s%s [%s];\n' % (
+        indent, quote(name), attr_list(node_attrs(attrs))))
+
+
+def agraph(graph):
     """
-    Recursively find all children of a graph node.
+    Convert a graph to a pygraphviz.AGraph (requires pygraphviz).
     """
-    children = node['children']
 
-    for c in children:
-        child = nodes[c]
-        if 'children' in child:
-            children = children.union(all_children(child, nodes))
+    import io
+    import pygraphviz
 
-    return children
+    buf = io.StringIO()
+    dot(graph, buf)
+
+    return pygraphviz.AGraph(string=buf.getvalue())
+
+
+def quote(value):
+    """
+    Quote a GraphViz ID.
+    """
+
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return '"%s"' % value
+
+
+def attr_list(attrs):
+    return ', '.join(
+        '%s=%s' % (quote(k), quote(v)) for (k, v) in sorted(attrs.items()))
 
 
 def edge_attrs(attrs):
     """
-    Decorate a graph edge.
+    Decorate a graph edge, returning a new attribute dict.
     """
 
-    kind = attrs['kind']
+    attrs = dict(attrs)
+    kind = attrs.get('kind')
 
     if kind == cdg.EdgeKind.Call:
         attrs['color'] = '#ff66ffff'
@@ -115,17 +151,16 @@ def edge_attrs(attrs):
     elif kind == cdg.EdgeKind.Operand:
         attrs['color'] = '#66666633'
 
-    else:
-        assert False    # invalid EdgeKind
-
     return attrs
 
 
 def node_attrs(attrs):
     """
-    Decorate a graph node.
+    Decorate a graph node, returning a new attribute dict.
     """
 
+    attrs = dict(attrs)
+
     callend = attrs['call'] if 'call' in attrs else None
     flowend = attrs['flow'] if 'flow' in attrs else None
 
@@ -170,4 +205,11 @@ def node_attrs(attrs):
     elif source or root:
         attrs['shape'] = 'doublecircle'
 
+    # Strongly connected components (see cdg.condense):
+    members = attrs.pop('members', None)
+    if members is not None:
+        attrs['xlabel'] = '%d nodes' % len(members)
+        attrs['tooltip'] = '\n'.join(members)
+        attrs['shape'] = 'box3d'
+
     return attrs
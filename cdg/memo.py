@@ -0,0 +1,239 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Memoised traversal results, for graphs that are asked the same questions
+over and over.
+
+After `attach(graph)`, cdg.query.reachable remembers the nodes that each
+breadth-first search finds, keyed by its seeds (sorted, without the ones
+that aren't in the graph), edge kinds and direction. Results are kept level
+by level, so a search to depth N also answers the same query to any depth up
+to N, and one that ran out of nodes answers it to any depth at all.
+
+The least-recently-used results are evicted once the memo's estimated size
+goes over its budget. A memo records the graph's version (see cdg.Graph) and
+is emptied when the graph changes. The memo of a graph loaded from a file
+can be kept in the snapshot cache (see cdg.cache) with `persist`, and is
+read back by `attach` the next time the file is loaded.
+'''
+
+import collections
+import json
+import os
+import threading
+
+import cdg
+import cdg.reach
+import cdg.stats
+
+
+Version = 1
+
+Suffix = '.memo'
+
+DefaultBudget = 256 << 20
+
+# Estimated bytes per node in a result (a reference in a tuple) and per
+# result (the key, the tuples of each level and the LRU entry)
+NodeSize = 8
+EntrySize = 512
+
+
+def attach(graph, budget=DefaultBudget):
+    '''
+    Remember the results of searching a graph, up to about `budget` bytes.
+    '''
+
+    memo = Memo(graph, budget)
+
+    filename = cache_path(graph)
+    if filename:
+        try:
+            with open(filename, 'rb') as f:
+                memo.read(f)
+        except (OSError, ValueError, KeyError, TypeError):
+            memo.clear()
+
+    graph.memo = memo
+
+
+def lookup(graph):
+    '''
+    The graph's memo, emptied if the graph has changed since it was filled,
+    or None if the graph doesn't use one.
+    '''
+
+    memo = getattr(graph, 'memo', None)
+    if memo is not None:
+        with memo.lock:
+            if memo.version != cdg.reach.version(graph):
+                memo.clear()
+
+    return memo
+
+
+def persist(graph):
+    '''
+    Keep a graph's memo in the snapshot cache, if it can be kept there.
+    '''
+
+    memo = lookup(graph)
+    filename = cache_path(graph)
+    if memo is None or not filename:
+        return
+
+    import cdg.cache
+    try:
+        cdg.cache.atomic_write(filename, writer=memo.write)
+    except OSError:
+        pass
+
+
+def cache_path(graph):
+    '''
+    Where to keep a graph's memo in the snapshot cache, if it can be kept
+    there: as with cdg.reach indexes, only graphs that are unmodified since
+    they were loaded from (or stored in) the cache have a cache key.
+    '''
+
+    import cdg.cache
+
+    key = cdg.cache.graph_key(graph)
+    if key is None:
+        return None
+
+    return os.path.join(cdg.cache.directory(), '%s-%d%s' % (
+        key, Version, Suffix))
+
+
+class Entry:
+    '''
+    The nodes that a search found at each depth (starting with its seeds),
+    and whether it ran out of nodes to find.
+    '''
+
+    def __init__(self, levels, complete):
+        self.levels = levels
+        self.complete = complete
+        self.size = EntrySize + NodeSize * sum(len(l) for l in levels)
+
+    def depth(self):
+        return len(self.levels) - 1
+
+    def covers(self, depth_limit):
+        return self.complete or bool(depth_limit) \
+            and depth_limit <= self.depth()
+
+    def nodes(self, depth_limit):
+        levels = self.levels
+        if depth_limit:
+            levels = levels[:depth_limit + 1]
+
+        return set().union(*levels)
+
+
+class Memo:
+    '''
+    Search results for one graph, least recently used first.
+    '''
+
+    def __init__(self, graph, budget=DefaultBudget):
+        self.graph = graph
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.version = cdg.reach.version(self.graph)
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def key(starting_nodes, kinds, reverse):
+        return (tuple(sorted(starting_nodes)), kinds, bool(reverse))
+
+    def get(self, starting_nodes, kinds, reverse, depth_limit):
+        '''
+        The names of the nodes that a search would find, or None if no
+        result that we remember answers it.
+        '''
+
+        key = self.key(starting_nodes, kinds, reverse)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not entry.covers(depth_limit):
+                return None
+
+            self.entries.move_to_end(key)
+
+        cdg.stats.note(memoised=True)
+        return entry.nodes(depth_limit)
+
+    def put(self, starting_nodes, kinds, reverse, levels, complete):
+        '''
+        Remember what a search found at each depth.
+        '''
+
+        key = self.key(starting_nodes, kinds, reverse)
+        entry = Entry([tuple(l) for l in levels if l], complete)
+
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None:
+                if old.complete or (old.depth() >= entry.depth()
+                                    and not entry.complete):
+                    return
+
+                self.size -= old.size
+
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.size += entry.size
+
+            while self.size > self.budget and self.entries:
+                (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def write(self, output):
+        '''
+        Write the remembered results to a binary stream as JSON.
+        '''
+
+        with self.lock:
+            data = json.dumps({
+                'version': Version,
+                'entries': [
+                    [list(seeds), kinds, reverse, e.complete,
+                     [list(l) for l in e.levels]]
+                    for ((seeds, kinds, reverse), e) in self.entries.items()
+                ],
+            })
+
+        output.write(data.encode('utf-8'))
+
+    def read(self, stream):
+        '''
+        Read results written by `write`, least recently used first.
+        '''
+
+        data = json.load(stream)
+        if data.get('version') != Version:
+            raise ValueError('Not a memo of version %d' % Version)
+
+        for (seeds, kinds, reverse, complete, levels) in data['entries']:
+            self.put(seeds, kinds, reverse, levels, complete)
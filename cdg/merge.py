@@ -0,0 +1,197 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Merge the CDGs of many translation units into one.
+
+Merging works on documents rather than graphs, so that calls between units
+are resolved exactly as `cdg.load` resolves calls within a file: a function
+that one unit only calls and another defines ends up with the definition's
+arguments, and calls to it point at them.
+
+Each input file is decoded in a worker process and written back out as a
+"run": a UBJSON document whose functions are sorted by name. Runs are then
+merged in a tree, `fan_in` at a time, by streaming through them in name order
+(like the merge step of a merge sort) and combining entries for the same
+function. Every step runs in parallel across a process pool, and no step
+holds more than one input file, or one function per run, in memory.
+'''
+
+import concurrent.futures
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+
+import cdg
+import cdg.stream
+
+
+# Formats that merged graphs can be written in
+Formats = ('.cdg', '.json', '.yaml', '.cdgc')
+
+
+def merge(filenames, output, workers=None, fan_in=16):
+    '''
+    Merge CDG files into one .cdg, .json or .yaml file, or into a .cdgc
+    snapshot (for which the merged graph is built in memory first).
+    '''
+
+    if not output.endswith(Formats):
+        raise ValueError('Unhandled output file type: %s' % output)
+
+    with tempfile.TemporaryDirectory(prefix='cdg-merge-') as tmp:
+        run = merge_runs(filenames, tmp, workers, fan_in)
+
+        if output.endswith('.cdg'):
+            shutil.move(run, output)
+            return
+
+        if output.endswith('.cdgc'):
+            with open(run, 'rb') as f:
+                graph = cdg.build('merged', cdg.stream.functions(f, run),
+                                  compact=True)
+            with open(output, 'wb') as out:
+                cdg.save(graph, out, output)
+            return
+
+        with open(run, 'rb') as f, open(output, 'wb') as out:
+            cdg.stream.write(out, output, cdg.stream.functions(f, run))
+
+
+def load(filenames, compact=False, workers=None, fan_in=16):
+    '''
+    Merge CDG files into a graph.
+    '''
+
+    with tempfile.TemporaryDirectory(prefix='cdg-merge-') as tmp:
+        run = merge_runs(filenames, tmp, workers, fan_in)
+
+        with open(run, 'rb') as f:
+            return cdg.build('merged', cdg.stream.functions(f, run), compact)
+
+
+def merge_runs(filenames, directory, workers=None, fan_in=16):
+    '''
+    Reduce CDG files to a single sorted run in a directory.
+    '''
+
+    if fan_in < 2:
+        raise ValueError('Merge fan-in must be at least 2')
+
+    names = (os.path.join(directory, '%d.cdg' % i) for i in itertools.count())
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        runs = list(pool.map(
+            sort, filenames, [next(names) for _ in filenames]))
+
+        if not runs:
+            runs = [next(names)]
+            write_run(runs[0], [])
+
+        while len(runs) > 1:
+            groups = [runs[i:i + fan_in]
+                      for i in range(0, len(runs), fan_in)]
+
+            # A leftover run on its own can wait for the next level
+            leftover = groups.pop() if len(groups[-1]) == 1 else []
+
+            runs = list(pool.map(
+                reduce, groups, [next(names) for _ in groups])) + leftover
+
+    return runs[0]
+
+
+def sort(filename, run):
+    '''
+    Decode a CDG file and write its functions out as a sorted run.
+    '''
+
+    with open(filename, 'rb') as f:
+        functions = cdg.decode(f, filename)['functions']
+
+    write_run(run, sorted(functions.items(), key=lambda fn: fn[0]))
+    return run
+
+
+def reduce(runs, run):
+    '''
+    Merge sorted runs into one, deleting the inputs.
+    '''
+
+    files = [open(r, 'rb') for r in runs]
+    try:
+        streams = [cdg.stream.functions(f, r) for (f, r) in zip(files, runs)]
+        merged = heapq.merge(*streams, key=lambda fn: fn[0])
+
+        write_run(run, (
+            (name, combine(props for (_, props) in entries))
+            for (name, entries) in itertools.groupby(
+                merged, key=lambda fn: fn[0])
+        ))
+    finally:
+        for f in files:
+            f.close()
+
+    for r in runs:
+        os.unlink(r)
+
+    return run
+
+
+def write_run(run, functions):
+    with open(run, 'wb') as f:
+        cdg.stream.write(f, run, functions)
+
+
+def combine(entries):
+    '''
+    Combine several units' entries for the same function.
+
+    Arguments, blocks and attributes are merged (so a unit that defines a
+    function fills in the details that a unit that calls it lacks). Calls and
+    flows are concatenated, without duplicates.
+    '''
+
+    result = {}
+
+    # Edges by (from, to, kind); a repeated edge moves to the end, so that
+    # the last of several edges between two nodes still wins in cdg.build.
+    edges = {'calls': {}, 'flows': {}}
+
+    for props in entries:
+        for (key, value) in props.items():
+            if key in ('arguments', 'attributes'):
+                result.setdefault(key, {}).update(value or {})
+
+            elif key == 'blocks':
+                blocks = result.setdefault(key, {})
+                for (name, values) in (value or {}).items():
+                    blocks.setdefault(name, {}).update(values)
+
+            elif key in edges:
+                for e in value or []:
+                    k = (e.get('from'), e.get('to'), e.get('kind'))
+                    edges[key].pop(k, None)
+                    edges[key][k] = e
+
+            else:
+                result[key] = value
+
+    for (key, values) in edges.items():
+        if values:
+            result[key] = list(values.values())
+
+    return result
@@ -0,0 +1,161 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Hierarchical node names and patterns that match them.
+
+Node names follow the function -> block -> value hierarchy, as in
+`fn::block::value`. Filter seeds may be patterns over those names, in which
+`*` matches any part of one level of the hierarchy, `**` matches across
+levels and `?` matches one character. A pattern that reaches below the
+function level only matches arguments and values, not blocks:
+
+    flows-from:sys_*            every function whose name starts with sys_
+    calls-to:vfs_*::*           the arguments of those functions
+    flows-to:main::**           every argument and value within main
+
+A pattern is resolved with a sorted index of the graph's names: its literal
+prefix (up to the first wildcard) is found by binary search, so only names
+that share the prefix are ever matched against the rest of the pattern.
+'''
+
+import bisect
+import re
+
+
+Separator = '::'
+
+Wildcards = '*?'
+
+
+def function_part(name):
+    '''
+    The part of a node name that names its function.
+    '''
+
+    return name.partition(Separator)[0]
+
+
+def is_pattern(name):
+    return any(c in name for c in Wildcards)
+
+
+def expand(graph, names):
+    '''
+    Replace the patterns among some node names with the names that they
+    match; other names are kept as they are.
+    '''
+
+    if not any(is_pattern(n) for n in names):
+        return list(names)
+
+    idx = index(graph)
+    result = []
+    for n in names:
+        if not is_pattern(n):
+            result.append(n)
+        elif Separator in n:
+            result += [m for m in idx.match(n) if not is_container(graph, m)]
+        else:
+            result += idx.match(n)
+
+    return result
+
+
+def is_container(graph, name):
+    '''
+    Whether a node is a function or a block, which has children.
+    '''
+
+    import cdg.compact
+
+    if isinstance(graph, cdg.compact.CompactGraph):
+        return graph.is_container(graph.id(name))
+
+    return 'children' in graph.nodes[name]
+
+
+def index(graph):
+    '''
+    The sorted index of a graph's names, kept until the graph changes.
+    '''
+
+    import cdg.compact
+
+    version = getattr(graph, 'version', 0)
+    (cached, idx) = graph.__dict__.get('_name_index', (None, None))
+    if idx is not None and cached == version:
+        return idx
+
+    # A CompactGraph's names are already sorted, unless nodes were added
+    # after it was built (or it has deleted nodes in among them)
+    if isinstance(graph, cdg.compact.CompactGraph) \
+            and len(graph._names) == graph._base:
+        idx = Index(graph._names, graph)
+    else:
+        idx = Index(sorted(graph))
+
+    graph.__dict__['_name_index'] = (version, idx)
+    return idx
+
+
+class Index:
+    '''
+    A sorted sequence of names, searchable by prefix or by pattern.
+    '''
+
+    def __init__(self, names, graph=None):
+        self.names = names
+
+        # Names that may belong to deleted nodes must be checked
+        self.graph = graph
+
+    def prefixed(self, prefix):
+        '''
+        Iterate over the names that start with a prefix.
+        '''
+
+        names = self.names
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            if self.graph is None or names[i] in self.graph:
+                yield names[i]
+            i += 1
+
+    def match(self, pattern):
+        '''
+        The names that match a pattern, in sorted order.
+        '''
+
+        literal = re.split('[%s]' % re.escape(Wildcards), pattern, 1)[0]
+        if literal == pattern:
+            return [n for n in self.prefixed(pattern) if n == pattern]
+
+        regex = compile_pattern(pattern)
+        return [n for n in self.prefixed(literal) if regex.fullmatch(n)]
+
+
+def compile_pattern(pattern):
+    parts = []
+    for token in re.split(r'(\*\*|\*|\?)', pattern):
+        if token == '**':
+            parts.append('.*')
+        elif token == '*':
+            parts.append('(?:(?!%s).)*' % re.escape(Separator))
+        elif token == '?':
+            parts.append('(?!%s).' % re.escape(Separator))
+        else:
+            parts.append(re.escape(token))
+
+    return re.compile(''.join(parts), re.DOTALL)
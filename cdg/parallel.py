@@ -0,0 +1,198 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Queries run by a pool of worker processes over a shared, read-only graph.
+
+A `Pool` freezes a graph by writing it out once as a snapshot (see
+cdg.snapshot), in shared memory (/dev/shm) where there is some, or uses an
+existing .cdgc file. Each worker memory-maps the snapshot when it starts, so
+every worker reads the same pages: attaching costs nothing however big the
+graph is, and the graph is never pickled. Workers send back the names of
+the nodes that they find, which the parent merges and takes the subgraph of
+(from the original graph, whose attributes are already decoded).
+
+    with cdg.parallel.Pool(graph, workers=64) as pool:
+        results = pool.apply_batch(specs)
+
+Independent filter specs are spread across the workers (specs that follow
+the same edges are still answered together, by cdg.query.reachable_sets),
+and a traversal from many seeds is split into traversals from subsets of
+them, whose results are unioned. Workers only see the graph as it was when
+the pool started, so it shouldn't be changed while the pool is in use.
+'''
+
+import concurrent.futures
+import os
+import tempfile
+
+import cdg
+import cdg.filters
+import cdg.names
+import cdg.query
+import cdg.snapshot
+import cdg.stats
+
+
+SharedMemory = '/dev/shm'
+
+
+class Pool:
+    '''
+    Worker processes that share a frozen copy of a graph.
+    '''
+
+    def __init__(self, graph, workers=None, path=None):
+        '''
+        Start `workers` processes (default: one per core) with a snapshot of
+        `graph`, or of the .cdgc file `path` if it is given.
+        '''
+
+        self.workers = workers or os.cpu_count()
+        self.directory = None
+
+        if path is None:
+            shared = SharedMemory if os.path.isdir(SharedMemory) else None
+            self.directory = tempfile.TemporaryDirectory(
+                prefix='cdg-', dir=shared)
+            path = os.path.join(self.directory.name, 'graph.cdgc')
+
+            with cdg.stats.phase('freeze'):
+                with open(path, 'wb') as f:
+                    cdg.snapshot.write(graph, f)
+
+        self.graph = graph
+        self.path = path
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=_attach, initargs=(path,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        if self.directory is not None:
+            self.directory.cleanup()
+            self.directory = None
+
+    @cdg.stats.measured('parallel-reachable')
+    def reachable(self, starting_nodes, kinds=cdg.EdgeKind.All,
+                  reverse=False, depth_limit=None):
+        '''
+        The names of the nodes reachable from some starting nodes, as found
+        by cdg.query.reachable, with the seeds split among the workers.
+        '''
+
+        seeds = sorted(n for n in set(starting_nodes) if n in self.graph)
+        futures = [
+            self.executor.submit(_reachable, chunk, kinds, reverse,
+                                 depth_limit)
+            for chunk in split(seeds, self.workers)
+        ]
+
+        found = set()
+        for f in futures:
+            found.update(f.result())
+
+        cdg.stats.count(nodes_visited=len(found))
+        return found
+
+    @cdg.stats.measured('parallel-reachable-sets')
+    def reachable_sets(self, seed_sets, kinds=cdg.EdgeKind.All,
+                       reverse=False, depth_limit=None):
+        '''
+        The names of the nodes reachable from each of many sets of starting
+        nodes, as found by cdg.query.reachable_sets, with the sets split
+        among the workers.
+        '''
+
+        if len(seed_sets) == 1:
+            return [self.reachable(seed_sets[0], kinds, reverse,
+                                   depth_limit)]
+
+        seed_sets = [list(seeds) for seeds in seed_sets]
+        futures = [
+            self.executor.submit(_reachable_sets, chunk, kinds, reverse,
+                                 depth_limit)
+            for chunk in split(seed_sets, self.workers)
+        ]
+
+        return [set(found) for f in futures for found in f.result()]
+
+    def apply(self, filter_spec):
+        return self.apply_batch([filter_spec])[0]
+
+    def apply_batch(self, filter_specs):
+        '''
+        Apply each of many filters to the graph, as
+        cdg.filters.apply_batch does, using the workers for reachability
+        filters. Returns one filtered graph per spec.
+        '''
+
+        graph = self.graph
+        results = [None] * len(filter_specs)
+        batches = {}
+
+        for (i, spec) in enumerate(filter_specs):
+            (name, kinds, args, depth_limit) = cdg.filters.parse(spec)
+            if name in cdg.filters.Traversals:
+                args = cdg.names.expand(graph, args)
+                batches.setdefault((name, kinds, depth_limit), []).append(
+                    (i, spec, args))
+            else:
+                results[i] = cdg.filters.apply(spec, graph)
+
+        for ((name, kinds, depth_limit), batch) in batches.items():
+            (kinds, reverse, annotations, description) = \
+                cdg.filters.traversal(batch[0][1], name, kinds)
+            reached = self.reachable_sets(
+                [args for (_, _, args) in batch], kinds, reverse,
+                depth_limit)
+
+            for ((i, _, args), nodes) in zip(batch, reached):
+                results[i] = cdg.filters.keep(graph, nodes, args,
+                                              annotations, description)
+
+        return results
+
+
+def split(items, n):
+    '''
+    Split a list into at most `n` contiguous chunks of about the same size.
+    '''
+
+    size = -(-len(items) // n) or 1
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# The frozen graph, in a worker process
+_graph = None
+
+
+def _attach(path):
+    global _graph
+    _graph = cdg.snapshot.open_mapped(path)
+
+
+def _reachable(seeds, kinds, reverse, depth_limit):
+    return list(cdg.query.reachable(_graph, seeds, kinds, reverse,
+                                    depth_limit=depth_limit))
+
+
+def _reachable_sets(seed_sets, kinds, reverse, depth_limit):
+    return [list(found) for found in cdg.query.reachable_sets(
+        _graph, seed_sets, kinds, reverse, depth_limit)]
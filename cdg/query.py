@@ -21,60 +21,508 @@
 #
 
 
-def pred(graph, node, attribute_predicate):
-    nodes = set(graph.predecessors(node))
+import heapq
+
+import cdg
+import cdg.compact
+import cdg.condense
+import cdg.memo
+import cdg.reach
+import cdg.stats
 
+
+def pred(graph, node, attribute_predicate):
     return (
-        src for (src,dest,attrs) in graph.edges(nodes, data = True)
-        if dest == node and attribute_predicate(attrs)
+        src for (src, attrs) in graph.pred[node].items()
+        if attribute_predicate(attrs)
     )
 
 
 def succ(graph, node, attribute_predicate):
     return (
-        dest for (src,dest,attrs) in graph.edges(node, data = True)
-        if src == node and attribute_predicate(attrs)
+        dest for (dest, attrs) in graph.succ[node].items()
+        if attribute_predicate(attrs)
     )
 
 
-def transitive_neighbours(graph, starting_nodes, select_fn, annotations=None,
-                          depth_limit=None):
-    result = set()
-    seen = set()
-    working_set = set(starting_nodes).intersection(graph.nodes)
+@cdg.stats.measured('reachable')
+def reachable(graph, starting_nodes, kinds=cdg.EdgeKind.All, reverse=False,
+              annotations=None, depth_limit=None, within=None):
+    """Find the nodes reachable from a set of starting nodes.
 
-    if annotations:
-        for node in working_set:
-            graph.nodes[node].update(annotations)
+    This is a level-synchronous breadth-first search: each step expands the
+    whole frontier at once, following only edges whose kind is in `kinds`.
+
+    Keyword arguments:
+    graph -- a networkx DiGraph or cdg.compact.CompactGraph
+    starting_nodes -- names of the nodes to start from
+    kinds -- a mask of EdgeKind values (see EdgeKind.mask)
+    reverse -- follow edges backwards (find predecessors)
+    annotations -- attributes to set on the starting nodes
+    depth_limit -- maximum number of edges to follow (None or 0: unlimited)
+    within -- only visit these nodes, as if searching graph.subgraph(within)
+
+    Queries without a depth limit are answered from a precomputed index if
+    the graph has them (see cdg.reach), or by searching the graph's
+    condensation if it uses one (see cdg.condense). If the graph remembers
+    earlier searches (see cdg.memo), a query that one of them answers isn't
+    searched again.
+    """
+
+    starting = [n for n in set(starting_nodes) if n in graph
+                and (within is None or n in within)]
+    annotate(graph, starting, annotations)
+
+    memo = cdg.memo.lookup(graph) if within is None else None
+    if memo is not None:
+        result = memo.get(starting, kinds, reverse, depth_limit)
+        if result is not None:
+            return result
+
+    if not depth_limit and within is None:
+        index = cdg.reach.lookup(graph, kinds, reverse)
+        if index is not None:
+            result = index.reachable(starting)
+            cdg.stats.count(nodes_visited=len(result))
+            return result
+
+        condensation = cdg.condense.lookup(graph, kinds)
+        if condensation is not None:
+            result = condensation.reachable(starting, reverse)
+            cdg.stats.count(nodes_visited=len(result))
+            return result
+
+    # The nodes found at each depth, for the memo
+    levels = None if memo is None else []
+
+    if isinstance(graph, cdg.compact.CompactGraph):
+        seen = _reachable_ids(graph, starting, kinds, reverse, depth_limit,
+                              within, levels)
+        if memo is not None:
+            name = graph.name
+            levels = [[name(i) for i in level] for level in levels]
 
+    else:
+        seen = _reachable(graph, starting, kinds, reverse, depth_limit,
+                          within, levels)
+
+    if memo is not None:
+        memo.put(starting, kinds, reverse, levels, not levels[-1])
+
+    return seen
+
+
+def _reachable(graph, starting, kinds, reverse, depth_limit, within=None,
+               levels=None):
+    select = neighbours(graph, kinds, reverse)
+    seen = set(starting)
+    frontier = starting
     depth = 0
-    while True:
-        next_gen = set()
+    scanned = 0
+
+    if levels is not None:
+        levels.append(frontier)
+
+    while frontier and not (depth_limit and depth >= depth_limit):
+        following = []
+
+        for node in frontier:
+            selected = select(node)
+            scanned += len(selected)
+
+            for n in selected:
+                if n in seen:
+                    continue
+
+                if within is not None and n not in within:
+                    continue
+
+                seen.add(n)
+                following.append(n)
+
+        frontier = following
+        depth += 1
+
+        if levels is not None:
+            levels.append(frontier)
+
+    cdg.stats.count(nodes_visited=len(seen), edges_scanned=scanned)
+    return seen
+
+
+def _reachable_ids(graph, starting, kinds, reverse, depth_limit,
+                   within=None, levels=None):
+    table = cdg.compact.kind_table(kinds)
+
+    # Nodes outside of `within` are never visited: mark them as already seen
+    if within is None:
+        seen = bytearray(len(graph._names))
+    else:
+        seen = bytearray(b'\x01') * len(graph._names)
+        for n in within:
+            i = graph.id(n)
+            if i is not None:
+                seen[i] = 0
+
+    frontier = [graph.id(n) for n in starting]
+    for i in frontier:
+        seen[i] = 1
+
+    result = list(frontier)
+    depth = 0
+
+    if levels is not None:
+        levels.append(frontier)
+
+    while frontier and not (depth_limit and depth >= depth_limit):
+        frontier = graph.expand(frontier, table, seen, reverse)
+        result += frontier
+        depth += 1
+
+        if levels is not None:
+            levels.append(frontier)
+
+    if cdg.stats.enabled():
+        # The last frontier is only expanded if the search ran out of nodes
+        expanded = result[:len(result) - len(frontier)]
+        cdg.stats.count(nodes_visited=len(result), edges_scanned=sum(
+            graph.degree_id(i, reverse, table) for i in expanded))
+
+    return set(graph.name(i) for i in result)
+
+
+@cdg.stats.measured('reachable-sets')
+def reachable_sets(graph, seed_sets, kinds=cdg.EdgeKind.All, reverse=False,
+                   depth_limit=None):
+    """Find the nodes reachable from each of many sets of starting nodes.
+
+    Rather than searching once per seed set, every node is labelled with a
+    bit mask of the seed sets that reach it. Without a depth limit, labels
+    are propagated in one pass over the graph's strongly connected
+    components (see cdg.reach.reachable_sets). With one, a single
+    multi-source breadth-first search only propagates the bits that are new
+    to each node, so a region that many seed sets reach is still only
+    explored once per level.
+
+    Keyword arguments:
+    graph -- a networkx DiGraph or cdg.compact.CompactGraph
+    seed_sets -- a list of collections of starting node names
+    kinds, reverse, depth_limit -- as for `reachable`
+
+    Seed sets that the graph's memo (see cdg.memo) can answer aren't
+    searched for.
+
+    Returns a list with one set of node names per seed set.
+    """
+
+    seed_sets = [[n for n in set(seeds) if n in graph] for seeds in seed_sets]
+
+    memo = cdg.memo.lookup(graph)
+    if memo is not None:
+        results = [memo.get(seeds, kinds, reverse, depth_limit)
+                   for seeds in seed_sets]
+        missing = [i for (i, r) in enumerate(results) if r is None]
+        if len(missing) < len(seed_sets):
+            found = reachable_sets(graph, [seed_sets[i] for i in missing],
+                                   kinds, reverse, depth_limit) \
+                if missing else []
+            for (i, r) in zip(missing, found):
+                results[i] = r
+            return results
+
+    if not depth_limit:
+        index = cdg.reach.lookup(graph, kinds, reverse)
+        if index is not None:
+            return [index.reachable(seeds) for seeds in seed_sets]
+
+        # Without a depth limit, one pass over the graph's condensation
+        # beats a search however many seeds there are.
+        if len(seed_sets) > 1:
+            return cdg.reach.reachable_sets(graph, seed_sets, kinds, reverse)
+
+    if isinstance(graph, cdg.compact.CompactGraph):
+        table = cdg.compact.kind_table(kinds)
+        select = lambda u: graph.neighbour_ids(u, table, reverse)
+        seed_sets = [[graph.id(n) for n in seeds] for seeds in seed_sets]
+        name = graph.name
+
+    else:
+        select = neighbours(graph, kinds, reverse)
+        name = lambda n: n
+
+    labels = {}
+    for (i, seeds) in enumerate(seed_sets):
+        for n in seeds:
+            labels[n] = labels.get(n, 0) | (1 << i)
+
+    frontier = dict(labels)
+    depth = 0
+
+    while frontier and not (depth_limit and depth >= depth_limit):
+        following = {}
+
+        for (u, bits) in frontier.items():
+            for v in select(u):
+                new = bits & ~labels.get(v, 0)
+                if new:
+                    labels[v] = labels.get(v, 0) | new
+                    following[v] = following.get(v, 0) | new
+
+        frontier = following
+        depth += 1
+
+    results = [set() for _ in seed_sets]
+    for (n, bits) in labels.items():
+        n = name(n)
+        for i in cdg.reach.set_bits(bits):
+            results[i].add(n)
+
+    return results
 
-        for node in working_set:
-            if node not in graph.nodes:
-                continue
 
-            result.add(node)
-            seen.add(node)
+@cdg.stats.measured('shortest-paths')
+def shortest_paths(graph, sources, targets, kinds=cdg.EdgeKind.All, k=1,
+                   within=None):
+    """Find the k shortest paths from any of some nodes to any of others.
 
-            selected = set(select_fn(node))
+    A path is found by a bidirectional breadth-first search that records
+    parent pointers: one search steps forward from the sources and another
+    backward from the targets, expanding whichever frontier is smaller,
+    until they meet. Only the neighbourhoods of the two ends are explored,
+    not everything that the sources reach. Further paths are found with
+    Yen's algorithm: searching again from each node of the last path found,
+    with the edges that earlier paths took from there (and the nodes before
+    it) set aside.
 
-            # Don't recurse down paths that we've previously explored
-            if seen.intersection(selected) == selected:
+    Keyword arguments:
+    graph -- a networkx DiGraph or cdg.compact.CompactGraph
+    sources -- names of the nodes that paths may start at
+    targets -- names of the nodes that paths may end at
+    kinds -- a mask of EdgeKind values (see EdgeKind.mask)
+    k -- number of paths to find
+    within -- only visit these nodes, as in `reachable`
+
+    Returns up to k simple paths (lists of node names), shortest first.
+    """
+
+    if isinstance(graph, cdg.compact.CompactGraph):
+        table = cdg.compact.kind_table(kinds)
+        forward = lambda u: graph.neighbour_ids(u, table, False)
+        backward = lambda u: graph.neighbour_ids(u, table, True)
+        (key, name) = (graph.id, graph.name)
+
+    else:
+        forward = neighbours(graph, kinds, False)
+        backward = neighbours(graph, kinds, True)
+        key = name = lambda n: n
+
+    allowed = None if within is None else \
+        set(key(n) for n in within if n in graph)
+
+    def keys(names):
+        return sorted(key(n) for n in set(names) if n in graph
+                      and (within is None or n in within))
+
+    (sources, targets) = (keys(sources), keys(targets))
+
+    def search(starts, banned_nodes=(), banned_edges=()):
+        return _bidirectional(forward, backward, starts, targets, allowed,
+                              banned_nodes, banned_edges)
+
+    path = search(sources)
+    if path is None:
+        return []
+
+    found = [path]
+    candidates = []
+    seen = {tuple(path)}
+
+    while len(found) < k:
+        last = found[-1]
+
+        # Spur from each node of the last path, or (at -1) from a source
+        # that no path has started at yet
+        for i in range(-1, len(last) - 1):
+            root = last[:i + 1]
+
+            if i < 0:
+                used = set(p[0] for p in found)
+                spur = search([s for s in sources if s not in used])
+
+            else:
+                taken = set(p[i + 1] for p in found if p[:i + 1] == root)
+                spur = search([last[i]], set(root[:-1]),
+                              set((last[i], v) for v in taken))
+
+            if spur is None:
                 continue
 
-            seen = seen.union(selected)
-            result = result.union(selected)
-            next_gen = next_gen.union(selected)
+            candidate = root[:-1] + spur
+            if tuple(candidate) not in seen:
+                seen.add(tuple(candidate))
+                heapq.heappush(candidates, (len(candidate), candidate))
 
-        working_set = next_gen
-        if len(working_set) == 0:
+        if not candidates:
             break
 
-        if depth_limit:
-            depth += 1
-            if depth >= depth_limit:
+        found.append(heapq.heappop(candidates)[1])
+
+    return [[name(n) for n in p] for p in found]
+
+
+def _bidirectional(forward, backward, sources, targets, allowed,
+                   banned_nodes, banned_edges):
+    """
+    One shortest path from sources to targets, avoiding some nodes and edges,
+    or None.
+
+    Whenever the searches meet, the path through the meeting point is a
+    shortest one: no node was within both searches' depths before this step,
+    so no path can be shorter than the two depths plus this edge.
+    """
+
+    before = dict((s, None) for s in sources if s not in banned_nodes)
+    after = dict((t, None) for t in targets if t not in banned_nodes)
+
+    meeting = next((s for s in before if s in after), None)
+    ahead = list(before)
+    behind = list(after)
+    scanned = 0
+
+    while meeting is None and ahead and behind:
+        forwards = len(ahead) <= len(behind)
+        if forwards:
+            (frontier, parents, other, select) = (ahead, before, after,
+                                                  forward)
+        else:
+            (frontier, parents, other, select) = (behind, after, before,
+                                                  backward)
+
+        following = []
+        for u in frontier:
+            for v in select(u):
+                scanned += 1
+                if v in parents or v in banned_nodes:
+                    continue
+
+                if allowed is not None and v not in allowed:
+                    continue
+
+                if banned_edges and \
+                        ((u, v) if forwards else (v, u)) in banned_edges:
+                    continue
+
+                parents[v] = u
+                if v in other:
+                    meeting = v
+                    break
+
+                following.append(v)
+
+            if meeting is not None:
                 break
 
-    return result
+        if forwards:
+            ahead = following
+        else:
+            behind = following
+
+    cdg.stats.count(nodes_visited=len(before) + len(after),
+                    edges_scanned=scanned)
+
+    if meeting is None:
+        return None
+
+    path = []
+    n = meeting
+    while n is not None:
+        path.append(n)
+        n = before[n]
+    path.reverse()
+
+    n = after[meeting]
+    while n is not None:
+        path.append(n)
+        n = after[n]
+
+    return path
+
+
+def neighbours(graph, kinds=cdg.EdgeKind.All, reverse=False):
+    '''
+    A function that lists a node's successors (or predecessors) along edges
+    whose kind is in `kinds`.
+
+    Where the graph groups its edges by kind (see cdg.Graph.group_kinds
+    and cdg.compact.CompactGraph.neighbour_ids), only edges of the selected
+    kinds are looked at.
+    '''
+
+    if isinstance(graph, cdg.compact.CompactGraph):
+        table = cdg.compact.kind_table(kinds)
+        return lambda n: [graph.name(v) for v in graph.neighbour_ids(
+            graph.id(n), table, reverse)]
+
+    adjacency = graph.pred if reverse else graph.succ
+    if kinds == cdg.EdgeKind.All:
+        return lambda n: adjacency[n]
+
+    groups = graph.kind_adjacency(reverse) \
+        if hasattr(graph, 'kind_adjacency') else None
+
+    if groups is not None:
+        groups = [g for (k, g) in enumerate(groups) if kinds & (1 << k)]
+        if len(groups) == 1:
+            return lambda n: groups[0].get(n, ())
+
+        return lambda n: [v for g in groups for v in g.get(n, ())]
+
+    return lambda n: [
+        v for (v, attrs) in adjacency[n].items() if _selected(attrs, kinds)]
+
+
+def _selected(attrs, kinds):
+    kind = attrs.get('kind')
+    if kind is None:
+        return kinds == cdg.EdgeKind.All
+
+    return kinds & (1 << kind)
+
+
+def annotate(graph, nodes, annotations):
+    if annotations:
+        for node in nodes:
+            graph.nodes[node].update(annotations)
+
+
+@cdg.stats.measured('transitive-neighbours')
+def transitive_neighbours(graph, starting_nodes, select_fn, annotations=None,
+                          depth_limit=None):
+    """Find the transitive closure of an arbitrary neighbour function.
+
+    This is the general form of `reachable` for callers that need to select
+    neighbours with a Python function rather than an EdgeKind mask.
+    """
+
+    seen = set(n for n in starting_nodes if n in graph.nodes)
+    annotate(graph, seen, annotations)
+
+    frontier = list(seen)
+    depth = 0
+    scanned = 0
+
+    while frontier and not (depth_limit and depth >= depth_limit):
+        following = []
+
+        for node in frontier:
+            for n in select_fn(node):
+                scanned += 1
+                if n not in seen:
+                    seen.add(n)
+                    following.append(n)
+
+        frontier = following
+        depth += 1
+
+    cdg.stats.count(nodes_visited=len(seen), edges_scanned=scanned)
+    return seen
@@ -0,0 +1,508 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Precomputed reachability indexes, for answering many transitive queries
+against the same graph.
+
+An index covers one class of edges (an EdgeKind mask) in one direction. It
+condenses the strongly connected components of the selected edges into a DAG
+and labels each component with intervals of a numbering of the components,
+as in Agrawal, Borgida and Jagadish's tree cover: components are numbered in
+the postorder of a spanning forest of the DAG, so each component's forest
+descendants are an interval of numbers ending with its own. A component's
+label is that interval merged with its successors' labels, so the label
+only grows past one interval where the DAG's other edges reach outside of
+the component's subtree. Labels are stored as flat arrays of (first, last)
+pairs, so an index's size grows with the number of those exceptions rather
+than with the square of the number of components.
+
+Indexes are opt-in: after `attach(graph)`, cdg.query.reachable answers
+queries without a depth limit from the graph's indexes, building each one
+the first time it is needed. An index records the graph's version (see
+cdg.Graph) and is rebuilt if the graph changes. Indexes of graphs loaded from
+files are also kept in the snapshot cache (see cdg.cache), next to the
+graph's own snapshot.
+'''
+
+import bisect
+import os
+import struct
+import sys
+import threading
+from array import array
+
+import cdg
+import cdg.compact
+import cdg.query
+
+
+Version = 2
+
+Header = struct.Struct('<8sIQQ')
+Magic = b'CDGREACH'
+
+Suffix = '.reach'
+
+
+def attach(graph):
+    '''
+    Answer reachability queries about a graph from indexes.
+    '''
+
+    graph.reach_indexes = {}
+    graph.reach_lock = threading.Lock()
+
+
+def lookup(graph, kinds, reverse):
+    '''
+    The up-to-date index of a graph for an EdgeKind mask and direction, or
+    None if the graph doesn't use indexes.
+    '''
+
+    indexes = getattr(graph, 'reach_indexes', None)
+    if indexes is None:
+        return None
+
+    with graph.reach_lock:
+        index = indexes.get((kinds, reverse))
+        if index is None or index.version != version(graph):
+            index = indexes[(kinds, reverse)] = load_or_build(
+                graph, kinds, reverse)
+
+    return index
+
+
+def version(graph):
+    return getattr(graph, 'version', 0)
+
+
+def load_or_build(graph, kinds, reverse):
+    filename = cache_path(graph, kinds, reverse)
+    if filename:
+        try:
+            with open(filename, 'rb') as f:
+                return Index.read(graph, kinds, reverse, f)
+        except (OSError, ValueError):
+            pass
+
+    index = Index(graph, kinds, reverse)
+
+    if filename:
+        import cdg.cache
+        try:
+            cdg.cache.atomic_write(filename, writer=index.write)
+        except OSError:
+            pass
+
+    return index
+
+
+def cache_path(graph, kinds, reverse):
+    '''
+    Where to keep an index in the snapshot cache, if it can be kept there.
+
+    Only graphs that are unmodified since they were loaded from (or stored
+    in) the cache have a cache key.
+    '''
+
+    import cdg.cache
+
+    key = cdg.cache.graph_key(graph)
+    if key is None:
+        return None
+
+    return os.path.join(cdg.cache.directory(), '%s-%d-%x%s%s' % (
+        key, Version, kinds, '-reverse' if reverse else '', Suffix))
+
+
+def node_order(graph):
+    '''
+    Number a graph's nodes: returns (names, ids, index) where `names` maps
+    local numbers to names, `ids` maps them to CompactGraph ids (or None)
+    and `index` maps names back to local numbers.
+
+    The numbering depends only on the graph's content, so that an index built
+    from a networkx graph can be reused for a CompactGraph and vice versa.
+    '''
+
+    if isinstance(graph, cdg.compact.CompactGraph):
+        ids = list(graph._live())
+        return ([graph._names[i] for i in ids], ids, None)
+
+    names = sorted(graph)
+    return (names, None, dict((n, i) for (i, n) in enumerate(names)))
+
+
+def adjacency(graph, kinds, reverse, order=None):
+    '''
+    The selected edges of a graph, as lists of neighbours' local numbers
+    (according to `order`, which defaults to `node_order(graph)`).
+    '''
+
+    (names, ids, index) = order or node_order(graph)
+    table = cdg.compact.kind_table(kinds)
+
+    if ids is not None:
+        local = dict((i, k) for (k, i) in enumerate(ids))
+        return (names, [[local[v] for v in graph.neighbour_ids(i, table,
+                                                                reverse)]
+                        for i in ids])
+
+    neighbours = cdg.query.neighbours(graph, kinds, reverse)
+    return (names, [[index[v] for v in neighbours(n)] for n in names])
+
+
+def local_number(graph, order, name):
+    '''
+    A node's number in a `node_order`, or None.
+    '''
+
+    (names, ids, index) = order
+    if index is not None:
+        return index.get(name)
+
+    i = graph.id(name)
+    if i is None:
+        return None
+
+    # Live ids are sorted, so binary search for the local number
+    k = bisect.bisect_left(ids, i)
+    return k if k < len(ids) and ids[k] == i else None
+
+
+def reachable_sets(graph, seed_sets, kinds, reverse):
+    '''
+    Find the nodes reachable from each of many sets of nodes, in one pass
+    over the graph's condensation.
+
+    Each component is labelled with a bit mask of the seed sets that reach
+    it. Visiting components in topological order, every component's label is
+    final by the time it is reached, so each edge is followed exactly once,
+    however many seed sets there are.
+    '''
+
+    order = node_order(graph)
+    (names, adjacent) = adjacency(graph, kinds, reverse, order)
+    (component, count) = components(adjacent)
+
+    labels = [0] * count
+    for (i, seeds) in enumerate(seed_sets):
+        for n in seeds:
+            u = local_number(graph, order, n)
+            if u is not None:
+                labels[component[u]] |= 1 << i
+
+    groups = members(component, count)
+    results = [set() for _ in seed_sets]
+
+    for c in range(count):
+        bits = labels[c]
+        if not bits:
+            continue
+
+        for u in groups[c]:
+            for v in adjacent[u]:
+                labels[component[v]] |= bits
+
+        group = [names[u] for u in groups[c]]
+        for i in set_bits(bits):
+            results[i].update(group)
+
+    return results
+
+
+def components(adjacent):
+    '''
+    Find strongly connected components with Tarjan's algorithm (iteratively,
+    since call chains are deeper than Python's recursion limit).
+
+    Returns the component number of each node and the number of components.
+    Components are numbered in topological order: every edge goes from a
+    component to itself or to a higher-numbered one.
+    '''
+
+    n = len(adjacent)
+    order = array('l', [-1]) * n
+    low = array('l', bytes(8 * n))
+    component = array('l', [-1]) * n
+    stack = []
+    found = 0
+    counter = 0
+
+    for root in range(n):
+        if order[root] >= 0:
+            continue
+
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        work = [(root, iter(adjacent[root]))]
+
+        while work:
+            (u, neighbours) = work[-1]
+
+            for v in neighbours:
+                if order[v] < 0:
+                    order[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    work.append((v, iter(adjacent[v])))
+                    break
+
+                elif component[v] < 0 and order[v] < low[u]:
+                    low[u] = order[v]
+
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if low[u] < low[parent]:
+                        low[parent] = low[u]
+
+                if low[u] == order[u]:
+                    while True:
+                        v = stack.pop()
+                        component[v] = found
+                        if v == u:
+                            break
+                    found += 1
+
+    # Tarjan finds components in reverse topological order
+    for i in range(n):
+        component[i] = found - 1 - component[i]
+
+    return (component, found)
+
+
+class Index:
+    '''
+    The transitive closure of one kind of edges in one direction.
+    '''
+
+    def __init__(self, graph, kinds, reverse, build=True):
+        self.graph = graph
+        self.kinds = kinds
+        self.reverse = reverse
+        self.version = version(graph)
+
+        (self.names, self.ids, self.index) = node_order(graph)
+        if build:
+            self.build()
+
+    def build(self):
+        (names, adjacent) = adjacency(self.graph, self.kinds, self.reverse,
+                                      (self.names, self.ids, self.index))
+        (component, count) = components(adjacent)
+
+        self.component = component
+        self.members = members(component, count)
+
+        # Edges between components (possibly more than once each)
+        successors = [[] for _ in range(count)]
+        for (u, neighbours) in enumerate(adjacent):
+            c = component[u]
+            successors[c] += [d for d in map(component.__getitem__,
+                                             neighbours) if d != c]
+
+        (first, post, self.by_post) = tree_cover(successors)
+
+        # Components only reach higher-numbered components, so build labels
+        # from the bottom up.
+        labels = [None] * count
+        for c in range(count - 1, -1, -1):
+            (low, high) = (first[c], post[c])
+            intervals = [(low, high)]
+            for d in successors[c]:
+                label = labels[d]
+                if len(label) > 2 or label[0] < low or label[1] > high:
+                    intervals += zip(label[::2], label[1::2])
+
+            labels[c] = array(cdg.compact.IdType, merge(intervals))
+
+        self.labels = labels
+
+    def reachable(self, starting_nodes):
+        '''
+        The names of all nodes reachable from the given nodes.
+        '''
+
+        intervals = []
+        for n in starting_nodes:
+            i = self.local(n)
+            if i is not None:
+                label = self.labels[self.component[i]]
+                intervals += zip(label[::2], label[1::2])
+
+        names = self.names
+        members = self.members
+        by_post = self.by_post
+        flat = merge(intervals)
+
+        return set(names[u] for k in range(0, len(flat), 2)
+                   for p in range(flat[k], flat[k + 1] + 1)
+                   for u in members[by_post[p]])
+
+    def local(self, name):
+        return local_number(self.graph, (self.names, self.ids, self.index),
+                            name)
+
+    def size(self):
+        '''
+        The number of intervals in the index's labels.
+        '''
+
+        return sum(len(label) for label in self.labels) // 2
+
+    def write(self, output):
+        '''
+        Write the index's components and labels to a binary stream.
+        '''
+
+        offsets = array(cdg.compact.OffsetType, [0])
+        for label in self.labels:
+            offsets.append(offsets[-1] + len(label))
+
+        component = array(cdg.compact.IdType, self.component)
+        by_post = array(cdg.compact.IdType, self.by_post)
+        flat = array(cdg.compact.IdType)
+        for label in self.labels:
+            flat.extend(label)
+
+        output.write(Header.pack(Magic, Version, len(self.names),
+                                 len(self.labels)))
+        for a in (component, by_post, offsets, flat):
+            if sys.byteorder != 'little':
+                a.byteswap()
+            output.write(a.tobytes())
+
+    @classmethod
+    def read(cls, graph, kinds, reverse, stream):
+        '''
+        Read an index of a graph from a binary stream.
+        '''
+
+        (magic, v, n, count) = Header.unpack(stream.read(Header.size))
+        if magic != Magic or v != Version:
+            raise ValueError('Not a reachability index')
+
+        index = cls(graph, kinds, reverse, build=False)
+        if len(index.names) != n:
+            raise ValueError('Index is for a different graph')
+
+        def arr(typecode, length):
+            a = array(typecode)
+            a.frombytes(stream.read(a.itemsize * length))
+            if len(a) != length:
+                raise ValueError('Truncated index')
+            if sys.byteorder != 'little':
+                a.byteswap()
+            return a
+
+        component = arr(cdg.compact.IdType, n)
+        by_post = arr(cdg.compact.IdType, count)
+        offsets = arr(cdg.compact.OffsetType, count + 1)
+        flat = arr(cdg.compact.IdType, offsets[-1])
+        if stream.read(1):
+            raise ValueError('Index is too long')
+
+        index.component = component
+        index.members = members(component, count)
+        index.by_post = by_post
+        index.labels = [flat[offsets[c]:offsets[c + 1]]
+                        for c in range(count)]
+
+        return index
+
+
+def tree_cover(successors):
+    '''
+    Number the nodes of a DAG (given as lists of successors, with nodes in
+    topological order) in the postorder of a depth-first spanning forest.
+
+    Returns each node's number, the first number in its subtree and the
+    node with each number.
+    '''
+
+    count = len(successors)
+    first = array('l', [-1]) * count
+    post = array('l', [-1]) * count
+    by_post = array('l', [-1]) * count
+    counter = 0
+
+    for root in range(count):
+        if first[root] >= 0:
+            continue
+
+        first[root] = counter
+        work = [(root, iter(successors[root]))]
+
+        while work:
+            (u, following) = work[-1]
+
+            for v in following:
+                if first[v] < 0:
+                    first[v] = counter
+                    work.append((v, iter(successors[v])))
+                    break
+
+            else:
+                work.pop()
+                post[u] = counter
+                by_post[counter] = u
+                counter += 1
+
+    return (first, post, by_post)
+
+
+def merge(intervals):
+    '''
+    Merge (first, last) intervals of integers, returning the union as a flat
+    list of (first, last) pairs in order.
+    '''
+
+    result = []
+    for (a, b) in sorted(intervals):
+        if result and a <= result[-1] + 1:
+            if b > result[-1]:
+                result[-1] = b
+        else:
+            result += (a, b)
+
+    return result
+
+
+def members(component, count):
+    '''
+    The nodes in each component.
+    '''
+
+    result = [[] for _ in range(count)]
+    for (u, c) in enumerate(component):
+        result[c].append(u)
+
+    return result
+
+
+def set_bits(bits):
+    '''
+    The positions of the bits that are set in an int.
+    '''
+
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for (i, byte) in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield i * 8 + low.bit_length() - 1
+            byte ^= low
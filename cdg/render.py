@@ -0,0 +1,366 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Partitioned rendering of graphs too big for one GraphViz layout.
+
+`render` splits a graph into parts, either by function (each function's
+cluster is kept whole, and small functions share a part) or by connected
+component, with at most `max_nodes` nodes per part. A function or component
+that is bigger than that is split into consecutive runs of its blocks'
+values or, with `summarise`, drawn as a single summary node.
+
+Each part is written as its own .dot file (see cdg.graphviz), in which an
+edge to a node in another part points at a dashed stub node that links to
+that part's rendering. The parts are laid out concurrently by the local
+`dot` binary, and an index.html links to them all, along with an overview
+of the parts and the edges between them.
+'''
+
+import collections
+import concurrent.futures
+import html
+import os
+import shutil
+import subprocess
+
+import cdg
+import cdg.compact
+import cdg.filters
+import cdg.graphviz
+import cdg.names
+import cdg.simplify
+import cdg.stats
+
+
+Schemes = ('function', 'component')
+
+
+@cdg.stats.measured('render')
+def render(graph, directory, by='function', max_nodes=2000, summarise=False,
+           fmt='svg', workers=None, layout=True, dot='dot'):
+    '''
+    Render a graph as parts in a directory, returning the parts.
+
+    If `layout` is false, only the .dot files and the index are written.
+    '''
+
+    if by not in Schemes:
+        raise ValueError('Invalid partitioning scheme: %s' % by)
+
+    if max_nodes < 1:
+        raise ValueError('Parts must hold at least one node')
+
+    if layout and shutil.which(dot) is None:
+        raise FileNotFoundError('GraphViz binary not found: %s' % dot)
+
+    os.makedirs(directory, exist_ok=True)
+    parts = partition(graph, by, max_nodes, summarise)
+    links = dict(
+        (p.number, p.filename(fmt if layout else 'dot')) for p in parts)
+
+    with cdg.stats.phase('render-dot', parts=len(parts)):
+        for p in parts:
+            with open(os.path.join(directory, p.filename('dot')), 'w') as f:
+                cdg.graphviz.dot(p.graph(graph, parts, links), f)
+
+        with open(os.path.join(directory, 'overview.dot'), 'w') as f:
+            overview(parts, links, f)
+
+    if layout:
+        names = [p.filename('dot') for p in parts] + ['overview.dot']
+        run_layout(directory, names, fmt, workers, dot)
+
+    with open(os.path.join(directory, 'index.html'), 'w') as f:
+        index(parts, links, 'overview.' + fmt if layout else None, f)
+
+    return parts
+
+
+class Part:
+    '''
+    A set of nodes to be drawn together.
+    '''
+
+    def __init__(self, number):
+        self.number = number
+        self.nodes = []
+        self.units = []
+
+        # Nodes drawn as summaries of the (too many) nodes they stand for
+        self.summaries = {}
+
+        # Number of edges to each other part
+        self.edges = collections.Counter()
+
+    def __len__(self):
+        return len(self.nodes) + len(self.summaries)
+
+    def filename(self, extension):
+        return 'part-%04d.%s' % (self.number, extension)
+
+    def title(self):
+        if len(self.units) == 1:
+            return self.units[0]
+
+        return '%s ... %s (%d)' % (self.units[0], self.units[-1],
+                                   len(self.units))
+
+    @cdg.stats.measured('render-part')
+    def graph(self, graph, parts, links):
+        '''
+        The graph to draw for this part: its nodes and their clusters, its
+        summary nodes and a stub node for each node in another part that an
+        edge leads to (or comes from).
+        '''
+
+        nodes = graph.nodes
+        place = self.place
+
+        keep = set(self.nodes)
+        for n in self.nodes:
+            parent = nodes[n].get('parent')
+            while parent in nodes and parent not in keep:
+                keep.add(parent)
+                parent = nodes[parent].get('parent')
+
+        result = cdg.filters.materialise(graph, keep)
+        if isinstance(result, cdg.compact.CompactGraph):
+            result = cdg.compact.to_networkx(result)
+
+        for (name, members) in self.summaries.items():
+            result.add_node(name, label=name, shape='box3d',
+                            xlabel='%d nodes' % len(members))
+
+        stubs = set()
+
+        def stub(n, part):
+            name = '%s (part %d)' % (n, part)
+            if name not in stubs:
+                stubs.add(name)
+                result.add_node(name, label=n, style='dashed', shape='note',
+                                URL=links[part],
+                                tooltip='in %s' % parts[part].title())
+            return name
+
+        kinds = collections.defaultdict(list)
+        for u in self.nodes + [m for ms in self.summaries.values()
+                               for m in ms]:
+            for (adjacent, outgoing) in ((graph.succ[u], True),
+                                         (graph.pred[u], False)):
+                for (v, attrs) in adjacent.items():
+                    (part, drawn) = place.get(v, (None, None))
+                    if part is None:
+                        continue
+
+                    if part != self.number:
+                        drawn = stub(v, part)
+                    elif drawn == v and place[u][1] == u:
+                        continue    # an edge within the part
+
+                    edge = (place[u][1], drawn) if outgoing \
+                        else (drawn, place[u][1])
+                    if edge[0] != edge[1]:
+                        kinds[edge].append(attrs.get('kind'))
+
+        for ((src, dest), merged) in kinds.items():
+            kind = cdg.simplify.merge_kinds(merged)
+            if kind is None:
+                result.add_edge(src, dest)
+            else:
+                result.add_edge(src, dest, kind=kind)
+
+        return result
+
+
+def partition(graph, by='function', max_nodes=2000, summarise=False):
+    '''
+    Split a graph's (non-cluster) nodes into parts of at most `max_nodes`.
+
+    Each part gets a `place` dict that maps every node in the graph to its
+    part number and the name that it is drawn with.
+    '''
+
+    nodes = graph.nodes
+    units = functions(graph) if by == 'function' else components(graph)
+
+    parts = [Part(0)]
+    for (name, members) in units:
+        if len(members) > max_nodes:
+            if summarise:
+                if len(parts[-1]) + 1 > max_nodes:
+                    parts.append(Part(len(parts)))
+                parts[-1].summaries[name + ' (summary)'] = members
+                parts[-1].units.append(name)
+                continue
+
+            # Split the unit into runs of nodes, keeping blocks together
+            members.sort(key=lambda n: (nodes[n].get('parent') or '', n))
+            for i in range(0, len(members), max_nodes):
+                if parts[-1].nodes or parts[-1].summaries:
+                    parts.append(Part(len(parts)))
+                parts[-1].nodes += members[i:i + max_nodes]
+                parts[-1].units.append(name)
+            continue
+
+        if len(parts[-1]) + len(members) > max_nodes:
+            parts.append(Part(len(parts)))
+
+        parts[-1].nodes += members
+        parts[-1].units.append(name)
+
+    if not parts[-1].units:
+        parts.pop()
+
+    place = {}
+    for p in parts:
+        for n in p.nodes:
+            place[n] = (p.number, n)
+        for (name, members) in p.summaries.items():
+            for n in members:
+                place[n] = (p.number, name)
+
+    for p in parts:
+        p.place = place
+
+    # Count the edges between parts, for the overview
+    for (u, v) in graph.edges():
+        (p, q) = (place.get(u), place.get(v))
+        if p is not None and q is not None and p[0] != q[0]:
+            parts[p[0]].edges[q[0]] += 1
+
+    return parts
+
+
+def functions(graph):
+    '''
+    The (non-cluster) nodes of each function, as (name, nodes) pairs in name
+    order. Nodes outside of any function are grouped by the function part of
+    their names, as in cdg.save.
+    '''
+
+    nodes = graph.nodes
+    units = collections.defaultdict(list)
+
+    for (n, attrs) in nodes.items():
+        if 'children' in attrs:
+            continue
+
+        owner = cdg.owner(graph, n)
+        units[owner or cdg.names.function_part(n)].append(n)
+
+    return sorted(units.items())
+
+
+def components(graph):
+    '''
+    The (non-cluster) nodes of each weakly connected component, as
+    (name, nodes) pairs, where a component is named after its first node.
+    '''
+
+    nodes = graph.nodes
+    leader = {}
+
+    def find(n):
+        root = n
+        while leader.get(root, root) != root:
+            root = leader[root]
+        while n != root:
+            (n, leader[n]) = (leader[n], root)
+        return root
+
+    for (u, v) in graph.edges():
+        (a, b) = (find(u), find(v))
+        if a != b:
+            leader[max(a, b)] = min(a, b)
+
+    units = collections.defaultdict(list)
+    for (n, attrs) in nodes.items():
+        if 'children' not in attrs:
+            units[find(n)].append(n)
+
+    return sorted(units.items())
+
+
+def run_layout(directory, filenames, fmt='svg', workers=None, dot='dot'):
+    '''
+    Lay out .dot files with GraphViz, several at a time.
+
+    Each layout is a separate `dot` process, so a thread per running layout
+    is all it takes to keep every core busy.
+    '''
+
+    def layout(filename):
+        output = os.path.splitext(filename)[0] + '.' + fmt
+        subprocess.run([dot, '-T' + fmt, '-o', output, filename],
+                       cwd=directory, check=True)
+        return output
+
+    workers = workers or os.cpu_count()
+    with cdg.stats.phase('layout', files=len(filenames)):
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(layout, filenames))
+
+
+def overview(parts, links, output):
+    '''
+    Write a .dot graph of the parts and the number of edges between them.
+    '''
+
+    output.write('digraph {\n')
+    output.write('\tnode [shape=rectangle, style=filled, fillcolor="%s"];\n'
+                 % cdg.graphviz.Colour.Cluster)
+
+    for p in parts:
+        output.write('\t%s [%s];\n' % (
+            cdg.graphviz.quote('part %d' % p.number),
+            cdg.graphviz.attr_list({
+                'label': '%s\n%d nodes' % (p.title(), len(p)),
+                'URL': links[p.number],
+            })))
+
+    for p in parts:
+        for (q, count) in sorted(p.edges.items()):
+            output.write('\t%s -> %s [%s];\n' % (
+                cdg.graphviz.quote('part %d' % p.number),
+                cdg.graphviz.quote('part %d' % q),
+                cdg.graphviz.attr_list({'label': count})))
+
+    output.write('}\n')
+
+
+def index(parts, links, overview, output):
+    '''
+    Write an HTML page that links to every part (and shows the overview).
+    '''
+
+    escape = html.escape
+
+    output.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8">'
+                 '<title>CDG parts</title></head>\n<body>\n')
+
+    if overview:
+        output.write('<object data="%s" type="image/svg+xml"></object>\n'
+                     % escape(overview))
+
+    output.write('<table>\n<tr><th>Part</th><th>Contents</th>'
+                 '<th>Nodes</th><th>Edges to other parts</th></tr>\n')
+
+    for p in parts:
+        output.write('<tr><td><a href="%s">%d</a></td><td>%s</td>'
+                     '<td>%d</td><td>%d</td></tr>\n' % (
+                         escape(links[p.number]), p.number,
+                         escape(p.title()), len(p), sum(p.edges.values())))
+
+    output.write('</table>\n</body>\n</html>\n')
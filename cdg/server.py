@@ -0,0 +1,370 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A long-running query server that keeps one graph loaded.
+
+The server speaks plain HTTP over a Unix socket or a TCP port:
+
+    GET /filter?spec=calls-to:read&spec=flows-from:main&format=cdg
+    GET /simplify?format=cdgc
+    GET /dot?spec=calls-from:main
+    GET /dimensions
+
+Every command applies its `spec` filters to the loaded graph as one pipeline
+(see cdg.filters.apply_all), and `simplify` then simplifies the result. The
+response body is the resulting graph in the requested format, streamed as it
+is written (with chunked transfer encoding). Queries run in a pool of worker
+threads, so a slow query doesn't hold up the others; filters never modify
+their input graph, so the loaded graph can be shared between them.
+
+A response that fails after its headers have been sent is cut off without
+its final chunk, so that clients see an incomplete response rather than a
+truncated graph. `request` is the matching client, which reports that as an
+error.
+'''
+
+import asyncio
+import concurrent.futures
+import http.client
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+import urllib.parse
+
+import cdg
+import cdg.filters
+
+
+Formats = {
+    'cdg': 'application/ubjson',
+    'cdgc': 'application/octet-stream',
+    'dot': 'text/vnd.graphviz',
+    'json': 'application/json',
+    'yaml': 'application/yaml',
+}
+
+Commands = ('dimensions', 'dot', 'filter', 'simplify')
+
+ChunkSize = 1 << 16
+
+
+def default_address(filename):
+    '''
+    The socket that `cdg serve` listens on by default for a graph file.
+    '''
+
+    return filename + '.sock'
+
+
+def parse_address(address):
+    '''
+    Parse 'port', 'host:port' or a Unix socket path.
+
+    Returns a (host, port) tuple for TCP addresses or a path string.
+    '''
+
+    if address.isdigit():
+        return ('localhost', int(address))
+
+    (host, _, port) = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return (host, int(port))
+
+    return address
+
+
+def query(graph, command, specs):
+    '''
+    Run a server command against a graph.
+    '''
+
+    if command not in Commands:
+        raise ValueError('Invalid command: %s' % command)
+
+    graph = cdg.filters.apply_all(specs, graph)
+
+    if command == 'simplify':
+        graph = graph.simplified()
+
+    return graph
+
+
+def serve(graph, address, workers=None):
+    '''
+    Answer queries about a graph until interrupted.
+    '''
+
+    address = parse_address(address)
+    executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    async def main():
+        server = await start(graph, address, executor)
+
+        print('Serving %d nodes, %d edges on %s' % (
+            cdg.dimensions(graph) + (format_address(address),)))
+
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                      stop.set)
+
+        async with server:
+            await stop.wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+
+
+async def start(graph, address, executor):
+    '''
+    Start answering queries about a graph on an address (as parsed by
+    `parse_address`) in the running event loop, returning the
+    asyncio.Server.
+    '''
+
+    async def handle(reader, writer):
+        try:
+            await respond(graph, executor, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.unlink(address)
+        return await asyncio.start_unix_server(handle, address)
+
+    return await asyncio.start_server(handle, *address)
+
+
+async def respond(graph, executor, reader, writer):
+    request_line = await reader.readline()
+    while (await reader.readline()).strip():
+        pass
+
+    try:
+        (method, target, _) = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        return await error(writer, 400, 'Malformed request')
+
+    if method != 'GET':
+        return await error(writer, 405, 'Unsupported method: %s' % method)
+
+    url = urllib.parse.urlsplit(target)
+    command = url.path.strip('/')
+    params = urllib.parse.parse_qs(url.query)
+    specs = params.get('spec', [])
+    fmt = params.get('format', ['dot' if command == 'dot' else 'cdg'])[-1]
+
+    if command not in Commands:
+        return await error(writer, 404, 'Invalid command: %s' % command)
+
+    if fmt not in Formats:
+        return await error(writer, 400, 'Invalid format: %s' % fmt)
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(
+            executor, query, graph, command, specs)
+    except cdg.filters.FilterError as e:
+        return await error(writer, 400, e.message, e.filter_spec)
+    except (KeyError, ValueError) as e:
+        return await error(writer, 400, str(e))
+    except Exception as e:
+        traceback.print_exc()
+        return await error(writer, 500, str(e))
+
+    dimensions = cdg.dimensions(result)
+    if command == 'dimensions':
+        return await send(writer, 200, 'application/json',
+                          json.dumps(dimensions).encode('utf-8'), dimensions)
+
+    await send(writer, 200, Formats[fmt], None, dimensions)
+
+    output = Output(writer, loop)
+    try:
+        await loop.run_in_executor(executor, write, result, fmt, output)
+    except ConnectionError:
+        return
+    except Exception:
+        # Leave the response without its last chunk
+        sys.stderr.write('Failed to send the result of %s:\n' % target)
+        traceback.print_exc()
+        return
+
+    await output.send(b'')
+
+
+def write(graph, fmt, output):
+    if fmt == 'dot':
+        graph.to_dot(output)
+    else:
+        graph.save(output, 'result.' + fmt)
+
+    output.flush()
+
+
+async def send(writer, status, content_type, body, dimensions=None):
+    '''
+    Send a response's headers and its body, or just its headers if the body
+    (None) is to be sent in chunks (see Output).
+    '''
+
+    headers = [
+        'HTTP/1.1 %d %s' % (status, http.client.responses[status]),
+        'Content-Type: %s' % content_type,
+        'Connection: close',
+    ]
+
+    if body is None:
+        headers.append('Transfer-Encoding: chunked')
+    else:
+        headers.append('Content-Length: %d' % len(body))
+
+    if dimensions is not None:
+        headers.append('X-CDG-Dimensions: %d %d' % dimensions)
+
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1'))
+    if body:
+        writer.write(body)
+    await writer.drain()
+
+
+async def error(writer, status, message, spec=None):
+    body = json.dumps({'message': message, 'spec': spec}).encode('utf-8')
+    await send(writer, status, 'application/json', body)
+
+
+class Output:
+    '''
+    A file-like object that lets a worker thread stream to a client.
+
+    Data is sent in chunks (as in HTTP's chunked transfer encoding), waiting
+    for each chunk to be written to the socket before accepting more, so a
+    slow client slows the writer down rather than letting the response pile
+    up in memory. Sending an empty chunk ends the response.
+    '''
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+        self.buffer = bytearray()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        self.buffer += data
+        if len(self.buffer) >= ChunkSize:
+            self.flush()
+
+        return len(data)
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        (chunk, self.buffer) = (bytes(self.buffer), bytearray())
+        asyncio.run_coroutine_threadsafe(self.send(chunk), self.loop).result()
+
+    async def send(self, chunk):
+        self.writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        await self.writer.drain()
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        http.client.HTTPConnection.__init__(self, 'localhost',
+                                            timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def connection(address):
+    address = parse_address(address)
+    if isinstance(address, str):
+        return UnixConnection(address)
+
+    return http.client.HTTPConnection(*address)
+
+
+def request(address, command, specs=(), fmt=None):
+    '''
+    Send a query to a running server.
+
+    Returns the result's (nodes, edges) dimensions and a file-like Result
+    to read the result from. Raises OSError if the server can't be reached
+    and cdg.filters.FilterError or ValueError if it rejects the query.
+    '''
+
+    params = [('spec', s) for s in specs]
+    if fmt:
+        params.append(('format', fmt))
+
+    conn = connection(address)
+    conn.request('GET', '/%s?%s' % (command, urllib.parse.urlencode(params)))
+    response = conn.getresponse()
+
+    if response.status != 200:
+        try:
+            e = json.loads(response.read().decode('utf-8'))
+        except ValueError:
+            e = {'message': response.reason, 'spec': None}
+
+        if e.get('spec') is not None:
+            raise cdg.filters.FilterError(e['spec'], e['message'])
+
+        raise ValueError(e['message'])
+
+    dimensions = response.getheader('X-CDG-Dimensions', '0 0').split()
+    return (tuple(int(d) for d in dimensions), Result(response))
+
+
+class Result:
+    '''
+    The body of a server's response, which raises ValueError if the server
+    doesn't finish sending it.
+    '''
+
+    def __init__(self, response):
+        self.response = response
+
+    def read(self, size=-1):
+        try:
+            return self.response.read(None if size < 0 else size)
+        except http.client.HTTPException:
+            raise ValueError('Incomplete response from server')
+
+    def close(self):
+        self.response.close()
+
+
+def format_address(address):
+    if isinstance(address, str):
+        return address
+
+    return '%s:%d' % address
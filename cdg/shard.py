@@ -0,0 +1,524 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Sharded CDGs, for graphs that don't fit in memory.
+
+`split` partitions a graph's functions across on-disk shards, either by a
+hash of the function's name or by module (the input file that defines it),
+without ever building the whole graph. Each shard is a snapshot (see
+cdg.snapshot) of the graph of its own functions, so it is memory-mapped
+rather than loaded.
+
+Every edge is stored in the shard that holds its source. An edge to a node
+in another shard (e.g., a call to another shard's function) points at a
+"ghost" node whose `shard` attribute names the node's home shard. Each
+shard also lists which other shards hold edges into its nodes, so that
+reverse traversals know where to look.
+
+A `ShardedGraph` runs reachability queries as rounds of searches within
+single shards: a search that reaches a ghost hands the node on to its home
+shard, and only shards that the frontier reaches are ever opened. Results
+are written out one shard at a time.
+
+A sharded graph is a directory:
+
+    manifest.json   shard count, partitioning scheme and input files
+    <n>.cdgc        snapshot of shard n
+    <n>.in          nodes of shard n with edges from other shards (UBJSON)
+'''
+
+import collections
+import json
+import os
+import tempfile
+import zlib
+
+import cdg
+import cdg.compact
+import cdg.filters
+import cdg.merge
+import cdg.names
+import cdg.query
+import cdg.snapshot
+import cdg.stats
+import cdg.stream
+
+
+Manifest = 'manifest.json'
+
+Schemes = ('hash', 'module')
+
+Version = 1
+
+
+def split(filenames, directory, shards=16, scheme='hash'):
+    '''
+    Partition the functions in some CDG files across `shards` shards.
+
+    With the 'hash' scheme, a function's shard depends only on its name; with
+    'module', each input file's functions are kept together (file i goes to
+    shard i modulo the shard count). Functions that several files define
+    are combined, as in cdg.merge.
+
+    Only one shard is held in memory at a time, along with the names of
+    functions and their arguments (to resolve calls between shards) and the
+    table of edges between shards.
+    '''
+
+    if shards < 1:
+        raise ValueError('Need at least one shard')
+
+    if scheme not in Schemes:
+        raise ValueError('Invalid sharding scheme: %s' % scheme)
+
+    os.makedirs(directory, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(prefix='cdg-shard-') as tmp:
+        runs = [os.path.join(tmp, '%d.cdg' % i) for i in range(shards)]
+        partition = Partition(shards)
+
+        files = [open(r, 'wb') for r in runs]
+        try:
+            writers = [cdg.stream.UBJSONWriter(f) for f in files]
+
+            for (i, filename) in enumerate(filenames):
+                module = i % shards if scheme == 'module' else None
+                for (name, props) in functions(filename):
+                    for (key, entry) in partition.add(name, props, module):
+                        writers[partition.homes[key]].add(key, entry)
+
+            for w in writers:
+                w.close()
+        finally:
+            for f in files:
+                f.close()
+
+        incoming = [collections.defaultdict(set) for _ in range(shards)]
+
+        for (s, run) in enumerate(runs):
+            with open(run, 'rb') as f:
+                graph = partition.build(s, cdg.stream.functions(f, run),
+                                        incoming)
+
+            with open(shard_path(directory, s), 'wb') as f:
+                cdg.snapshot.write(graph, f)
+
+            del graph
+            os.unlink(run)
+
+    import ubjson
+
+    for (s, nodes) in enumerate(incoming):
+        with open(os.path.join(directory, '%d.in' % s), 'wb') as f:
+            ubjson.dump(dict((n, sorted(t)) for (n, t) in nodes.items()), f)
+
+    with open(os.path.join(directory, Manifest), 'w') as f:
+        json.dump({
+            'version': Version,
+            'shards': shards,
+            'scheme': scheme,
+            'sources': list(filenames),
+            'functions': len(partition.targets),
+        }, f, indent=2)
+
+    return ShardedGraph(directory)
+
+
+def functions(filename):
+    with open(filename, 'rb') as f:
+        if filename.endswith('.cdg') or filename.endswith('.json'):
+            yield from cdg.stream.functions(f, filename)
+        else:
+            yield from cdg.decode(f, filename)['functions'].items()
+
+
+def hash_shard(name, shards):
+    return zlib.crc32(name.encode('utf-8')) % shards
+
+
+def is_sharded(path):
+    return os.path.isfile(os.path.join(path, Manifest))
+
+
+def shard_path(directory, s):
+    return os.path.join(directory, '%d.cdgc' % s)
+
+
+class Partition:
+    '''
+    Where each function lives, and the calls between shards.
+    '''
+
+    def __init__(self, shards):
+        self.shards = shards
+
+        # Home shard of each function (or group of stray edges) by name
+        self.homes = {}
+
+        # Call targets (see cdg.call_targets) of every function, and the home
+        # shard of every argument
+        self.targets = {}
+        self.arguments = {}
+
+    def add(self, name, props, module=None):
+        '''
+        Assign a function to a shard, returning the entries to store: the
+        function itself and, for any edges from nodes named after another
+        function (as in `other::value`), an entry for that function.
+        '''
+
+        home = self.assign(name, module)
+
+        if 'arguments' in props or 'blocks' in props:
+            targets = cdg.call_targets(props)
+            self.targets[name] = targets
+            for arg in targets or []:
+                self.arguments[arg] = home
+
+        own = set([name])
+        own.update(props.get('arguments') or {})
+        for (block, values) in (props.get('blocks') or {}).items():
+            own.add(block)
+            own.update(values)
+
+        stray = {}
+        for key in ('calls', 'flows'):
+            kept = []
+            for e in props.get(key) or []:
+                prefix = cdg.names.function_part(e['from'])
+                if e['from'] in own or prefix == name:
+                    kept.append(e)
+                else:
+                    stray.setdefault(prefix, {}).setdefault(key, []).append(e)
+
+            if key in props:
+                props[key] = kept
+
+        yield (name, props)
+
+        for (prefix, entry) in stray.items():
+            self.assign(prefix)
+            yield (prefix, entry)
+
+    def assign(self, name, module=None):
+        home = self.homes.get(name)
+        if home is None:
+            home = self.homes[name] = hash_shard(name, self.shards) \
+                if module is None else module
+
+        return home
+
+    def home(self, name):
+        '''
+        The shard that a node defined outside of a shard belongs to.
+        '''
+
+        home = self.homes.get(name)
+        if home is None:
+            home = self.arguments.get(name)
+        if home is None:
+            home = self.homes.get(cdg.names.function_part(name))
+        if home is None:
+            home = hash_shard(name, self.shards)
+
+        return home
+
+    def build(self, s, entries, incoming):
+        '''
+        Build the graph of one shard from its functions, turning calls and
+        flows to other shards into edges to ghost nodes and recording them
+        in `incoming`.
+        '''
+
+        functions = {}
+        for (name, props) in entries:
+            functions.setdefault(name, []).append(props)
+
+        functions = dict(
+            (name, props[0] if len(props) == 1 else cdg.merge.combine(props))
+            for (name, props) in functions.items())
+
+        own = set(functions)
+        for props in functions.values():
+            own.update(props.get('arguments') or {})
+            for (block, values) in (props.get('blocks') or {}).items():
+                own.add(block)
+                own.update(values)
+
+        ghosts = {}
+
+        def ghost(name):
+            home = self.home(name)
+            if home != s:
+                ghosts[name] = home
+                incoming[home][name].add(s)
+
+        for props in functions.values():
+            calls = []
+            flows = props.get('flows') or []
+
+            for call in props.get('calls') or []:
+                callee = call['to']
+                if callee in own or self.home(callee) == s:
+                    calls.append(call)
+                    continue
+
+                targets = self.targets.get(callee)
+                for target in [callee] if targets is None else targets:
+                    flows.append(dict(call, to=target, kind='call'))
+                    ghost(target)
+
+            for flow in flows:
+                if flow['to'] not in own:
+                    ghost(flow['to'])
+
+            props['calls'] = calls
+            props['flows'] = flows
+
+        graph = cdg.build('shard %d' % s, functions.items(), compact=True)
+        for (name, home) in ghosts.items():
+            graph.nodes[name]['shard'] = home
+
+        return graph
+
+
+class ShardedGraph:
+    '''
+    A sharded graph on disk (see `split`), keeping up to `resident` shards
+    open at once.
+    '''
+
+    def __init__(self, directory, resident=4):
+        with open(os.path.join(directory, Manifest)) as f:
+            manifest = json.load(f)
+
+        if manifest.get('version') != Version:
+            raise ValueError('Unsupported sharded graph version: %s' % (
+                manifest.get('version')))
+
+        self.directory = directory
+        self.shards = manifest['shards']
+        self.scheme = manifest['scheme']
+        self.resident = max(resident, 1)
+        self.open = collections.OrderedDict()
+
+    def __len__(self):
+        return self.shards
+
+    def shard(self, s):
+        '''
+        Open a shard: returns its graph and the shards that hold edges into
+        each of its nodes.
+        '''
+
+        if s in self.open:
+            self.open.move_to_end(s)
+            return self.open[s]
+
+        import ubjson
+
+        with cdg.stats.phase('shard', shard=s):
+            graph = cdg.snapshot.open_mapped(shard_path(self.directory, s))
+            with open(os.path.join(self.directory, '%d.in' % s), 'rb') as f:
+                incoming = ubjson.load(f)
+
+        self.open[s] = (graph, incoming)
+        if len(self.open) > self.resident:
+            self.open.popitem(last=False)
+
+        return self.open[s]
+
+    def locate(self, names):
+        '''
+        Find the home shards of some nodes (or of the nodes that match
+        patterns; see cdg.names), returning a dict.
+        '''
+
+        patterns = [n for n in names if cdg.names.is_pattern(n)]
+        remaining = set(names).difference(patterns)
+        found = {}
+
+        for s in range(self.shards):
+            if not remaining and not patterns:
+                break
+
+            (graph, incoming) = self.shard(s)
+            for n in cdg.names.expand(graph, patterns):
+                found.setdefault(n, graph.nodes[n].get('shard', s))
+
+            for n in list(remaining):
+                if n in graph:
+                    home = graph.nodes[n].get('shard', s)
+                elif n in incoming:
+                    home = s
+                else:
+                    continue
+
+                found[n] = home
+                remaining.discard(n)
+
+        return found
+
+    @cdg.stats.measured('reachable')
+    def reachable(self, starting_nodes, kinds=cdg.EdgeKind.All,
+                  reverse=False, depth_limit=None):
+        '''
+        Find the nodes reachable from a set of starting nodes, as for
+        cdg.query.reachable. Returns a dict of each node's home shard.
+
+        Each round searches the shard with the most work waiting for it,
+        following edges within the shard and handing nodes in other shards
+        on to them. A reverse search of a node also looks for its
+        predecessors in the other shards that hold edges into it.
+        '''
+
+        homes = self.locate(starting_nodes)
+        depth = dict((n, 0) for n in homes)
+
+        # Nodes to search from in each shard: their own nodes, and nodes in
+        # other shards whose predecessors they hold
+        pending = collections.defaultdict(set)
+        for (n, s) in homes.items():
+            pending[s].add(n)
+
+        visited = scanned = 0
+
+        while pending:
+            s = max(pending, key=lambda s: len(pending[s]))
+            starts = pending.pop(s)
+
+            (graph, incoming) = self.shard(s)
+            nodes = graph.nodes
+            select = cdg.query.neighbours(graph, kinds, reverse)
+
+            def reached(n, d, home):
+                if n in depth and (not depth_limit or depth[n] <= d):
+                    return False
+
+                depth[n] = d
+                homes[n] = home
+                return True
+
+            def hand_on(n):
+                for t in incoming.get(n, ()) if reverse else ():
+                    pending[t].add(n)
+
+            queue = collections.deque()
+            for n in starts:
+                if homes[n] == s:
+                    hand_on(n)
+                queue.append(n)
+
+            while queue:
+                u = queue.popleft()
+                d = depth[u] + 1
+                if u not in graph or (depth_limit and d > depth_limit):
+                    continue
+
+                selected = select(u)
+                visited += 1
+                scanned += len(selected)
+
+                for v in selected:
+                    home = nodes[v].get('shard', s)
+                    if not reached(v, d, home):
+                        continue
+
+                    if home == s:
+                        hand_on(v)
+                        queue.append(v)
+                    else:
+                        pending[home].add(v)
+
+        cdg.stats.count(nodes_visited=visited, edges_scanned=scanned)
+        return homes
+
+    def write(self, found, output, filename, annotations=None):
+        '''
+        Write the subgraph induced by some nodes (a dict of their home shards,
+        as returned by `reachable`) and their parents, one shard at a time.
+
+        Returns the number of nodes and edges written.
+        '''
+
+        by_shard = collections.defaultdict(list)
+        for (n, s) in found.items():
+            by_shard[s].append(n)
+
+        annotations = annotations or {}
+        counts = [0, 0]
+
+        def records():
+            for s in sorted(by_shard):
+                subgraph = self.subgraph(s, by_shard[s], found)
+
+                # Ghosts are counted, annotated and written out by their
+                # home shards: here, they are only the ends of edges, which
+                # are written out with their sources' functions.
+                for (n, attrs) in subgraph.nodes.items():
+                    if attrs.pop('shard', None) is None:
+                        attrs.update(annotations.get(n, {}))
+                        counts[0] += 1
+
+                counts[1] += subgraph.number_of_edges()
+                yield from cdg.function_records(subgraph)
+
+        cdg.stream.write(output, filename, records())
+        return tuple(counts)
+
+    def subgraph(self, s, names, found):
+        '''
+        The part of a result that shard `s` holds: its own nodes, their
+        parents (see cdg.filters.parents) and their edges, including edges
+        to other shards' nodes (ghosts, which keep their `shard` attribute).
+        '''
+
+        (graph, _) = self.shard(s)
+        nodes = graph.nodes
+
+        keep = set(n for n in names if n in graph)
+        keep.update(cdg.filters.parents(graph, keep))
+
+        for n in list(keep):
+            for v in graph.succ[n]:
+                if v in found and 'shard' in nodes[v]:
+                    keep.add(v)
+
+        return cdg.compact.to_networkx(cdg.filters.materialise(graph, keep))
+
+    @cdg.stats.measured('filter')
+    def apply(self, filter_spec, output, filename):
+        '''
+        Apply a reachability filter like calls-to:read,write to the graph,
+        writing the result to a binary stream.
+        '''
+
+        cdg.stats.note(spec=filter_spec)
+        (name, kinds, args, depth_limit) = cdg.filters.parse(filter_spec)
+
+        if name not in cdg.filters.Traversals:
+            raise cdg.filters.FilterError(
+                filter_spec, 'Only reachability filters can be sharded')
+
+        (kinds, reverse, annotations, description) = cdg.filters.traversal(
+            filter_spec, name, kinds)
+        args = list(self.locate(args))
+        found = self.reachable(args, kinds, reverse, depth_limit)
+
+        print('Keeping %d %s of %d nodes' % (len(found), description,
+                                             len(args)))
+
+        return self.write(found, output, filename,
+                          dict((n, annotations) for n in args if n in found))
@@ -22,34 +22,158 @@
 #
 
 
+import cdg
+import cdg.compact
+import cdg.stats
+
+
+# Kinds in decreasing order of precedence when a chain mixes kinds
+Precedence = (
+    cdg.EdgeKind.Call,
+    cdg.EdgeKind.Memory,
+    cdg.EdgeKind.Operand,
+    cdg.EdgeKind.Meta,
+)
+
+
 def is_simple_node(graph, node):
     """A node is "Simple" if none of the following is true
     - it has multiple inputs (it joins chains together)
     - it has no inputs (it's a root node)
     - it has multiple outputs (it splits chains apart)
     - it has no outputs (it's a leaf node)
+    - it has children (removing it would orphan them)
 
     Keyword arguments:
     node -- A networkx DiGraph Node
     """
-    return graph.in_degree(node) == 1 and graph.out_degree(node) == 1
+    return (graph.in_degree(node) == 1 and graph.out_degree(node) == 1
+            and 'children' not in graph.nodes[node])
+
+
+def merge_kinds(kinds):
+    """The kind of an edge that replaces a chain of edges: their common kind
+    if they all agree, otherwise the highest-precedence kind among them.
+    """
+    kinds = set(kinds)
+    if len(kinds) == 1:
+        return kinds.pop()
+
+    for k in Precedence:
+        if k in kinds:
+            return k
+
+    return None
+
+
+def chains(graph):
+    """Find maximal chains of simple nodes in a single pass.
+
+    Yields (source, destination, kind, hops, interior) tuples, one per
+    compressed edge, where `interior` is the list of simple nodes that the
+    edge replaces. Each node and edge is visited once.
+
+    Cycles made up entirely of simple nodes have no endpoints; each is
+    compressed to a self-loop on one of its members.
+    """
+
+    simple = set(n for n in graph if is_simple_node(graph, n))
+    succ = graph.succ
+    visited = set()
+
+    def follow(start, dest, attrs):
+        kinds = [attrs.get('kind')]
+        interior = []
+
+        while dest in simple and dest != start and dest not in visited:
+            visited.add(dest)
+            interior.append(dest)
 
+            ((dest, attrs),) = succ[dest].items()
+            kinds.append(attrs.get('kind'))
 
-def simplified(graph):
+        return (start, dest, merge_kinds(kinds), len(kinds), interior)
+
+    for n in graph:
+        if n in simple:
+            continue
+
+        for (dest, attrs) in succ[n].items():
+            if dest in simple:
+                yield follow(n, dest, attrs)
+
+    for n in simple:
+        if n not in visited:
+            visited.add(n)
+            ((dest, attrs),) = succ[n].items()
+            yield follow(n, dest, attrs)
+
+
+@cdg.stats.measured('simplify')
+def simplified(graph, copy=False):
     """Simplify a CallGraph by coalescing call chains and dropping
     any unreferenced calls.
 
+    Each maximal chain of simple nodes is replaced by a single edge whose
+    'kind' is merged from the chain (see merge_kinds) and whose 'hops'
+    attribute counts the edges it replaces.
+
     Keyword arguments:
-    graph -- A networkx DiGraph
+    graph -- A networkx DiGraph or cdg.compact.CompactGraph
+    copy -- copy the graph and delete from it rather than building the
+            result directly
     """
 
-    g = graph.full_copy()
+    compressed = list(chains(graph))
+    removed = set()
+    for (_, _, _, _, interior) in compressed:
+        removed.update(interior)
 
-    for n in graph:
-        if is_simple_node(graph, n):
-            (pre,) = g.predecessors(n)
-            (suc,) = g.successors(n)
-            g.add_edge(pre, suc)
-            g.remove_node(n)
+    # A real edge takes precedence over a compressed one, and a shorter
+    # chain over a longer one.
+    edges = {}
+    for (src, dest, kind, hops, _) in compressed:
+        if (src, dest) in edges and edges[(src, dest)][1] <= hops:
+            continue
+        if src != dest and graph.has_edge(src, dest) and dest not in removed:
+            continue
+        edges[(src, dest)] = (kind, hops)
+
+    if copy:
+        g = graph.full_copy()
+        g.remove_nodes_from(removed)
+
+        for n in set(graph.nodes[n]['parent'] for n in removed
+                     if 'parent' in graph.nodes[n]):
+            if n in g:
+                g.nodes[n]['children'] = set(
+                    c for c in graph.nodes[n]['children'] if c not in removed)
+
+    else:
+        if isinstance(graph, cdg.compact.CompactGraph):
+            g = cdg.compact.Builder('')
+        else:
+            g = cdg.create('')
+        g.graph.update(graph.graph)
+
+        for (n, attrs) in graph.nodes(data=True):
+            if n in removed:
+                continue
+
+            attrs = dict(attrs)
+            if 'children' in attrs:
+                attrs['children'] = set(
+                    c for c in attrs['children'] if c not in removed)
+            g.add_node(n, **attrs)
+
+        for (src, dest, attrs) in graph.edges(data=True):
+            if src not in removed and dest not in removed:
+                g.add_edge(src, dest, **attrs)
+
+    for ((src, dest), (kind, hops)) in edges.items():
+        g.add_edge(src, dest, kind=kind, hops=hops)
+
+    if isinstance(g, cdg.compact.Builder):
+        g = g.finish()
 
     return g
@@ -0,0 +1,406 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Binary snapshots of built graphs, also usable as a columnar file format.
+
+A snapshot is a CompactGraph's arrays written out as-is: a header, a table of
+named sections and then the sections themselves, each aligned to 8 bytes and
+stored little-endian:
+
+    names, nameoff      sorted string table (UTF-8 blob + offsets)
+    parent, contain     parent id and "is a container" flag of each node
+    childoff, childid   children of each node (CSR)
+    outoff, outdst      outgoing edges (CSR)
+    inoff, insrc        incoming edges (CSC)
+    outkind, inkind     EdgeKind byte of each edge
+    outgrp, ingrp       offsets of each node's edges of each kind
+    attroff, attrs      JSON attributes of each node (offsets + blob)
+    eattrs, graph       JSON edge and graph attributes
+
+`load` copies a snapshot into memory. `open_mapped` instead memory-maps it
+and uses the columns in place: node names are found by binary search over the
+string table and attributes are decoded on demand, so a query only touches the
+pages that it needs. Files with a .cdgc extension are snapshots.
+'''
+
+import bisect
+import collections.abc
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+import cdg.compact
+
+
+Magic = b'CDGSNAP\0'
+Version = 3
+
+Header = struct.Struct('<8sII')
+SectionEntry = struct.Struct('<8sQQ')
+
+Alignment = 8
+
+
+def write(graph, output):
+    '''
+    Write a snapshot of a graph to a binary stream.
+    '''
+
+    if not isinstance(graph, cdg.compact.CompactGraph) or graph._shadowed \
+            or graph._added_succ or len(graph) != graph._base:
+        graph = cdg.compact.from_graph(graph)
+
+    (names, name_offsets) = string_table(graph._names)
+
+    if graph._children is None:
+        graph._index_children()
+    (child_offsets, child_ids) = graph._children
+
+    attrs = [
+        json.dumps(graph._attrs[i], default=sorted).encode('utf-8')
+        if i in graph._attrs else b''
+        for i in range(len(graph._names))
+    ]
+    (attrs, attr_offsets) = (b''.join(attrs), offsets(attrs))
+
+    edge_attrs = [[u, v, a] for ((u, v), a) in graph._edge_attrs.items()]
+
+    sections = [
+        (b'names', names),
+        (b'nameoff', name_offsets),
+        (b'parent', graph._parent),
+        (b'contain', graph._container),
+        (b'childoff', child_offsets),
+        (b'childid', child_ids),
+        (b'outoff', graph._out_offsets),
+        (b'outdst', graph._out_targets),
+        (b'outkind', graph._out_kinds),
+        (b'outgrp', graph._out_groups),
+        (b'inoff', graph._in_offsets),
+        (b'insrc', graph._in_sources),
+        (b'inkind', graph._in_kinds),
+        (b'ingrp', graph._in_groups),
+        (b'attroff', attr_offsets),
+        (b'attrs', attrs),
+        (b'eattrs', json.dumps(edge_attrs, default=sorted).encode('utf-8')),
+        (b'graph', json.dumps(graph.graph, default=sorted).encode('utf-8')),
+    ]
+
+    offset = align(Header.size + SectionEntry.size * len(sections))
+    table = []
+    for (name, data) in sections:
+        length = len(data) * getattr(data, 'itemsize', 1)
+        table.append((name, offset, length))
+        offset = align(offset + length)
+
+    output.write(Header.pack(Magic, Version, len(sections)))
+    for entry in table:
+        output.write(SectionEntry.pack(*entry))
+
+    position = Header.size + SectionEntry.size * len(sections)
+    for ((name, data), (_, offset, length)) in zip(sections, table):
+        output.write(b'\0' * (offset - position))
+        output.write(little_endian(data))
+        position = offset + length
+
+
+def read(stream):
+    '''
+    Read a snapshot from a binary stream into a CompactGraph.
+    '''
+
+    return load(stream.read())
+
+
+def load(buf):
+    '''
+    Build a CompactGraph from a snapshot held in a bytes-like object.
+    '''
+
+    sections = parse(buf)
+
+    def arr(name, typecode):
+        a = array(typecode)
+        a.frombytes(sections[name])
+        if sys.byteorder != 'little':
+            a.byteswap()
+        return a
+
+    blob = bytes(sections[b'names'])
+    name_offsets = arr(b'nameoff', cdg.compact.OffsetType)
+    names = [
+        blob[name_offsets[i]:name_offsets[i + 1]].decode('utf-8')
+        for i in range(len(name_offsets) - 1)
+    ]
+
+    graph = cdg.compact.CompactGraph()
+    graph._names = names
+    graph._index = dict((n, i) for (i, n) in enumerate(names))
+    graph._parent = arr(b'parent', cdg.compact.ParentType)
+    graph._container = bytearray(sections[b'contain'])
+    graph._children = (arr(b'childoff', cdg.compact.OffsetType),
+                       arr(b'childid', cdg.compact.IdType))
+
+    graph._out_offsets = arr(b'outoff', cdg.compact.OffsetType)
+    graph._out_targets = arr(b'outdst', cdg.compact.IdType)
+    graph._out_kinds = bytearray(sections[b'outkind'])
+    graph._out_groups = arr(b'outgrp', cdg.compact.OffsetType)
+    graph._in_offsets = arr(b'inoff', cdg.compact.OffsetType)
+    graph._in_sources = arr(b'insrc', cdg.compact.IdType)
+    graph._in_kinds = bytearray(sections[b'inkind'])
+    graph._in_groups = arr(b'ingrp', cdg.compact.OffsetType)
+
+    graph._attrs = Attributes(arr(b'attroff', cdg.compact.OffsetType),
+                              bytes(sections[b'attrs']))
+
+    return finish(graph, sections)
+
+
+def open_mapped(stream):
+    '''
+    Memory-map a snapshot file (a filename or a binary file object) and
+    return a CompactGraph that reads its columns lazily.
+
+    The mapping is copy-on-write: annotations and other changes to the graph
+    are never written back to the file. A stream without a file descriptor
+    that can be mapped is read into memory instead.
+    '''
+
+    if isinstance(stream, str):
+        with open(stream, 'rb') as f:
+            return open_mapped(f)
+
+    if sys.byteorder != 'little':
+        return read(stream)
+
+    try:
+        buf = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (AttributeError, OSError, ValueError):
+        return read(stream)
+    sections = parse(buf)
+
+    def column(name, typecode):
+        return sections[name].cast(typecode)
+
+    graph = cdg.compact.CompactGraph()
+    graph._names = Names(sections[b'names'],
+                         column(b'nameoff', cdg.compact.OffsetType))
+    graph._index = Index(graph._names)
+    graph._parent = column(b'parent', cdg.compact.ParentType)
+    graph._container = sections[b'contain']
+    graph._children = (column(b'childoff', cdg.compact.OffsetType),
+                       column(b'childid', cdg.compact.IdType))
+
+    graph._out_offsets = column(b'outoff', cdg.compact.OffsetType)
+    graph._out_targets = column(b'outdst', cdg.compact.IdType)
+    graph._out_kinds = sections[b'outkind']
+    graph._out_groups = column(b'outgrp', cdg.compact.OffsetType)
+    graph._in_offsets = column(b'inoff', cdg.compact.OffsetType)
+    graph._in_sources = column(b'insrc', cdg.compact.IdType)
+    graph._in_kinds = sections[b'inkind']
+    graph._in_groups = column(b'ingrp', cdg.compact.OffsetType)
+
+    graph._attrs = Attributes(column(b'attroff', cdg.compact.OffsetType),
+                              sections[b'attrs'])
+
+    # Keep the mapping alive for as long as the graph is
+    graph._mapping = buf
+
+    return finish(graph, sections)
+
+
+def finish(graph, sections):
+    n = len(graph._names)
+
+    graph.graph = json.loads(bytes(sections[b'graph']).decode('utf-8'))
+    graph._edge_attrs = dict(
+        ((u, v), a) for (u, v, a)
+        in json.loads(bytes(sections[b'eattrs']).decode('utf-8')))
+
+    graph._alive = bytearray(b'\x01') * n
+    graph._base = n
+    graph._node_count = n
+    graph._edge_count = len(graph._out_targets)
+
+    return cdg.hot_patch(graph)
+
+
+def parse(buf):
+    '''
+    Validate a snapshot's header and return its sections as memoryviews.
+    '''
+
+    buf = memoryview(buf)
+    if len(buf) < Header.size:
+        raise ValueError('Truncated snapshot')
+
+    (magic, version, count) = Header.unpack_from(buf)
+    if magic != Magic:
+        raise ValueError('Not a CDG snapshot')
+
+    if version != Version:
+        raise ValueError('Unsupported snapshot version: %d' % version)
+
+    sections = {}
+    for i in range(count):
+        (name, offset, length) = SectionEntry.unpack_from(
+            buf, Header.size + i * SectionEntry.size)
+
+        if offset + length > len(buf):
+            raise ValueError('Truncated snapshot')
+
+        sections[name.rstrip(b'\0')] = buf[offset:offset + length]
+
+    return sections
+
+
+def string_table(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    return (b''.join(encoded), offsets(encoded))
+
+
+def offsets(blobs):
+    result = array(cdg.compact.OffsetType, [0])
+    for b in blobs:
+        result.append(result[-1] + len(b))
+    return result
+
+
+def align(offset):
+    return (offset + Alignment - 1) // Alignment * Alignment
+
+
+def little_endian(data):
+    if isinstance(data, array) and sys.byteorder != 'little' \
+            and data.itemsize > 1:
+        data = array(data.typecode, data)
+        data.byteswap()
+
+    return data
+
+
+class Names(collections.abc.Sequence):
+    '''
+    Node names, decoded from a string table as they are needed.
+    '''
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.raw(i).decode('utf-8')
+
+    def raw(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+
+class Index:
+    '''
+    Look up a name's id by binary search over a sorted string table.
+
+    UTF-8 preserves code point order, so names can be compared as bytes.
+    '''
+
+    class Keys:
+        def __init__(self, names):
+            self.names = names
+
+        def __len__(self):
+            return len(self.names)
+
+        def __getitem__(self, i):
+            return self.names.raw(i)
+
+    def __init__(self, names):
+        self.names = names
+        self.keys = Index.Keys(names)
+
+    def get(self, name, default=None):
+        if not isinstance(name, str):
+            return default
+
+        key = name.encode('utf-8')
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.names) and self.keys[i] == key:
+            return i
+
+        return default
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Attributes(collections.abc.MutableMapping):
+    '''
+    Per-node attribute dicts, decoded from JSON the first time that they are
+    used. Decoded (and changed) dicts are kept, so updates persist.
+    '''
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        self.decoded = {}
+        self.deleted = set()
+
+    def stored(self, i):
+        return (isinstance(i, int) and 0 <= i < len(self.offsets) - 1
+                and i not in self.deleted
+                and self.offsets[i] != self.offsets[i + 1])
+
+    def __getitem__(self, i):
+        if i in self.decoded:
+            return self.decoded[i]
+
+        if not self.stored(i):
+            raise KeyError(i)
+
+        data = bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+        attrs = self.decoded[i] = json.loads(data.decode('utf-8'))
+        return attrs
+
+    def __setitem__(self, i, attrs):
+        self.decoded[i] = attrs
+
+    def __delitem__(self, i):
+        if i not in self:
+            raise KeyError(i)
+
+        self.decoded.pop(i, None)
+        if self.stored(i):
+            self.deleted.add(i)
+
+    def __contains__(self, i):
+        return i in self.decoded or self.stored(i)
+
+    def __iter__(self):
+        for i in range(len(self.offsets) - 1):
+            if i in self.decoded or self.stored(i):
+                yield i
+
+        for i in self.decoded:
+            if i >= len(self.offsets) - 1:
+                yield i
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,265 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Timing and memory instrumentation of the phases of CDG processing.
+
+Loading (decoding and building), filtering (traversing and taking the
+subgraph), simplifying, saving and writing .dot files are each measured as a
+phase. Phases nest: a filter's traversal is a phase within the filter. When a
+phase ends, every subscribed callback is called with a record of it:
+
+    {'phase': 'reachable', 'path': 'filter/reachable', 'depth': 1,
+     'started': 1500000000.0, 'seconds': 0.25, 'peak_bytes': 1048576,
+     'nodes_visited': 1234, 'edges_scanned': 5678}
+
+along with any information that the phase noted about itself (e.g., the
+filter spec) and the dimensions of the graph that it returned, if any.
+`peak_bytes` is how far memory use rose above its level at the start of the
+phase, and is None unless tracemalloc is tracing. Tracing slows everything
+down, so a phase that ran while tracemalloc was tracing has None for its
+`seconds`: time and memory use are measured in separate runs (as cdg.bench
+does). Counters like `nodes_visited` are added to the enclosing phases'
+counters too.
+
+Nothing is measured unless something has subscribed, so instrumentation costs
+next to nothing when it isn't used:
+
+    collector = cdg.stats.subscribe(cdg.stats.Collector())
+    graph = cdg.load(...)
+    collector.summary(sys.stderr)
+'''
+
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+
+_subscribers = []
+_local = threading.local()
+
+
+def subscribe(callback):
+    '''
+    Call `callback(record)` at the end of every phase. Returns the callback.
+    '''
+
+    _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    _subscribers.remove(callback)
+
+
+def enabled():
+    return bool(_subscribers)
+
+
+def current():
+    '''
+    The innermost phase running in this thread, or None.
+    '''
+
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def count(**counters):
+    '''
+    Add to the counters of the current phase (e.g., `nodes_visited=10`).
+    '''
+
+    p = current()
+    if p is not None:
+        for (name, n) in counters.items():
+            p.counters[name] += n
+
+
+def note(**info):
+    '''
+    Record information about the current phase (e.g., `spec='calls-to:x'`).
+    '''
+
+    p = current()
+    if p is not None:
+        p.info.update(info)
+
+
+@contextlib.contextmanager
+def phase(name, **info):
+    '''
+    Measure a block of code as a phase.
+    '''
+
+    if not _subscribers:
+        yield None
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    p = Phase(name, stack[-1] if stack else None, info)
+    stack.append(p)
+    try:
+        yield p
+    finally:
+        stack.pop()
+        p.finish()
+
+        for callback in list(_subscribers):
+            callback(p.record())
+
+
+def measured(name):
+    '''
+    Decorator that measures every call of a function as a phase.
+    '''
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _subscribers:
+                return fn(*args, **kwargs)
+
+            with phase(name) as p:
+                result = fn(*args, **kwargs)
+                if hasattr(result, 'number_of_edges'):
+                    p.info['nodes'] = len(result)
+                    p.info['edges'] = result.number_of_edges()
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+class Phase:
+    def __init__(self, name, parent, info):
+        self.name = name
+        self.parent = parent
+        self.info = dict(info)
+        self.counters = collections.Counter()
+
+        self.path = name if parent is None else parent.path + '/' + name
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.started = time.time()
+
+        # tracemalloc only keeps one peak, so each phase resets it and hands
+        # the peak that it saw up to its parent when it finishes.
+        self.memory = self.peak = None
+        self.traced = tracemalloc.is_tracing()
+        if self.traced:
+            (self.memory, peak) = tracemalloc.get_traced_memory()
+            if parent is not None and parent.peak is not None:
+                parent.peak = max(parent.peak, peak)
+            self.peak = self.memory
+            reset_peak()
+
+        self.start = time.perf_counter()
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+
+        tracing = tracemalloc.is_tracing()
+        if self.traced or tracing:
+            self.seconds = None
+
+        if self.peak is not None and tracing:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if self.parent is not None and self.parent.peak is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+
+        if self.parent is not None:
+            self.parent.counters.update(self.counters)
+
+    def record(self):
+        r = {
+            'phase': self.name,
+            'path': self.path,
+            'depth': self.depth,
+            'started': self.started,
+            'seconds': self.seconds,
+            'peak_bytes': None if self.peak is None
+                          else self.peak - self.memory,
+        }
+        r.update(self.counters)
+        r.update(self.info)
+        return r
+
+
+def reset_peak():
+    # tracemalloc.reset_peak is new in Python 3.9
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+class Collector:
+    '''
+    A callback that keeps the records of all phases.
+    '''
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def ordered(self):
+        '''
+        Records in the order that their phases started.
+        '''
+
+        return sorted(self.records, key=lambda r: (r['started'], r['depth']))
+
+    def dump(self, output):
+        '''
+        Write the records to a text stream as JSON.
+        '''
+
+        json.dump(self.ordered(), output, indent=2, default=str)
+        output.write('\n')
+
+    def summary(self, output):
+        '''
+        Write a table of the records to a text stream.
+        '''
+
+        output.write('%-28s %10s %11s %10s %10s  %s\n' % (
+            'phase', 'time (s)', 'peak (MiB)', 'visited', 'scanned',
+            'details'))
+
+        for r in self.ordered():
+            peak = r['peak_bytes']
+            details = ' '.join(
+                '%s=%s' % (k, v) for (k, v) in sorted(r.items())
+                if k not in Columns)
+
+            output.write('%-28s %10s %11s %10s %10s  %s\n' % (
+                '  ' * r['depth'] + r['phase'],
+                '-' if r['seconds'] is None else '%.3f' % r['seconds'],
+                '-' if peak is None else '%.1f' % (peak / (1 << 20)),
+                r.get('nodes_visited', '-'), r.get('edges_scanned', '-'),
+                details))
+
+
+Columns = ('phase', 'path', 'depth', 'started', 'seconds', 'peak_bytes',
+           'nodes_visited', 'edges_scanned')
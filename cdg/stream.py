@@ -0,0 +1,375 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Incremental decoding and encoding of CDG documents.
+
+The functions in this module walk the top level of a serialised CDG and yield
+one entry of its `functions` object at a time, so that callers can build a
+graph without ever holding the whole decoded document in memory. `write` is
+the inverse: it encodes a document one function at a time.
+'''
+
+import codecs
+import json
+import struct
+
+
+def functions(stream, filename):
+    '''
+    Iterate over the (name, properties) pairs of a document's functions.
+    '''
+
+    if filename.endswith('.cdg'):
+        return ubjson_functions(stream)
+
+    elif filename.endswith('.json'):
+        return json_functions(stream)
+
+    else:
+        raise ValueError('Unhandled file type for streaming: %s' % filename)
+
+
+def write(output, filename, functions):
+    '''
+    Write a document from an iterable of (name, properties) pairs to a binary
+    stream, in the format implied by the filename.
+    '''
+
+    if filename.endswith('.cdg'):
+        write_ubjson(output, functions)
+
+    elif filename.endswith('.json'):
+        write_json(output, functions)
+
+    elif filename.endswith('.yaml'):
+        write_yaml(output, functions)
+
+    else:
+        raise ValueError('Unhandled file type for streaming: %s' % filename)
+
+
+def write_json(output, functions):
+    output.write(b'{"functions": {')
+
+    separator = b''
+    for (name, props) in functions:
+        output.write(separator)
+        output.write(json.dumps(name).encode('utf-8'))
+        output.write(b': ')
+        output.write(json.dumps(props).encode('utf-8'))
+        separator = b', '
+
+    output.write(b'}}')
+
+
+def write_ubjson(output, functions):
+    writer = UBJSONWriter(output)
+    for (name, props) in functions:
+        writer.add(name, props)
+    writer.close()
+
+
+class UBJSONWriter:
+    '''
+    Write a UBJSON document one function at a time, for callers that produce
+    functions for several documents at once (see cdg.shard).
+    '''
+
+    def __init__(self, output):
+        import ubjson
+
+        self.output = output
+        self.dumpb = ubjson.dumpb
+
+        output.write(b'{')
+        output.write(_UBJSONReader.key('functions'))
+        output.write(b'{')
+
+    def add(self, name, props):
+        self.output.write(_UBJSONReader.key(name))
+        self.output.write(self.dumpb(props))
+
+    def close(self):
+        self.output.write(b'}}')
+
+
+def write_yaml(output, functions):
+    import yaml
+
+    try:
+        from yaml import CSafeDumper as Dumper
+    except ImportError:
+        from yaml import SafeDumper as Dumper
+
+    output.write(b'functions:')
+
+    empty = True
+    for (name, props) in functions:
+        if empty:
+            output.write(b'\n')
+            empty = False
+
+        text = yaml.dump({name: props}, Dumper=Dumper,
+                         default_flow_style=False)
+        for line in text.splitlines(True):
+            output.write(b'  ' + line.encode('utf-8'))
+
+    if empty:
+        output.write(b' {}\n')
+
+
+def json_functions(stream):
+    '''
+    Iterate over the functions in a JSON-encoded document.
+    '''
+
+    reader = _JSONReader(stream)
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+
+        if key == 'functions':
+            reader.expect('{')
+            if reader.peek() == '}':
+                reader.expect('}')
+            else:
+                while True:
+                    name = reader.value()
+                    reader.expect(':')
+                    yield (name, reader.value())
+
+                    if reader.peek() == '}':
+                        reader.expect('}')
+                        break
+                    reader.expect(',')
+        else:
+            reader.value()
+
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
+
+
+def ubjson_functions(stream, spans=False):
+    '''
+    Iterate over the functions in a UBJSON-encoded document.
+
+    Only the containers that enclose function entries are decoded here; each
+    entry is handed to `ubjson.load`, which stops reading at its end.
+
+    If `spans` is set, the stream must be seekable and each function comes
+    with the (start, end) offsets of its entry, which `read_span` can later
+    decode on its own.
+    '''
+
+    import ubjson
+
+    reader = _UBJSONReader(stream, spans)
+
+    for key in reader.object_keys():
+        if key != 'functions':
+            ubjson.load(stream)
+            continue
+
+        for name in reader.object_keys():
+            if spans:
+                yield (name, ubjson.load(stream),
+                       (reader.start, stream.tell()))
+            else:
+                yield (name, ubjson.load(stream))
+
+
+def read_span(stream, span):
+    '''
+    Decode the function entry at some (start, end) offsets of a UBJSON
+    document, returning its (name, properties).
+    '''
+
+    import ubjson
+
+    (start, end) = span
+    stream.seek(start)
+    entry = ubjson.loadb(b'{' + stream.read(end - start) + b'}')
+
+    return next(iter(entry.items()))
+
+
+class _JSONReader:
+    '''
+    Pull values from a JSON text stream without decoding the enclosing object.
+    '''
+
+    ChunkSize = 1 << 16
+
+    def __init__(self, stream):
+        # Binary streams are decoded as they are read, rather than wrapped in
+        # an io.TextIOWrapper (which would close the caller's stream)
+        self.stream = stream
+        self.text = None
+        if isinstance(stream.read(0), bytes):
+            self.text = codecs.getincrementaldecoder('utf-8')()
+
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=ChunkSize):
+        if self.pos > 0:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+
+        data = self.stream.read(max(size, self.ChunkSize))
+        if not data:
+            self.eof = True
+
+        if self.text is not None:
+            self.buf += self.text.decode(data, final=not data)
+        else:
+            self.buf += data
+
+        return bool(data)
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError("Expected '%s' at JSON offset %d, got '%s'" % (
+                c, self.pos, self.buf[self.pos]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+
+                # A number at the very end of the buffer may be truncated.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # Grow geometrically so that large values aren't re-parsed for
+            # every chunk that we read.
+            self.fill(len(self.buf) - self.pos)
+
+
+class _UBJSONReader:
+    '''
+    Walk UBJSON object headers and keys, leaving values to `ubjson.load`.
+    '''
+
+    Lengths = {
+        b'i': struct.Struct('>b'),
+        b'U': struct.Struct('>B'),
+        b'I': struct.Struct('>h'),
+        b'l': struct.Struct('>i'),
+        b'L': struct.Struct('>q'),
+    }
+
+    def __init__(self, stream, spans=False):
+        self.stream = stream
+
+        # Where the last key read (and any no-ops before it) started
+        self.spans = spans
+        self.start = None
+
+    @classmethod
+    def key(cls, name):
+        '''
+        Encode an object key: a length followed by UTF-8 bytes.
+        '''
+
+        data = name.encode('utf-8')
+        for marker in (b'U', b'l', b'L'):
+            fmt = cls.Lengths[marker]
+            if len(data) < 1 << (8 * fmt.size - (marker != b'U')):
+                return marker + fmt.pack(len(data)) + data
+
+    def read(self, n):
+        data = self.stream.read(n)
+        if len(data) != n:
+            raise ValueError('Unexpected end of UBJSON document')
+        return data
+
+    def marker(self):
+        while True:
+            m = self.read(1)
+            if m != b'N':
+                return m
+
+    def length(self, marker):
+        if marker not in self.Lengths:
+            raise ValueError('Invalid UBJSON length marker: %r' % marker)
+
+        fmt = self.Lengths[marker]
+        return fmt.unpack(self.read(fmt.size))[0]
+
+    def object_keys(self):
+        '''
+        Iterate over the keys of the object at the current position.
+
+        The caller must consume each key's value before asking for the next.
+        '''
+
+        if self.marker() != b'{':
+            raise ValueError('Expected UBJSON object')
+
+        count = None
+        if self.spans:
+            self.start = self.stream.tell()
+        m = self.marker()
+        if m == b'$':
+            raise ValueError('Typed UBJSON objects cannot be streamed')
+
+        elif m == b'#':
+            count = self.length(self.marker())
+            m = None
+
+        while count is None or count > 0:
+            if m is None:
+                if self.spans:
+                    self.start = self.stream.tell()
+                m = self.marker()
+
+            if count is None and m == b'}':
+                return
+
+            key = self.read(self.length(m)).decode('utf-8')
+            m = None
+
+            yield key
+
+            if count is not None:
+                count -= 1
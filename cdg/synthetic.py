@@ -0,0 +1,113 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Seeded generator of synthetic CDGs, for benchmarks and tests.
+
+Generated functions look like those of real programs: each has zero to three
+arguments (calls to a function without arguments point at the function
+itself) and a number of blocks of values, with flows between its own values
+and calls from its values to other functions. Callees are skewed towards
+low-numbered functions, so that a few "library" functions are called from
+everywhere, as they are in real code.
+
+The same parameters and seed always produce the same document.
+'''
+
+import random
+
+
+def functions(count, blocks=8, values=8, calls=1, flows=2, seed=0):
+    '''
+    Generate (name, properties) pairs for `count` functions, one at a time.
+
+    `calls` is the number of calls per block and `flows` the number of flows
+    per value.
+    '''
+
+    rng = random.Random(seed)
+    names = ['fn%d' % i for i in range(count)]
+
+    for fn in names:
+        args = dict(('%s::arg%d' % (fn, i), {})
+                    for i in range(rng.randint(0, 3)))
+        all_values = list(args)
+        bbs = {}
+
+        for b in range(blocks):
+            block = '%s::bb%d' % (fn, b)
+            bbs[block] = dict(
+                ('%s::v%d' % (block, v), {'description': 'value %d' % v})
+                for v in range(values))
+            all_values += list(bbs[block])
+
+        if not all_values:
+            yield (fn, {'arguments': args, 'attributes': {}})
+            continue
+
+        fn_flows = [
+            {
+                'from': rng.choice(all_values),
+                'to': rng.choice(all_values),
+                'kind': rng.choice(('operand', 'operand', 'memory')),
+            }
+            for _ in range(flows * len(all_values))
+        ]
+
+        fn_calls = [
+            {
+                'from': rng.choice(all_values),
+                'to': names[int(count * rng.random() ** 2)],
+            }
+            for _ in range(calls * blocks)
+        ]
+
+        yield (fn, {
+            'arguments': args,
+            'attributes': {},
+            'blocks': bbs,
+            'calls': fn_calls,
+            'flows': fn_flows,
+        })
+
+
+def generate(count, blocks=8, values=8, calls=1, flows=2, seed=0):
+    '''
+    Generate a whole document (see `functions`).
+    '''
+
+    return {
+        'functions': dict(functions(count, blocks, values, calls, flows,
+                                    seed)),
+    }
+
+
+def write(filename, count, blocks=8, values=8, calls=1, flows=2, seed=0):
+    '''
+    Write a synthetic CDG to a file, in the format implied by its name.
+
+    Documents are written one function at a time; only .cdgc snapshots need
+    the graph to be built first.
+    '''
+
+    fns = functions(count, blocks, values, calls, flows, seed)
+
+    with open(filename, 'wb') as f:
+        if filename.endswith('.cdgc'):
+            import cdg
+            cdg.save(cdg.build('synthetic', fns, compact=True), f, filename)
+
+        else:
+            import cdg.stream
+            cdg.stream.write(f, filename, fns)
@@ -0,0 +1,49 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+from unittest import TestCase
+
+import cdg.bench
+import cdg.synthetic
+
+
+class TestBench(TestCase):
+    def test_synthetic(self):
+        self.assertEqual(cdg.synthetic.generate(10, 2, 2, seed=4),
+                         cdg.synthetic.generate(10, 2, 2, seed=4))
+
+        graph = cdg.build('synthetic',
+                          cdg.synthetic.functions(10, 2, 2, calls=2))
+        self.assertIn('fn3::bb1::v1', graph)
+
+    def test_run(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = cdg.bench.run(['5x2x2'], repeat=1, memory=False,
+                                    formats=('json', 'cdgc'),
+                                    backends=('compact',))
+
+        operations = set((r['operation'], r['variant']) for r in results)
+        self.assertIn(('load', 'json-streaming'), operations)
+        self.assertIn(('load', 'cdgc'), operations)
+        self.assertIn(('filter', 'calls-to'), operations)
+        self.assertIn(('index', 'all'), operations)
+        self.assertIn(('simplify', None), operations)
+        self.assertIn(('save', 'cdgc'), operations)
+        self.assertIn(('dot', None), operations)
+
+        for r in results:
+            self.assertGreaterEqual(r['seconds'], 0)
+            self.assertIsNone(r['peak_bytes'])
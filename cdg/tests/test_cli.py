@@ -0,0 +1,94 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+import cdg
+import cdg.synthetic
+
+
+Root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+class TestCommandLine(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.graph = self.path('graph.json')
+        cdg.synthetic.write(self.graph, 10, 2, 2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def run_cdg(self, *args, status=0):
+        '''
+        Run bin/cdg, checking its exit status and returning its standard
+        output and standard error.
+        '''
+
+        env = dict(os.environ)
+        env['CDG_CACHE_DIR'] = self.path('cache')
+        env['PYTHONPATH'] = os.pathsep.join(
+            [Root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+        result = subprocess.run(
+            [sys.executable, os.path.join(Root, 'bin', 'cdg')] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            universal_newlines=True)
+
+        self.assertEqual(result.returncode, status, result.stderr)
+        return (result.stdout, result.stderr)
+
+    def test_merge(self):
+        output = self.path('merged.cdgc')
+        self.run_cdg('merge', '--workers=1', output, self.graph)
+        with open(output, 'rb') as f:
+            merged = cdg.load(f, output)
+        with open(self.graph, 'rb') as f:
+            self.assertEqual(merged.dimensions(),
+                             cdg.load(f, self.graph).dimensions())
+
+        # Unknown output formats are reported before any work is done
+        (_, stderr) = self.run_cdg('merge', self.path('merged.txt'),
+                                   self.graph, status=1)
+        self.assertEqual(stderr, 'Unhandled output file type: %s\n' %
+                         self.path('merged.txt'))
+
+    def test_stats(self):
+        output = self.path('filtered.cdg')
+        (stdout, _) = self.run_cdg('filter', '--no-server', '--stats=-',
+                                   '-o', output, self.graph, 'calls-to:fn0')
+
+        records = json.loads(stdout[stdout.index('[\n'):])
+        phases = set(r['path'] for r in records)
+        self.assertIn('load', phases)
+        self.assertIn('filter-pipeline', phases)
+        self.assertTrue(all(r['seconds'] is not None for r in records))
+
+        stats = self.path('stats.json')
+        self.run_cdg('filter', '--no-server', '--trace-memory',
+                     '--stats=' + stats, '-o', output, self.graph,
+                     'calls-to:fn0')
+
+        with open(stats) as f:
+            records = json.load(f)
+        self.assertTrue(all(r['seconds'] is None for r in records))
+        self.assertTrue(all(r['peak_bytes'] is not None for r in records))
@@ -0,0 +1,321 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import cdg
+import cdg.cache
+import cdg.compact
+import cdg.memo
+import cdg.query
+import cdg.reach
+import cdg.synthetic
+
+
+DOCUMENT = {
+    'functions': {
+        'main': {
+            'arguments': {'main::argc': {}},
+            'blocks': {
+                'main::entry': {
+                    'main::entry::x': {'description': 'x'},
+                    'main::entry::y': {},
+                },
+            },
+            'calls': [{'from': 'main::entry::y', 'to': 'foo'}],
+            'flows': [
+                {'from': 'main::argc', 'to': 'main::entry::x',
+                 'kind': 'operand'},
+                {'from': 'main::entry::x', 'to': 'main::entry::y',
+                 'kind': 'memory'},
+            ],
+        },
+        'foo': {
+            'arguments': {'foo::a': {}, 'foo::b': {}},
+        },
+    },
+}
+
+
+class TestLoad(TestCase):
+    def check(self, graph):
+        self.assertEqual(graph.dimensions(), (8, 4))
+        self.assertEqual(graph.nodes['main']['children'],
+                         {'main::argc', 'main::entry'})
+        self.assertEqual(graph.nodes['main::entry::x']['parent'],
+                         'main::entry')
+        self.assertEqual(
+            {d for (s, d, k) in graph.edges(data='kind')
+             if k == cdg.EdgeKind.Call},
+            {'foo::a', 'foo::b'})
+
+    def test_document(self):
+        data = json.dumps(DOCUMENT).encode('utf-8')
+        self.check(cdg.load(io.BytesIO(data), 'test.json'))
+
+    def test_streaming_json(self):
+        # Non-ASCII names are decoded from a binary stream
+        document = json.loads(json.dumps(DOCUMENT).replace('foo', 'f\u00f6o'))
+        data = json.dumps(document, ensure_ascii=False).encode('utf-8')
+
+        want = cdg.load(io.BytesIO(data), 'test.json')
+        stream = io.BytesIO(data)
+
+        for _ in range(2):
+            graph = cdg.load(stream, 'test.json', streaming=True)
+            self.assertIn('f\u00f6o::a', graph)
+            self.assertEqual(set(graph.edges()), set(want.edges()))
+
+            # The caller's stream is left open, to be read again
+            self.assertFalse(stream.closed)
+            stream.seek(0)
+
+        self.check(cdg.load(io.BytesIO(json.dumps(DOCUMENT).encode('utf-8')),
+                            'test.json', streaming=True))
+
+    def test_streaming_ubjson(self):
+        import ubjson
+        data = ubjson.dumpb(DOCUMENT)
+        stream = io.BytesIO(data)
+        self.check(cdg.load(stream, 'test.cdg', streaming=True))
+        self.assertFalse(stream.closed)
+
+    def test_compact(self):
+        data = json.dumps(DOCUMENT).encode('utf-8')
+        graph = cdg.load(io.BytesIO(data), 'test.json', compact=True)
+        self.check(graph)
+
+        graph.nodes['foo::a']['flow'] = 'sink'
+        self.assertEqual(dict(graph.nodes['foo::a']),
+                         {'parent': 'foo', 'flow': 'sink'})
+
+        sub = graph.subgraph(['main::entry::x', 'main::entry::y'])
+        self.assertEqual(cdg.dimensions(sub), (2, 1))
+        self.assertEqual(sub.nodes['main::entry::x']['parent'], 'main::entry')
+
+    def test_columnar(self):
+        data = json.dumps(DOCUMENT).encode('utf-8')
+        graph = cdg.load(io.BytesIO(data), 'test.json', cache=False)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'test.cdgc')
+            with open(filename, 'wb') as f:
+                graph.save(f, filename)
+
+            # Snapshots are used as they are, not converted
+            with open(filename, 'rb') as f:
+                mapped = cdg.load(f, filename)
+            self.check(mapped)
+            self.assertIsInstance(mapped, cdg.compact.CompactGraph)
+
+            with open(filename, 'rb') as f:
+                converted = cdg.load(f, filename, compact=False)
+            self.check(converted)
+            self.assertIsInstance(converted, cdg.Graph)
+
+            # Streams that can't be mapped are read instead
+            with open(filename, 'rb') as f:
+                data = f.read()
+            self.check(cdg.load(io.BytesIO(data), filename))
+            self.assertNotIn('main::nothing', mapped)
+
+            # Changes stay in memory
+            mapped.nodes['foo::a']['flow'] = 'sink'
+            mapped.add_edge('foo::a', 'foo::b', kind=cdg.EdgeKind.Operand)
+            self.assertEqual(mapped.dimensions(), (8, 5))
+
+            with open(filename, 'rb') as f:
+                self.check(cdg.load(f, filename, compact=True))
+
+    def test_save(self):
+        data = json.dumps(DOCUMENT).encode('utf-8')
+
+        for compact in (False, True):
+            graph = cdg.load(io.BytesIO(data), 'test.json', compact=compact,
+                             cache=False)
+            before = dict((n, dict(graph.nodes[n])) for n in graph)
+
+            for filename in ('test.cdg', 'test.json', 'test.yaml'):
+                output = io.BytesIO()
+                graph.save(output, filename)
+                output.seek(0)
+                self.check(cdg.load(output, filename, cache=False))
+
+            # Saving leaves the graph alone
+            self.assertEqual(dict((n, dict(graph.nodes[n])) for n in graph),
+                             before)
+
+    def test_patch(self):
+        for compact in (False, True):
+            graph = cdg.build('test', DOCUMENT['functions'].items(), compact)
+            affected = cdg.patch(graph, [
+                ('foo', {'arguments': {'foo::c': {}}}),
+            ])
+
+            self.assertEqual(affected,
+                             {'foo', 'foo::a', 'foo::b', 'foo::c',
+                              'main::entry::y'})
+            self.assertEqual(graph.dimensions(), (7, 3))
+            self.assertEqual(set(graph.succ['main::entry::y']), {'foo::c'})
+            self.assertEqual(graph.nodes['foo']['children'], {'foo::c'})
+
+    def test_merge(self):
+        import cdg.merge
+
+        # main calls foo, which is defined in another unit
+        main = dict(DOCUMENT['functions']['main'])
+        units = [
+            {'main': main, 'foo': {'calls': []}},
+            {'foo': DOCUMENT['functions']['foo']},
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filenames = []
+            for (i, unit) in enumerate(units):
+                filenames.append(os.path.join(tmp, 'unit%d.json' % i))
+                with open(filenames[-1], 'w') as f:
+                    json.dump({'functions': unit}, f)
+
+            self.check(cdg.merge.load(filenames, workers=1))
+
+            for name in ('merged.cdg', 'merged.json', 'merged.cdgc'):
+                output = os.path.join(tmp, name)
+                cdg.merge.merge(filenames, output, workers=1)
+                with open(output, 'rb') as f:
+                    self.check(cdg.load(f, output))
+
+            with self.assertRaises(ValueError):
+                cdg.merge.merge(filenames, os.path.join(tmp, 'merged.txt'),
+                                workers=1)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ['CDG_CACHE_DIR'] = os.path.join(tmp, 'cache')
+            filename = os.path.join(tmp, 'test.json')
+            with open(filename, 'w') as f:
+                json.dump(DOCUMENT, f)
+
+            try:
+                # The cache is only used when asked for
+                with open(filename, 'rb') as f:
+                    cdg.load(f, filename)
+                self.assertEqual(cdg.cache.entries(), [])
+
+                with open(filename, 'rb') as f:
+                    cdg.load(f, filename, cache=True)
+                self.assertEqual(len(cdg.cache.entries()), 1)
+
+                # A cache hit doesn't need to read the stream at all
+                self.check(cdg.load(io.BytesIO(), filename, cache=True))
+                self.check(cdg.load(io.BytesIO(), filename, compact=True,
+                                    cache=True))
+
+                # The first run (which builds the graph) keeps the indexes
+                # and memos derived from it, for later runs to reuse
+                for compact in (False, True):
+                    cdg.cache.clear()
+                    files = []
+
+                    for run in range(2):
+                        with open(filename, 'rb') as f:
+                            graph = cdg.load(f, filename, compact=compact,
+                                             cache=True)
+
+                        cdg.reach.attach(graph)
+                        cdg.memo.attach(graph)
+                        self.assertEqual(len(graph.memo), run)
+
+                        self.assertIn('foo::a', cdg.query.reachable(
+                            graph, ['main::argc']))
+                        cdg.query.reachable(graph, ['foo::a'], depth_limit=1)
+                        cdg.memo.persist(graph)
+
+                        files.append(dict(
+                            (os.path.basename(p), os.stat(p).st_ino)
+                            for (p, _, _) in cdg.cache.entries()
+                            if p.endswith(cdg.reach.Suffix)))
+
+                    # The second run read the index rather than rebuilding it
+                    self.assertEqual(len(files[0]), 1)
+                    self.assertEqual(files[0], files[1])
+            finally:
+                del os.environ['CDG_CACHE_DIR']
+
+    def test_diff(self):
+        import cdg.digest
+
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ['CDG_CACHE_DIR'] = os.path.join(tmp, 'cache')
+            changed = json.loads(json.dumps(DOCUMENT))
+            changed['functions']['main']['flows'].pop()
+            changed['functions']['bar'] = {'arguments': {'bar::x': {}}}
+
+            filenames = []
+            for (name, doc) in (('old', DOCUMENT), ('new', changed)):
+                data = json.dumps(doc).encode('utf-8')
+                graph = cdg.load(io.BytesIO(data), 'test.json', cache=False)
+
+                filename = os.path.join(tmp, name + '.cdg')
+                with open(filename, 'wb') as f:
+                    graph.save(f, filename)
+                filenames.append(filename)
+
+            try:
+                self.assertEqual(cdg.digest.diff(filenames[0], filenames[0]),
+                                 [])
+
+                changes = cdg.digest.diff(*filenames)
+                self.assertEqual([(c.name, c.status) for c in changes],
+                                 [('bar', 'added'), ('main', 'modified')])
+                self.assertEqual(changes[1].edges_removed, [
+                    ('main::entry::x', 'main::entry::y', 'memory')])
+                self.assertEqual(changes[1].nodes_added, [])
+
+                # Loading a file in streaming mode records its hashes
+                os.remove(cdg.digest.record_path(filenames[1]))
+                with open(filenames[1], 'rb') as f:
+                    cdg.load(f, filenames[1], streaming=True, cache=True)
+
+                digest = cdg.digest.lookup(
+                    filenames[1], cdg.digest.file_stamp(filenames[1]))
+                self.assertEqual(sorted(digest.spans), ['bar', 'foo', 'main'])
+                self.assertEqual(len(cdg.digest.diff(*filenames)), 2)
+
+                # A source document and the same graph saved by cdg.save
+                # (with its calls resolved to edges) are the same
+                source = os.path.join(tmp, 'source.cdg')
+                cdg.synthetic.write(source, 20, 2, 2, calls=2)
+                with open(source, 'rb') as f:
+                    synthetic = cdg.load(f, source)
+
+                for name in ('saved.cdg', 'saved.json', 'saved.cdgc'):
+                    saved = os.path.join(tmp, name)
+                    with open(saved, 'wb') as f:
+                        synthetic.save(f, saved)
+                    self.assertEqual(cdg.digest.diff(source, saved), [])
+
+                # Documents that can only be decoded whole, too
+                yaml = os.path.join(tmp, 'new.yaml')
+                with open(yaml, 'wb') as f:
+                    graph.save(f, yaml)
+                self.assertEqual(cdg.digest.diff(yaml, filenames[1]), [])
+                self.assertEqual(
+                    [c.name for c in cdg.digest.diff(filenames[0], yaml)],
+                    ['bar', 'main'])
+            finally:
+                del os.environ['CDG_CACHE_DIR']
@@ -0,0 +1,55 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+import cdg
+import cdg.filters
+import cdg.parallel
+import cdg.query
+import cdg.synthetic
+
+
+class TestParallel(TestCase):
+    def test_apply_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'graph.json')
+            cdg.synthetic.write(source, 40, 2, 2, seed=3)
+            with open(source, 'rb') as f:
+                graph = cdg.load(f, source, cache=False)
+
+        specs = [
+            'flows-from:fn0', 'flows-to:fn5::bb1::v0', 'calls-to:fn9',
+            'flows-from:fn1,fn2,fn3,fn4,fn6', 'flows-to:fn2::*::v1:2',
+            'exclude:fn7',
+        ]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = cdg.filters.apply_batch(specs, graph)
+            with cdg.parallel.Pool(graph, workers=3) as pool:
+                results = pool.apply_batch(specs)
+
+                # One traversal from many seeds, split among the workers
+                seeds = ['fn%d' % i for i in range(0, 40, 3)]
+                self.assertEqual(
+                    pool.reachable(seeds, depth_limit=3),
+                    cdg.query.reachable(graph, seeds, depth_limit=3))
+
+        for (spec, e, r) in zip(specs, expected, results):
+            self.assertEqual(set(e), set(r), spec)
+            self.assertEqual(e.number_of_edges(), r.number_of_edges(), spec)
@@ -0,0 +1,511 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import io
+import random
+import tracemalloc
+from unittest import TestCase
+
+import cdg
+import cdg.condense
+import cdg.filters
+import cdg.memo
+import cdg.names
+import cdg.query
+import cdg.reach
+import cdg.stats
+import cdg.synthetic
+
+
+def chain(compact):
+    '''
+    a -call-> b -operand-> c -memory-> d, plus x -call-> c
+    '''
+    fns = {
+        'f': {
+            'blocks': {
+                'f::bb': dict((n, {}) for n in ('a', 'b', 'c', 'd', 'x')),
+            },
+            'flows': [
+                {'from': 'a', 'to': 'b', 'kind': 'call'},
+                {'from': 'b', 'to': 'c', 'kind': 'operand'},
+                {'from': 'c', 'to': 'd', 'kind': 'memory'},
+                {'from': 'x', 'to': 'c', 'kind': 'call'},
+            ],
+        },
+    }
+
+    return cdg.build('test', fns.items(), compact)
+
+
+class TestReachable(TestCase):
+    def check(self, graph):
+        calls = cdg.EdgeKind.mask(cdg.EdgeKind.Call)
+        reachable = lambda *args, **kw: cdg.query.reachable(graph, *args, **kw)
+
+        self.assertEqual(reachable(['a']), {'a', 'b', 'c', 'd'})
+        self.assertEqual(reachable(['a'], depth_limit=2), {'a', 'b', 'c'})
+        self.assertEqual(reachable(['a'], calls), {'a', 'b'})
+        self.assertEqual(reachable(['c'], calls, reverse=True), {'c', 'x'})
+        self.assertEqual(reachable(['d', 'nonexistent'], reverse=True),
+                         {'a', 'b', 'c', 'd', 'x'})
+
+        seed_sets = [['a'], ['c', 'x'], ['nonexistent'], ['d']]
+        for depth in (None, 1):
+            self.assertEqual(
+                cdg.query.reachable_sets(graph, seed_sets, reverse=True,
+                                         depth_limit=depth),
+                [reachable(s, reverse=True, depth_limit=depth)
+                 for s in seed_sets])
+
+        reachable(['d'], annotations={'flow': 'sink'})
+        self.assertEqual(graph.nodes['d']['flow'], 'sink')
+
+        # Filters annotate their result, not the graph being filtered
+        result = cdg.filters.apply('calls-to:c', graph)
+        self.assertEqual(set(result.nodes), {'c', 'x', 'f::bb', 'f'})
+        self.assertEqual(result.nodes['c']['call'], 'target')
+        self.assertNotIn('call', graph.nodes['c'])
+
+        # Specs can choose which kinds of edges to follow
+        result = cdg.filters.apply('flows-to[memory,operand]:d', graph)
+        self.assertEqual(set(result.nodes), {'b', 'c', 'd', 'f::bb', 'f'})
+        result = cdg.filters.apply('calls-to[operand]:c', graph)
+        self.assertEqual(set(result.nodes), {'b', 'c', 'f::bb', 'f'})
+        self.assertRaises(cdg.filters.FilterError, cdg.filters.apply,
+                          'flows-to[bogus]:d', graph)
+
+        # A pipeline only searches the nodes that earlier filters kept
+        result = cdg.filters.apply_all(
+            ['flows-to:d', 'exclude:b', 'flows-to:d'], graph)
+        self.assertEqual(set(result.nodes), {'c', 'd', 'x', 'f::bb', 'f'})
+        self.assertEqual(result.nodes['d']['flow'], 'sink')
+
+    def check_index(self, graph, attach=cdg.reach.attach):
+        attach(graph)
+        self.check(graph)
+
+        # Changing the graph invalidates its indexes
+        graph.add_edge('d', 'x', kind=cdg.EdgeKind.Operand)
+        self.assertEqual(cdg.query.reachable(graph, ['c']), {'c', 'd', 'x'})
+        self.assertEqual(cdg.query.reachable(graph, ['x'], reverse=True),
+                         {'a', 'b', 'c', 'd', 'x'})
+
+    def test_networkx(self):
+        self.check(chain(False))
+
+    def test_compact(self):
+        self.check(chain(True))
+
+    def test_index_networkx(self):
+        self.check_index(chain(False))
+
+    def test_index_compact(self):
+        self.check_index(chain(True))
+
+    def test_random(self):
+        # Every way of answering a query agrees with a plain breadth-first
+        # search, including after the graph has changed
+        rng = random.Random(7)
+        E = cdg.EdgeKind
+        masks = [E.All, E.mask(E.Call), E.mask(E.Operand),
+                 E.mask(E.Operand, E.Memory), E.mask(E.Call, E.Meta)]
+
+        graphs = [cdg.build('synthetic', cdg.synthetic.functions(
+            40, 3, 3, calls=2, seed=5), compact) for compact in (False, True)]
+
+        def bfs(seeds, kinds, reverse, depth_limit):
+            adjacent = {}
+            for (u, v, attrs) in graphs[0].edges(data=True):
+                kind = attrs.get('kind')
+                if kinds == E.All or (kind is not None
+                                      and kinds & (1 << kind)):
+                    (u, v) = (v, u) if reverse else (u, v)
+                    adjacent.setdefault(u, []).append(v)
+
+            seen = set(seeds)
+            frontier = list(seen)
+            depth = 0
+            while frontier and not (depth_limit and depth >= depth_limit):
+                following = []
+                for u in frontier:
+                    for v in adjacent.get(u, ()):
+                        if v not in seen:
+                            seen.add(v)
+                            following.append(v)
+
+                frontier = following
+                depth += 1
+
+            return seen
+
+        def check():
+            names = sorted(graphs[0])
+            seed_sets = [rng.sample(names, rng.randint(1, 3))
+                         for _ in range(4)]
+
+            for kinds in masks:
+                for reverse in (False, True):
+                    for depth in (None, 1, 2, 4):
+                        want = [bfs(seeds, kinds, reverse, depth)
+                                for seeds in seed_sets]
+
+                        for graph in graphs:
+                            self.assertEqual(
+                                [cdg.query.reachable(graph, seeds, kinds,
+                                                     reverse,
+                                                     depth_limit=depth)
+                                 for seeds in seed_sets], want)
+                            self.assertEqual(cdg.query.reachable_sets(
+                                graph, seed_sets, kinds, reverse, depth),
+                                want)
+
+        check()
+
+        # Add edges of every kind (closing cycles) and remove others
+        names = sorted(graphs[0])
+        for _ in range(200):
+            (u, v) = rng.sample(names, 2)
+            if not graphs[0].has_edge(u, v):
+                kind = rng.randrange(4)
+                for graph in graphs:
+                    graph.add_edge(u, v, kind=kind)
+
+        for (u, v) in rng.sample(sorted(graphs[0].edges()), 100):
+            for graph in graphs:
+                graph.remove_edge(u, v)
+
+        check()
+
+        # Answers from reachability indexes
+        for graph in graphs:
+            cdg.reach.attach(graph)
+        check()
+
+    def test_index_size(self):
+        # A long chain with shortcuts and a few cycles, whose transitive
+        # closure is quadratic in its length
+        rng = random.Random(1)
+        length = 2000
+        values = ['v%d' % i for i in range(length)]
+        flows = [(i, i + 1) for i in range(length - 1)]
+        flows += [(i, rng.randrange(i, length)) for i in range(0, length, 3)]
+        flows += [(i, i - rng.randrange(1, 5)) for i in range(5, length, 50)]
+
+        fns = {
+            'f': {
+                'blocks': {'f::bb': dict((v, {}) for v in values)},
+                'flows': [{'from': values[i], 'to': values[j],
+                           'kind': 'operand'} for (i, j) in flows],
+            },
+        }
+
+        for compact in (False, True):
+            graph = cdg.build('test', fns.items(), compact)
+            for reverse in (False, True):
+                index = cdg.reach.Index(graph, cdg.EdgeKind.All, reverse)
+                self.assertLess(index.size(), 2 * length)
+
+                output = io.BytesIO()
+                index.write(output)
+                self.assertLess(len(output.getvalue()), 64 * length)
+                copy = cdg.reach.Index.read(graph, cdg.EdgeKind.All, reverse,
+                                            io.BytesIO(output.getvalue()))
+
+                for _ in range(20):
+                    seeds = rng.sample(values, 2)
+                    expected = cdg.query.reachable(graph, seeds,
+                                                   reverse=reverse)
+                    self.assertEqual(index.reachable(seeds), expected)
+                    self.assertEqual(copy.reachable(seeds), expected)
+
+    def test_kind_groups(self):
+        graph = chain(False)
+        groups = graph.kind_adjacency()
+        self.assertIsNotNone(groups)
+
+        calls = cdg.EdgeKind.mask(cdg.EdgeKind.Call)
+        operands = cdg.EdgeKind.mask(cdg.EdgeKind.Operand)
+
+        def check():
+            # The groups are updated in place, not thrown away and rebuilt
+            self.assertIs(graph.kind_adjacency(), groups)
+
+            fresh = cdg.Graph(graph)
+            fresh.group_kinds()
+            for reverse in (False, True):
+                self.assertEqual(graph.kind_adjacency(reverse),
+                                 fresh.kind_adjacency(reverse))
+
+        graph.add_edge('d', 'x', kind=cdg.EdgeKind.Call)
+        check()
+        self.assertEqual(cdg.query.reachable(graph, ['c'], calls), {'c'})
+        self.assertEqual(cdg.query.reachable(graph, ['d'], calls),
+                         {'c', 'd', 'x'})
+
+        # Changing an edge's kind moves it to another group
+        graph.add_edge('a', 'b', kind=cdg.EdgeKind.Operand)
+        check()
+        self.assertEqual(cdg.query.reachable(graph, ['c'], operands,
+                                             reverse=True), {'a', 'b', 'c'})
+
+        graph.add_edges_from([('b', 'd'), ('x', 'a', {'kind': 1})])
+        graph.remove_edges_from([('d', 'x'), ('a', 'nonexistent')])
+        check()
+
+        graph.remove_node('c')
+        graph.remove_nodes_from(['x', 'nonexistent'])
+        check()
+        self.assertEqual(cdg.query.reachable(graph, ['a'], operands),
+                         {'a', 'b'})
+
+    def test_condensed_networkx(self):
+        self.check_index(chain(False), cdg.condense.attach)
+
+    def test_condensed_compact(self):
+        self.check_index(chain(True), cdg.condense.attach)
+
+    def test_memo_networkx(self):
+        self.check_index(chain(False), cdg.memo.attach)
+
+    def test_memo_compact(self):
+        self.check_index(chain(True), cdg.memo.attach)
+
+    def test_memo(self):
+        for compact in (False, True):
+            graph = chain(compact)
+            cdg.memo.attach(graph)
+            memo = graph.memo
+
+            # A search to depth 2 answers the same query to depth 1, and one
+            # that runs out of nodes answers it to any depth
+            cdg.query.reachable(graph, ['a', 'nonexistent'], depth_limit=2)
+            self.assertEqual(memo.get(['a'], cdg.EdgeKind.All, False, 1),
+                             {'a', 'b'})
+            self.assertIsNone(memo.get(['a'], cdg.EdgeKind.All, False, 3))
+
+            cdg.query.reachable(graph, ['a'])
+            self.assertEqual(memo.get(['a'], cdg.EdgeKind.All, False, 3),
+                             {'a', 'b', 'c', 'd'})
+            self.assertEqual(len(memo), 1)
+
+            # Memos can be written out and read back
+            output = io.BytesIO()
+            memo.write(output)
+            copy = cdg.memo.Memo(graph)
+            copy.read(io.BytesIO(output.getvalue()))
+            self.assertEqual(copy.get(['a'], cdg.EdgeKind.All, False, None),
+                             {'a', 'b', 'c', 'd'})
+
+            # The least recently used results are evicted first
+            memo.budget = 2 * cdg.memo.EntrySize
+            cdg.query.reachable(graph, ['x'])
+            cdg.query.reachable(graph, ['a'])
+            cdg.query.reachable(graph, ['d'], reverse=True)
+            self.assertEqual(len(memo), 1)
+            self.assertIsNone(memo.get(['x'], cdg.EdgeKind.All, False, None))
+
+    def test_condense(self):
+        for compact in (False, True):
+            graph = chain(compact)
+            graph.add_edge('d', 'x', kind=cdg.EdgeKind.Operand)
+
+            condensation = cdg.condense.condense(graph)
+            self.assertEqual(len(condensation), 5)
+            [cycle] = condensation.cycles()
+            self.assertEqual(set(condensation.member_names(cycle)),
+                             {'c', 'd', 'x'})
+
+            # The cycle c -> d -> x -> c becomes one node within f::bb
+            condensed = condensation.to_graph()
+            scc = condensation.component_name(cycle)
+            self.assertEqual(set(condensed), {'f', 'f::bb', 'a', 'b', scc})
+            self.assertEqual(set(condensed.edges), {('a', 'b'), ('b', scc)})
+            self.assertEqual(condensed.nodes[scc]['members'], ['c', 'd', 'x'])
+            self.assertEqual(condensed.nodes[scc]['parent'], 'f::bb')
+            self.assertEqual(condensed.nodes['f::bb']['children'],
+                             {'a', 'b', scc})
+
+    def test_patterns(self):
+        fns = [('fn%d' % i, {
+            'arguments': {'fn%d::arg' % i: {}},
+            'blocks': {'fn%d::bb' % i: {'fn%d::bb::v' % i: {}}},
+        }) for i in range(12)]
+
+        for compact in (False, True):
+            graph = cdg.build('test', fns, compact)
+            match = cdg.names.index(graph).match
+
+            self.assertEqual(match('fn1*'), ['fn1', 'fn10', 'fn11'])
+            self.assertEqual(match('fn1?::*'), ['fn10::arg', 'fn10::bb',
+                                                'fn11::arg', 'fn11::bb'])
+            self.assertEqual(match('fn2::**'), ['fn2::arg', 'fn2::bb',
+                                                'fn2::bb::v'])
+            self.assertEqual(match('*::bb::v'),
+                             sorted('fn%d::bb::v' % i for i in range(12)))
+            self.assertEqual(match('nothing*'), [])
+
+            self.assertEqual(
+                cdg.names.expand(graph, ['fn3::arg', 'fn1?', 'missing']),
+                ['fn3::arg', 'fn10', 'fn11', 'missing'])
+
+            # Below the function level, patterns only select leaves
+            self.assertEqual(cdg.names.expand(graph, ['fn1?::*']),
+                             ['fn10::arg', 'fn11::arg'])
+            self.assertEqual(cdg.names.expand(graph, ['fn2::**']),
+                             ['fn2::arg', 'fn2::bb::v'])
+            self.assertEqual(cdg.names.expand(graph, ['fn2::bb']),
+                             ['fn2::bb'])
+
+            # Patterns only see nodes that are still in the graph
+            graph.remove_node('fn10')
+            self.assertEqual(cdg.names.index(graph).match('fn1*'),
+                             ['fn1', 'fn11'])
+
+    def test_pattern_round_trip(self):
+        # Filtering with a documented pattern gives a graph that can be
+        # saved and loaded again
+        for compact in (False, True):
+            graph = cdg.build('synthetic', cdg.synthetic.functions(
+                10, 3, 3), compact)
+
+            result = cdg.filters.apply('calls-to:fn1::*', graph)
+            self.assertEqual(result.nodes['fn1::arg0']['call'], 'target')
+
+            # Blocks are saved without attributes of their own
+            blocks = [n for n in result if 'parent' in result.nodes[n]
+                      and 'children' in result.nodes[n]]
+            self.assertGreater(len(blocks), 0)
+            result.nodes[blocks[0]]['note'] = 'not saved'
+
+            for filename in ('result.json', 'result.cdg'):
+                output = io.BytesIO()
+                result.save(output, filename)
+                output.seek(0)
+
+                loaded = cdg.load(output, filename)
+                self.assertEqual(set(loaded), set(result))
+                self.assertEqual(set(loaded.edges()), set(result.edges()))
+                self.assertEqual(loaded.nodes['fn1::arg0']['call'], 'target')
+
+    def test_pipeline(self):
+        # Excluding parents, filtering after paths, etc. gives the same
+        # result whether filters are fused or applied one at a time
+        pipelines = [
+            ['exclude:fn3::bb1', 'flows-from:fn3::bb*::v0'],
+            ['flows-to:fn0::bb0::v*', 'exclude:fn0,fn1::bb0',
+             'flows-from:fn1::*:3'],
+            ['calls-to:fn0::*', 'exclude:fn0::bb1',
+             'flows-to[call,operand]:fn0::*'],
+            ['path:fn5::*,fn0::*:3', 'flows-from:fn5::*', 'exclude:fn0::bb0'],
+            ['path:fn5::*,fn0::*:3', 'path:fn5::*,fn0::*:2'],
+        ]
+
+        for compact in (False, True):
+            graph = cdg.build('synthetic', cdg.synthetic.functions(
+                30, 3, 3, seed=1), compact)
+
+            for specs in pipelines:
+                fused = cdg.filters.apply_all(specs, graph)
+                one_by_one = functools.reduce(
+                    lambda g, spec: cdg.filters.apply(spec, g), specs, graph)
+
+                self.assertGreater(len(fused), 0)
+                self.assertEqual(set(fused), set(one_by_one))
+                self.assertEqual(set(fused.edges()), set(one_by_one.edges()))
+                for n in fused:
+                    self.assertEqual(dict(fused.nodes[n]),
+                                     dict(one_by_one.nodes[n]))
+
+    def test_paths(self):
+        flows = [('a', 'b', 'operand'), ('b', 'd', 'operand'),
+                 ('a', 'c', 'operand'), ('c', 'd', 'memory'),
+                 ('a', 'e', 'operand'), ('e', 'f', 'operand'),
+                 ('f', 'd', 'operand'), ('d', 'a', 'call')]
+        fns = {'f': {
+            'blocks': {'f::bb': dict((n, {}) for n in 'abcdef')},
+            'flows': [{'from': u, 'to': v, 'kind': k} for (u, v, k) in flows],
+        }}
+        operands = cdg.EdgeKind.mask(cdg.EdgeKind.Operand)
+
+        for compact in (False, True):
+            graph = cdg.build('test', fns.items(), compact)
+            paths = lambda *args: cdg.query.shortest_paths(graph, *args)
+
+            self.assertEqual(paths(['a'], ['d']), [['a', 'b', 'd']])
+            self.assertEqual(paths(['a'], ['d'], cdg.EdgeKind.All, 5),
+                             [['a', 'b', 'd'], ['a', 'c', 'd'],
+                              ['a', 'e', 'f', 'd']])
+            self.assertEqual(paths(['a', 'e'], ['d'], operands, 2),
+                             [['a', 'b', 'd'], ['e', 'f', 'd']])
+            self.assertEqual(paths(['d'], ['b'], operands), [])
+
+            # Only the edges along the paths are kept
+            result = cdg.filters.apply('path:a,d:2', graph)
+            self.assertEqual(set(result), {'f', 'f::bb', 'a', 'b', 'c', 'd'})
+            self.assertEqual(set(result.edges()), {
+                ('a', 'b'), ('b', 'd'), ('a', 'c'), ('c', 'd')})
+            self.assertEqual(result.nodes['a']['path'], 'source')
+            self.assertEqual(result.nodes['d']['path'], 'target')
+
+            result = cdg.filters.apply('path[operand]:a,d', graph)
+            self.assertEqual(set(result.edges()), {('a', 'b'), ('b', 'd')})
+
+    def test_stats(self):
+        for compact in (False, True):
+            graph = chain(compact)
+            collector = cdg.stats.subscribe(cdg.stats.Collector())
+            try:
+                cdg.filters.apply('flows-from:b:2', graph)
+            finally:
+                cdg.stats.unsubscribe(collector)
+
+            records = dict((r['path'], r) for r in collector.records)
+            self.assertEqual(set(records), {
+                'filter', 'filter/reachable', 'filter/subgraph'})
+
+            # b -> c -> d, scanning b's and c's out-edges but not d's
+            traversal = records['filter/reachable']
+            self.assertEqual(traversal['nodes_visited'], 3)
+            self.assertEqual(traversal['edges_scanned'], 2)
+
+            self.assertEqual(records['filter']['spec'], 'flows-from:b:2')
+            self.assertEqual(records['filter']['nodes_visited'], 3)
+            self.assertEqual(records['filter']['nodes'], 5)
+
+            # Time is only reported from phases that ran without tracing
+            self.assertGreaterEqual(records['filter']['seconds'], 0)
+            self.assertIsNone(records['filter']['peak_bytes'])
+
+    def test_traced_stats(self):
+        graph = chain(False)
+        collector = cdg.stats.subscribe(cdg.stats.Collector())
+        tracemalloc.start()
+        try:
+            cdg.filters.apply('flows-from:b:2', graph)
+        finally:
+            tracemalloc.stop()
+            cdg.stats.unsubscribe(collector)
+
+        for r in collector.records:
+            self.assertIsNone(r['seconds'])
+            self.assertGreaterEqual(r['peak_bytes'], 0)
+
+        output = io.StringIO()
+        collector.summary(output)
+        rows = dict((line.split()[0], line.split()[1:3])
+                    for line in output.getvalue().splitlines()[1:])
+        self.assertEqual(rows['filter'][0], '-')
+        self.assertNotEqual(rows['filter'][1], '-')
@@ -0,0 +1,97 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from unittest import TestCase
+
+import cdg
+import cdg.render
+import cdg.synthetic
+
+
+class TestRender(TestCase):
+    def test_partition(self):
+        graph = cdg.build('synthetic', cdg.synthetic.functions(20, 2, 2))
+        leaves = sorted(n for n in graph if 'children' not in graph.nodes[n])
+
+        for by in cdg.render.Schemes:
+            for (max_nodes, summarise) in ((12, False), (3, False), (3, True)):
+                parts = cdg.render.partition(graph, by, max_nodes, summarise)
+                self.assertTrue(all(len(p) <= max_nodes for p in parts))
+
+                # Every node is drawn in exactly one part
+                placed = [n for p in parts for n in p.nodes]
+                placed += [n for p in parts
+                           for members in p.summaries.values()
+                           for n in members]
+                self.assertEqual(sorted(placed), leaves)
+
+    def test_render(self):
+        graph = cdg.build('synthetic', cdg.synthetic.functions(20, 2, 2))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            parts = cdg.render.render(graph, tmp, max_nodes=12, layout=False)
+            self.assertGreater(len(parts), 1)
+
+            # Each edge is drawn once, or twice (to and from stubs) if it
+            # crosses between parts
+            place = parts[0].place
+            crossing = sum(1 for (u, v) in graph.edges()
+                           if place[u][0] != place[v][0])
+            drawn = 0
+            for p in parts:
+                with open(os.path.join(tmp, p.filename('dot'))) as f:
+                    drawn += f.read().count(' -> ')
+
+            self.assertGreater(crossing, 0)
+            self.assertEqual(drawn, graph.number_of_edges() + crossing)
+
+            with open(os.path.join(tmp, 'index.html')) as f:
+                self.assertIn(parts[-1].filename('dot'), f.read())
+
+
+class TestDot(TestCase):
+    def test_round_trip(self):
+        graph = cdg.build('synthetic', cdg.synthetic.functions(20, 3, 3))
+        leaves = set(n for n in graph if 'children' not in graph.nodes[n])
+        clusters = set(graph) - leaves
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'graph.dot')
+            graph.to_dot(filename)
+
+            with open(filename) as f:
+                text = f.read()
+
+        self.assertTrue(text.endswith('}\n'))
+        self.assertEqual(text.count(' -> '), graph.number_of_edges())
+
+        try:
+            import pygraphviz
+        except ImportError:
+            self.skipTest('pygraphviz not installed')
+
+        parsed = pygraphviz.AGraph(string=text)
+        self.assertEqual(set(parsed.nodes()), leaves)
+        self.assertEqual(set(parsed.edges()), set(graph.edges()))
+
+        subgraphs = set()
+        pending = list(parsed.subgraphs())
+        while pending:
+            s = pending.pop()
+            subgraphs.add(s.name[len('cluster_'):])
+            pending += s.subgraphs()
+
+        self.assertEqual(subgraphs, clusters)
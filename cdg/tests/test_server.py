@@ -0,0 +1,125 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import cdg
+import cdg.filters
+import cdg.server
+import cdg.synthetic
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.graph = cdg.build('synthetic',
+                               cdg.synthetic.functions(100, 4, 4))
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp.name, 'graph.sock')
+        self.executor = concurrent.futures.ThreadPoolExecutor(4)
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+        self.server = self.run_async(cdg.server.start(
+            self.graph, self.address, self.executor))
+
+    def tearDown(self):
+        self.server.close()
+        self.run_async(self.server.wait_closed())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown()
+        self.tmp.cleanup()
+
+    def run_async(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def query(self, specs, fmt='json'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            (dimensions, response) = cdg.server.request(
+                self.address, 'filter', specs, fmt)
+            data = response.read()
+            result = cdg.load(io.BytesIO(data), 'result.' + fmt, cache=False)
+
+        return (dimensions, result)
+
+    def expected(self, specs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = cdg.filters.apply_all(specs, self.graph)
+
+        output = io.BytesIO()
+        result.save(output, 'result.json')
+        output.seek(0)
+        return (result.dimensions(),
+                cdg.load(output, 'result.json', cache=False))
+
+    def check(self, specs):
+        (dimensions, result) = self.query(specs)
+        (want_dimensions, want) = self.expected(specs)
+
+        self.assertEqual(dimensions, want_dimensions)
+        self.assertEqual(set(result), set(want))
+        self.assertEqual(set(result.edges()), set(want.edges()))
+
+    def test_query(self):
+        self.check(['flows-from:fn1::bb0::v0'])
+        self.check(['calls-to:fn0', 'exclude:fn0::bb1'])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            (dimensions, response) = cdg.server.request(
+                self.address, 'dimensions')
+        self.assertEqual(dimensions, self.graph.dimensions())
+        response.read()
+
+    def test_filter_error(self):
+        with self.assertRaises(cdg.filters.FilterError) as e:
+            cdg.server.request(self.address, 'filter', ['flows-to[bogus]:x'])
+        self.assertEqual(e.exception.filter_spec, 'flows-to[bogus]:x')
+
+        with self.assertRaises(ValueError):
+            cdg.server.request(self.address, 'bogus')
+
+    def test_concurrent(self):
+        specs = [['flows-from:fn%d::bb0::v0' % i] for i in range(16)]
+        specs += [['calls-to:fn%d' % i] for i in range(16)]
+
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(self.query, specs))
+
+        for (s, (dimensions, result)) in zip(specs, results):
+            (want_dimensions, want) = self.expected(s)
+            self.assertEqual(dimensions, want_dimensions)
+            self.assertEqual(set(result), set(want))
+
+    def test_failure(self):
+        # A result that can't be written out, after its headers are sent
+        self.graph.nodes['fn99::bb3::v3']['bad'] = object()
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            (_, response) = cdg.server.request(self.address, 'filter', [],
+                                               'json')
+            with self.assertRaises(ValueError):
+                response.read()
+
+        self.assertIn('TypeError', stderr.getvalue())
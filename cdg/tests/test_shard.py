@@ -0,0 +1,111 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+import cdg
+import cdg.filters
+import cdg.query
+import cdg.shard
+import cdg.synthetic
+
+
+class TestShard(TestCase):
+    def test_reachable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'graph.json')
+            cdg.synthetic.write(source, 30, 2, 2, seed=2)
+            with open(source, 'rb') as f:
+                graph = cdg.load(f, source, cache=False)
+
+            calls = cdg.EdgeKind.mask(cdg.EdgeKind.Call)
+            seeds = ['fn0', 'fn3::bb1::v0', 'fn7::bb0::v1']
+
+            for shards in (1, 5):
+                sharded = cdg.shard.split(
+                    [source], os.path.join(tmp, str(shards)), shards)
+
+                for (kinds, reverse, depth) in [
+                        (cdg.EdgeKind.All, False, None),
+                        (cdg.EdgeKind.All, True, 2),
+                        (calls, True, None)]:
+                    for seed in seeds:
+                        self.assertEqual(
+                            set(sharded.reachable([seed], kinds, reverse,
+                                                  depth)),
+                            cdg.query.reachable(graph, [seed], kinds, reverse,
+                                                depth_limit=depth))
+
+            # Results are written without building the whole graph
+            output = os.path.join(tmp, 'filtered.json')
+            with open(output, 'wb') as f, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                (nodes, edges) = sharded.apply('flows-from:fn3::bb1::v0', f,
+                                               output)
+
+            with open(output, 'rb') as f:
+                result = cdg.load(f, output, cache=False)
+
+            expected = cdg.query.reachable(graph, ['fn3::bb1::v0'])
+            self.assertTrue(expected.issubset(result))
+            self.assertEqual(result.number_of_edges(), edges)
+
+    def test_filter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'graph.json')
+            cdg.synthetic.write(source, 30, 2, 2, seed=2)
+            with open(source, 'rb') as f:
+                graph = cdg.load(f, source, cache=False)
+
+            sharded = cdg.shard.split([source], os.path.join(tmp, 'shards'),
+                                      4)
+
+            def load(filename):
+                with open(filename, 'rb') as f:
+                    return cdg.load(f, filename, cache=False)
+
+            # Arguments that have ghosts in shards after their home shards,
+            # which mustn't write anything out for their functions
+            seeds = []
+            for n in sorted(n for n in graph if '::arg' in n):
+                home = sharded.locate([n])[n]
+                if any(n in sharded.shard(s)[0]
+                       for s in range(home + 1, len(sharded))):
+                    seeds.append(n)
+            self.assertTrue(seeds)
+
+            specs = ['calls-to:%s' % n for n in seeds]
+            specs += ['flows-from:fn3::bb1::v0', 'flows-to:fn2::bb0::v0:2']
+
+            for spec in specs:
+                output = os.path.join(tmp, 'sharded.json')
+                expected = os.path.join(tmp, 'expected.json')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    with open(output, 'wb') as f:
+                        (nodes, edges) = sharded.apply(spec, f, output)
+
+                    with open(expected, 'wb') as f:
+                        cdg.filters.apply(spec, graph).save(f, expected)
+
+                (result, want) = (load(output), load(expected))
+                self.assertEqual((nodes, edges), want.dimensions())
+                self.assertEqual(set(result), set(want))
+                self.assertEqual(set(result.edges()), set(want.edges()))
+                for n in want:
+                    self.assertEqual(dict(result.nodes[n]),
+                                     dict(want.nodes[n]))
@@ -0,0 +1,80 @@
+# Copyright 2017 Jonathan Anderson
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+from unittest import TestCase
+
+import cdg
+
+
+def chain(compact):
+    '''
+    a -> b -> c -> d -> e and a -> x -> e, plus p -> q -> r
+    '''
+    names = ('a', 'b', 'c', 'd', 'e', 'x', 'p', 'q', 'r')
+    fns = {
+        'f': {
+            'blocks': {'f::bb': dict((n, {}) for n in names)},
+            'flows': [
+                {'from': 'a', 'to': 'b', 'kind': 'operand'},
+                {'from': 'b', 'to': 'c', 'kind': 'memory'},
+                {'from': 'c', 'to': 'd', 'kind': 'operand'},
+                {'from': 'd', 'to': 'e', 'kind': 'operand'},
+                {'from': 'a', 'to': 'x', 'kind': 'operand'},
+                {'from': 'x', 'to': 'e', 'kind': 'operand'},
+                {'from': 'p', 'to': 'q', 'kind': 'operand'},
+                {'from': 'q', 'to': 'r', 'kind': 'memory'},
+            ],
+        },
+    }
+
+    return cdg.build('test', fns.items(), compact)
+
+
+class TestSimplify(TestCase):
+    def check(self, graph, copy):
+        s = graph.simplified(copy=copy)
+
+        self.assertEqual(set(s), {'f', 'f::bb', 'a', 'e', 'p', 'r'})
+        self.assertEqual(s.nodes['f::bb']['children'], {'a', 'e', 'p', 'r'})
+
+        # The shorter of two parallel chains wins
+        self.assertEqual(dict(s.edges[('a', 'e')]),
+                         {'kind': cdg.EdgeKind.Operand, 'hops': 2})
+
+        self.assertEqual(dict(s.edges[('p', 'r')]),
+                         {'kind': cdg.EdgeKind.Memory, 'hops': 2})
+
+    def test_save(self):
+        # Saving keeps the 'hops' of compressed edges
+        for compact in (False, True):
+            s = chain(compact).simplified()
+
+            for filename in ('test.cdg', 'test.json', 'test.cdgc'):
+                output = io.BytesIO()
+                s.save(output, filename)
+                output.seek(0)
+
+                loaded = cdg.load(output, filename, compact=compact)
+                self.assertEqual(dict(loaded.edges[('a', 'e')]),
+                                 {'kind': cdg.EdgeKind.Operand, 'hops': 2})
+                self.assertEqual(set(loaded.edges()), set(s.edges()))
+
+    def test_networkx(self):
+        self.check(chain(False), copy=False)
+        self.check(chain(False), copy=True)
+
+    def test_compact(self):
+        self.check(chain(True), copy=False)
+        self.check(chain(True), copy=True)
@@ -26,7 +26,10 @@ config = {
     'author_email': 'jonathan.anderson@mun.ca',
     'url': 'https://github.com/musec/py-cdg',
     'download_url': 'https://github.com/musec/py-cdg',
-    'install_requires': ['networkx', 'pygraphviz'],
+    'install_requires': ['networkx'],
+    'extras_require': {
+        'agraph': ['pygraphviz'],
+    },
     'packages': ['cdg'],
     'scripts': ['bin/cdg'],
     'setup_requires': ['setuptools_scm'],